@@ -64,8 +64,13 @@ class APIClient:
             # Nunca debe romper el flujo por un fallo de caché
             pass
     
-    def _make_request(self, method: str, endpoint: str, data: Optional[Dict] = None, params: Optional[Dict] = None) -> Union[Dict, List]:
-        """Realiza una petición HTTP con manejo de errores y reintentos"""
+    def _make_request(self, method: str, endpoint: str, data: Optional[Dict] = None, params: Optional[Dict] = None,
+                      headers_respuesta: Optional[Dict] = None) -> Union[Dict, List]:
+        """
+        Realiza una petición HTTP con manejo de errores y reintentos.
+        Si se pasa headers_respuesta (dict), se llena con los headers de la respuesta exitosa
+        (nombres en minúsculas).
+        """
         url = self.config.get_endpoint_url(endpoint)
         
         for attempt in range(self.config.max_retries + 1):
@@ -75,6 +80,8 @@ class APIClient:
                 response = self.session.request(method=method, url=url, json=data, params=params)
                 
                 if 200 <= response.status_code < 300:
+                    if headers_respuesta is not None:
+                        headers_respuesta.update({k.lower(): v for k, v in response.headers.items()})
                     if not response.content:
                         return {}
                     # Intentar parsear JSON de forma segura
@@ -119,6 +126,8 @@ class APIClient:
                             retry_response = self.session.request(method=method, url=retry_url, json=data, params=params)
                             
                             if 200 <= retry_response.status_code < 300:
+                                if headers_respuesta is not None:
+                                    headers_respuesta.update({k.lower(): v for k, v in retry_response.headers.items()})
                                 if not retry_response.content:
                                     return {}
                                 try:
@@ -473,8 +482,13 @@ class APIClient:
         skip: int = 0,
         limit: int = 100,
         desde: Optional[Union[str, date]] = None,
+        cursor: Optional[str] = None,
+        headers_respuesta: Optional[Dict] = None,
     ) -> List[Dict]:
-        """Lista tarjetas, opcionalmente filtradas por empleado, estado y fecha (desde)."""
+        """
+        Lista tarjetas, opcionalmente filtradas por empleado, estado y fecha (desde).
+        cursor: valor de X-Next-Cursor de la página anterior (reemplaza a skip).
+        """
         if empleado_id:
             # Si se especifica empleado, usar endpoint específico
             if isinstance(desde, date):
@@ -482,7 +496,10 @@ class APIClient:
             params = {'estado': estado, 'skip': skip, 'limit': limit}
             if desde:
                 params['desde'] = desde
-            return self._make_request('GET', f'/empleados/{empleado_id}/tarjetas/', params=params)
+            if cursor:
+                params['cursor'] = cursor
+            return self._make_request('GET', f'/empleados/{empleado_id}/tarjetas/', params=params,
+                                      headers_respuesta=headers_respuesta)
         else:
             # Si no se especifica empleado, usar endpoint general
             if isinstance(desde, date):
@@ -490,7 +507,28 @@ class APIClient:
             params = {'estado': estado, 'skip': skip, 'limit': limit}
             if desde:
                 params['desde'] = desde
-            return self._make_request('GET', '/tarjetas/', params=params)
+            if cursor:
+                params['cursor'] = cursor
+            return self._make_request('GET', '/tarjetas/', params=params, headers_respuesta=headers_respuesta)
+
+    def list_tarjetas_todas(
+        self,
+        empleado_id: Optional[str] = None,
+        estado: str = 'activas',
+        desde: Optional[Union[str, date]] = None,
+        tam_pagina: int = 500,
+    ) -> List[Dict]:
+        """Lista todas las tarjetas recorriendo las páginas por cursor (X-Next-Cursor)."""
+        tarjetas: List[Dict] = []
+        cursor = None
+        while True:
+            headers: Dict = {}
+            pagina = self.list_tarjetas(empleado_id=empleado_id, estado=estado, limit=tam_pagina,
+                                        desde=desde, cursor=cursor, headers_respuesta=headers) or []
+            tarjetas.extend(pagina)
+            cursor = headers.get('x-next-cursor')
+            if not cursor or not pagina:
+                return tarjetas
     
     def list_targetas(self, empleado_id: Optional[str] = None, estado: str = 'activas', skip: int = 0, limit: int = 100) -> List[Dict]:
         """Alias para list_tarjetas (compatibilidad)"""
@@ -505,9 +543,10 @@ class APIClient:
         """Obtiene una tarjeta por código"""
         return self._make_request('GET', f'/tarjetas/{codigo}')
 
-    def search_tarjetas(self, termino: str, empleado_id: Optional[str] = None, estado: str = 'activas') -> List[Dict]:
-        """Busca tarjetas por término (nombre/apellido)"""
-        params = {'termino': termino, 'estado': estado}
+    def search_tarjetas(self, termino: str, empleado_id: Optional[str] = None, estado: str = 'activas',
+                        limite: int = 50) -> List[Dict]:
+        """Busca tarjetas por término (nombre, apellido, identificación o teléfono), ordenadas por similitud"""
+        params = {'termino': termino, 'estado': estado, 'limite': limite}
         if empleado_id:
             params['empleado_id'] = empleado_id
         return self._make_request('GET', '/tarjetas/buscar', params=params)
@@ -599,6 +638,16 @@ class APIClient:
         """Obtiene el resumen de una tarjeta por código"""
         return self._make_request('GET', f'/tarjetas/{tarjeta_codigo}/resumen')
 
+    def get_tarjetas_resumenes(self, codigos: Optional[List[str]] = None, empleado_id: Optional[str] = None,
+                               estado: Optional[str] = 'activas') -> List[Dict]:
+        """Resúmenes de muchas tarjetas en un solo llamado (por códigos o por empleado + estado)"""
+        payload = {'estado': estado}
+        if codigos is not None:
+            payload['codigos'] = [str(c) for c in codigos]
+        else:
+            payload['empleado_identificacion'] = empleado_id
+        return self._make_request('POST', '/tarjetas/resumenes', data=payload) or []
+
     # --- Permisos por empleado (columnas descargar/subir/fecha_accion) ---
     def get_empleado_permissions(self, empleado_identificacion: str) -> Dict:
         """Obtiene descargar, subir y fecha_accion para un empleado"""
@@ -719,6 +768,15 @@ class APIClient:
             url += f"?timezone={urllib.parse.quote(timezone_name)}"
         return self._make_request('GET', url)
 
+    def count_tarjetas_sin_abono_dia(self, empleado_id: str, fecha: Union[str, date], timezone_name: Optional[str] = None) -> int:
+        if isinstance(fecha, date):
+            fecha = fecha.isoformat()
+        url = f'/empleados/{empleado_id}/tarjetas-sin-abono/{fecha}/conteo'
+        if timezone_name:
+            import urllib.parse
+            url += f"?timezone={urllib.parse.quote(timezone_name)}"
+        return int((self._make_request('GET', url) or {}).get('total', 0))
+
     # --- Métodos para Clientes ---
 
     def get_cliente(self, identificacion: str) -> Dict:
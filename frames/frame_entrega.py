@@ -493,7 +493,7 @@ class FrameEntrega(ttk.Frame):
                             desde = hoy - timedelta(days=30)
                         except Exception:
                             desde = None
-                    tarjetas_loc = self.api_client.list_tarjetas(empleado_id=empleado_id, estado=estado, limit=200, desde=desde)
+                    tarjetas_loc = self.api_client.list_tarjetas_todas(empleado_id=empleado_id, estado=estado, desde=desde)
                     logger.info(f"API retornó {len(tarjetas_loc)} tarjetas")
                 except Exception as _e:
                     logger.error(f"Error al consultar tarjetas: {_e}")
@@ -813,18 +813,31 @@ class FrameEntrega(ttk.Frame):
             except Exception:
                 return cod, None
 
+        def _guardar(c, res):
+            self._resumen_cache_por_tarjeta[c] = res
+            self._merge_tarjeta_con_resumen(c, res)
+
         def _worker():
             try:
-                # Descarga paralela con 8 hilos
-                with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
-                    future_to_cod = {executor.submit(_fetch_one, c): c for c in pendientes}
-                    for future in concurrent.futures.as_completed(future_to_cod):
-                        c, res = future.result()
-                        if res:
-                            self._resumen_cache_por_tarjeta[c] = res
-                            self._merge_tarjeta_con_resumen(c, res)
+                # Un solo llamado por bloque de tarjetas (POST /tarjetas/resumenes)
+                for i in range(0, len(pendientes), 500):
+                    for res in self.api_client.get_tarjetas_resumenes(codigos=pendientes[i:i + 500]):
+                        c = str(res.get('codigo_tarjeta') or '')
+                        if c:
+                            _guardar(c, res)
             except Exception as e:
-                print(f"Error en prefetch paralelo: {e}")
+                # Servidor sin el endpoint de lote: descarga paralela tarjeta por tarjeta
+                print(f"Resúmenes en lote no disponibles ({e}); descargando uno por uno")
+                try:
+                    faltantes = [c for c in pendientes if c not in self._resumen_cache_por_tarjeta]
+                    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+                        future_to_cod = {executor.submit(_fetch_one, c): c for c in faltantes}
+                        for future in concurrent.futures.as_completed(future_to_cod):
+                            c, res = future.result()
+                            if res:
+                                _guardar(c, res)
+                except Exception as e2:
+                    print(f"Error en prefetch paralelo: {e2}")
             finally:
                 # Al terminar, restaurar cursor y aplicar estilos
                 def _finish():
@@ -1,6 +1,10 @@
 from .connection_pool import DatabasePool
+from .async_pool import AsyncDatabasePool
+from .fechas import limites_dia_utc
+from .saldos_db import expr_saldo, expr_total_abonado
+from .caja_db import guardar_caja_dia_async
 import logging
-from datetime import datetime
+from datetime import date, datetime
 from typing import List, Dict, Optional, Tuple
 from decimal import Decimal
 
@@ -23,26 +27,52 @@ def obtener_abonos_tarjeta(tarjeta_codigo: str) -> List[Tuple]:
         logger.error(f"Error al obtener abonos: {e}")
         return []
 
+_SQL_ABONO_POR_ID = '''
+    SELECT id, tarjeta_codigo, fecha, monto, indice_orden, metodo_pago
+    FROM abonos
+    WHERE id = %s
+'''
+
+_SQL_SIGUIENTE_INDICE = '''
+    SELECT COALESCE(MAX(indice_orden), 0) + 1
+    FROM abonos
+    WHERE tarjeta_codigo = %s
+'''
+
+def _abono_a_dict(result) -> Dict:
+    return {
+        "id": result[0],
+        "tarjeta_codigo": result[1],
+        "fecha": result[2],
+        "monto": result[3],
+        "indice_orden": result[4],
+        "metodo_pago": result[5]
+    }
+
+def _insertar_abono_sql(tarjeta_codigo: str, monto: Decimal, indice_orden: int, metodo_pago: str,
+                        fecha: Optional[datetime]) -> Tuple[str, tuple]:
+    if fecha:
+        query = '''
+            INSERT INTO abonos (tarjeta_codigo, fecha, monto, indice_orden, metodo_pago)
+            VALUES (%s, %s, %s, %s, %s)
+            RETURNING id
+        '''
+        return query, (tarjeta_codigo, fecha, monto, indice_orden, metodo_pago)
+    query = '''
+        INSERT INTO abonos (tarjeta_codigo, fecha, monto, indice_orden, metodo_pago)
+        VALUES (%s, NOW(), %s, %s, %s)
+        RETURNING id
+    '''
+    return query, (tarjeta_codigo, monto, indice_orden, metodo_pago)
+
 def obtener_abono_por_id(abono_id: int) -> Optional[Dict]:
     """Obtiene un abono específico por su ID"""
     try:
         with DatabasePool.get_cursor() as cursor:
-            query = '''
-                SELECT id, tarjeta_codigo, fecha, monto, indice_orden, metodo_pago
-                FROM abonos
-                WHERE id = %s
-            '''
-            cursor.execute(query, (abono_id,))
+            cursor.execute(_SQL_ABONO_POR_ID, (abono_id,))
             result = cursor.fetchone()
             if result:
-                return {
-                    "id": result[0],
-                    "tarjeta_codigo": result[1],
-                    "fecha": result[2],
-                    "monto": result[3],
-                    "indice_orden": result[4],
-                    "metodo_pago": result[5]
-                }
+                return _abono_a_dict(result)
             return None
     except Exception as e:
         logger.error(f"Error al obtener abono por ID: {e}")
@@ -56,74 +86,84 @@ def registrar_abono(tarjeta_codigo: str, monto: Decimal, metodo_pago: str = 'efe
     try:
         with DatabasePool.get_cursor() as cursor:
             # Obtener el siguiente índice de orden
-            cursor.execute('''
-                SELECT COALESCE(MAX(indice_orden), 0) + 1
-                FROM abonos
-                WHERE tarjeta_codigo = %s
-            ''', (tarjeta_codigo,))
+            cursor.execute(_SQL_SIGUIENTE_INDICE, (tarjeta_codigo,))
             indice_orden = cursor.fetchone()[0]
             
             # Insertar el abono
-            if fecha:
-                query = '''
-                    INSERT INTO abonos (tarjeta_codigo, fecha, monto, indice_orden, metodo_pago)
-                    VALUES (%s, %s, %s, %s, %s)
-                    RETURNING id
-                '''
-                cursor.execute(query, (tarjeta_codigo, fecha, monto, indice_orden, metodo_pago))
-            else:
-                query = '''
-                    INSERT INTO abonos (tarjeta_codigo, fecha, monto, indice_orden, metodo_pago)
-                    VALUES (%s, NOW(), %s, %s, %s)
-                    RETURNING id
-                '''
-                cursor.execute(query, (tarjeta_codigo, monto, indice_orden, metodo_pago))
-            
+            cursor.execute(*_insertar_abono_sql(tarjeta_codigo, monto, indice_orden, metodo_pago, fecha))
             return cursor.fetchone()[0]
             
     except Exception as e:
         logger.error(f"Error al registrar abono: {e}")
         return None
 
+async def _insertar_abono_async(cursor, tarjeta_codigo: str, monto: Decimal, metodo_pago: str,
+                                fecha: Optional[datetime]) -> Dict:
+    await cursor.execute(_SQL_SIGUIENTE_INDICE, (tarjeta_codigo,))
+    indice_orden = (await cursor.fetchone())[0]
+    await cursor.execute(*_insertar_abono_sql(tarjeta_codigo, monto, indice_orden, metodo_pago, fecha))
+    abono_id = (await cursor.fetchone())[0]
+    await cursor.execute(_SQL_ABONO_POR_ID, (abono_id,))
+    return _abono_a_dict(await cursor.fetchone())
+
+async def registrar_abono_async(tarjeta_codigo: str, monto: Decimal, metodo_pago: str = 'efectivo',
+                                fecha: Optional[datetime] = None) -> Optional[Dict]:
+    """
+    Versión asíncrona de registrar_abono: inserta y devuelve el abono creado
+    (mismo dict que obtener_abono_por_id) en una sola transacción.
+    """
+    try:
+        async with AsyncDatabasePool.get_cursor() as cursor:
+            return await _insertar_abono_async(cursor, tarjeta_codigo, monto, metodo_pago, fecha)
+    except Exception as e:
+        logger.error(f"Error al registrar abono (async): {e}")
+        return None
+
+async def registrar_abono_con_caja_async(tarjeta_codigo: str, monto: Decimal, metodo_pago: str,
+                                         fecha: Optional[datetime], fecha_caja: date,
+                                         timezone_name: Optional[str] = None) -> Optional[Dict]:
+    """
+    Inserta el abono y recalcula la caja del día `fecha_caja` del empleado dueño
+    de la tarjeta en UNA transacción del pool asíncrono: si el recálculo falla
+    se revierte también el abono. Retorna el abono o None si hubo error.
+    """
+    try:
+        async with AsyncDatabasePool.get_cursor() as cursor:
+            abono = await _insertar_abono_async(cursor, tarjeta_codigo, monto, metodo_pago, fecha)
+            await cursor.execute("SELECT empleado_identificacion FROM tarjetas WHERE codigo = %s", (tarjeta_codigo,))
+            fila = await cursor.fetchone()
+            if fila and fila[0]:
+                await guardar_caja_dia_async(cursor, fila[0], fecha_caja, timezone_name)
+            return abono
+    except Exception as e:
+        logger.error(f"Error al registrar abono con caja (async): {e}")
+        return None
+
 def obtener_total_abonado(tarjeta_codigo: str) -> Decimal:
-    """Calcula el total abonado en una tarjeta"""
+    """Total abonado en una tarjeta (columna denormalizada tarjetas.total_abonado)"""
     try:
         with DatabasePool.get_cursor() as cursor:
-            query = '''
-                SELECT COALESCE(SUM(monto), 0)
-                FROM abonos
-                WHERE tarjeta_codigo = %s
-            '''
-            cursor.execute(query, (tarjeta_codigo,))
-            return cursor.fetchone()[0]
+            cursor.execute(
+                f"SELECT {expr_total_abonado('t')} FROM tarjetas t WHERE t.codigo = %s",
+                (tarjeta_codigo,),
+            )
+            row = cursor.fetchone()
+            return row[0] if row else Decimal('0')
             
     except Exception as e:
         logger.error(f"Error al calcular total abonado: {e}")
         return Decimal('0')
 
 def obtener_saldo_tarjeta(tarjeta_codigo: str) -> Optional[Decimal]:
-    """Calcula el saldo pendiente de una tarjeta (monto total - total abonado)"""
+    """Calcula el saldo pendiente de una tarjeta (monto total con interés - total abonado)"""
     try:
-        from .tarjetas_db import obtener_tarjeta_por_codigo
-        
-        # Obtener la tarjeta para calcular el monto total
-        tarjeta = obtener_tarjeta_por_codigo(tarjeta_codigo)
-        if not tarjeta:
-            return None
-            
-        monto = Decimal(str(tarjeta.get('monto', 0)))
-        interes = Decimal(str(tarjeta.get('interes', 0)))
-        
-        # Calcular monto total con interés
-        monto_total = monto * (1 + interes / 100)
-        
-        # Obtener total abonado
-        total_abonado = obtener_total_abonado(tarjeta_codigo)
-        
-        # Calcular saldo pendiente
-        saldo_pendiente = monto_total - total_abonado
-        
-        return saldo_pendiente
+        with DatabasePool.get_cursor() as cursor:
+            cursor.execute(
+                f"SELECT {expr_saldo('t')} FROM tarjetas t WHERE t.codigo = %s",
+                (tarjeta_codigo,),
+            )
+            row = cursor.fetchone()
+            return row[0] if row else None
         
     except Exception as e:
         logger.error(f"Error al calcular saldo de tarjeta: {e}")
@@ -209,7 +249,9 @@ def obtener_abonos_por_fecha(
     fecha: datetime,
     empleado_identificacion: Optional[str] = None
 ) -> List[Tuple]:
-    """Obtiene abonos por fecha y empleado opcional"""
+    """Obtiene abonos por fecha (día UTC) y empleado opcional"""
+    dia = fecha.date() if isinstance(fecha, datetime) else fecha
+    inicio, fin = limites_dia_utc(dia)
     try:
         with DatabasePool.get_cursor() as cursor:
             query = '''
@@ -218,12 +260,12 @@ def obtener_abonos_por_fecha(
                 FROM abonos a
                 JOIN tarjetas t ON a.tarjeta_codigo = t.codigo
                 JOIN clientes c ON t.cliente_identificacion = c.identificacion
-                WHERE DATE(a.fecha) = %s
+                WHERE a.fecha >= %s AND a.fecha < %s
                 AND (CASE WHEN %s IS NULL THEN TRUE 
                          ELSE t.empleado_identificacion = %s END)
                 ORDER BY a.fecha DESC
             '''
-            cursor.execute(query, (fecha, empleado_identificacion, empleado_identificacion))
+            cursor.execute(query, (inicio, fin, empleado_identificacion, empleado_identificacion))
             return cursor.fetchall()
     except Exception as e:
         logger.error(f"Error al obtener abonos por fecha: {e}")
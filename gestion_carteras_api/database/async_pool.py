@@ -0,0 +1,123 @@
+"""
+Pool asíncrono (psycopg 3) para los endpoints calientes.
+
+Convive con DatabasePool (psycopg2): los helpers síncronos siguen disponibles y
+son el respaldo cuando psycopg 3 no está instalado, ASYNC_DB_ENABLED=0 o el pool
+asíncrono no pudo iniciarse. Las sentencias usan AsyncClientCursor (parámetros
+interpolados en el cliente, igual que psycopg2), así el mismo SQL con %s sirve
+para ambos stacks.
+"""
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+from .connection_pool import CursorMedido, forma_parametros, normalizar_sql
+
+try:
+    import psycopg
+    from psycopg_pool import AsyncConnectionPool
+except ImportError:  # psycopg 3 es opcional: sin él se usa el stack síncrono
+    psycopg = None
+    AsyncConnectionPool = None
+
+logger = logging.getLogger(__name__)
+
+
+if psycopg is not None:
+    class CursorMedidoAsync(psycopg.AsyncClientCursor):
+        """Cursor asíncrono que suma a la medición del request y reporta consultas lentas."""
+
+        async def execute(self, query, params=None, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return await super().execute(query, params, **kwargs)
+            finally:
+                self._medir(query, params, time.perf_counter() - inicio)
+
+        async def executemany(self, query, params_seq, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return await super().executemany(query, params_seq, **kwargs)
+            finally:
+                self._medir(query, params_seq, time.perf_counter() - inicio)
+
+        @staticmethod
+        def _medir(query, params, duracion: float):
+            CursorMedido._registrar(duracion)
+            umbral = CursorMedido.umbral_lento_segundos
+            if umbral and duracion >= umbral:
+                sql = query if isinstance(query, str) else str(query)
+                logger.warning(
+                    f"Consulta lenta async ({duracion * 1000:.0f} ms): {normalizar_sql(sql)} | params={forma_parametros(params)}"
+                )
+else:
+    CursorMedidoAsync = None
+
+
+def _conninfo(db_config: dict) -> str:
+    """Convierte DB_CONFIG (claves estilo psycopg2) a un conninfo de libpq."""
+    config = {('dbname' if k == 'database' else k): v for k, v in db_config.items() if v not in (None, '')}
+    config.setdefault('connect_timeout', 10)
+    opciones = config.get('options') or ''
+    if 'timezone' not in opciones:
+        config['options'] = (opciones + ' -c timezone=UTC').strip()
+    return psycopg.conninfo.make_conninfo(**{k: str(v) for k, v in config.items()})
+
+
+class AsyncDatabasePool:
+    _pool = None
+
+    @classmethod
+    def disponible(cls) -> bool:
+        return cls._pool is not None
+
+    @classmethod
+    async def initialize(cls, minconn: int = 1, maxconn: int = 10, **db_config):
+        """Abre el pool asíncrono. Si no es posible, los endpoints usan el stack síncrono."""
+        if os.getenv("ASYNC_DB_ENABLED", "1").lower() in ("0", "false", "no"):
+            logger.info("Pool asíncrono desactivado (ASYNC_DB_ENABLED=0)")
+            return
+        if AsyncConnectionPool is None:
+            logger.warning("psycopg 3 no está instalado; los endpoints asíncronos usan el pool síncrono")
+            return
+        try:
+            pool = AsyncConnectionPool(
+                conninfo=_conninfo(db_config),
+                min_size=minconn,
+                max_size=maxconn,
+                timeout=float(os.getenv("POOL_ACQUIRE_TIMEOUT_SECONDS", "5")),
+                kwargs={'cursor_factory': CursorMedidoAsync},
+                open=False,
+            )
+            await pool.open(wait=True, timeout=15)
+            cls._pool = pool
+            logger.info(f"Pool asíncrono inicializado. Min: {minconn}, Max: {maxconn}")
+        except Exception as e:
+            logger.error(f"Error al inicializar el pool asíncrono (se usará el síncrono): {e}")
+            cls._pool = None
+
+    @classmethod
+    @asynccontextmanager
+    async def get_cursor(cls):
+        """Cursor en una transacción: commit al salir sin errores, rollback si hay excepción."""
+        if cls._pool is None:
+            raise RuntimeError("AsyncDatabasePool no está inicializado.")
+        async with cls._pool.connection() as conn:
+            # connection() hace commit al salir y rollback si hay excepción;
+            # las conexiones rotas las descarta el propio pool
+            async with conn.cursor() as cursor:
+                yield cursor
+
+    @classmethod
+    def stats(cls) -> dict:
+        if cls._pool is None:
+            return {}
+        return dict(cls._pool.get_stats())
+
+    @classmethod
+    async def close_all(cls):
+        if cls._pool is not None:
+            await cls._pool.close()
+            cls._pool = None
+            logger.info("Pool asíncrono cerrado")
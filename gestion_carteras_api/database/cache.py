@@ -0,0 +1,106 @@
+"""
+Caché en memoria con TTL, tamaño máximo (LRU) e invalidación O(1) por ámbito.
+
+Cada entrada se guarda junto con la "generación" de su ámbito (p. ej. el
+empleado) y la generación global. Invalidar un ámbito solo incrementa su
+contador: las entradas viejas dejan de coincidir y salen por LRU/TTL, sin
+recorrer claves.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+_SIN_VALOR = object()
+
+
+class CacheTTL:
+    def __init__(self, nombre: str, max_entradas: int = 1000, ttl_segundos: float = 300.0):
+        self.nombre = nombre
+        self.max_entradas = max(1, int(max_entradas))
+        self.ttl_segundos = float(ttl_segundos)
+        self._datos: "OrderedDict[tuple, tuple]" = OrderedDict()  # clave -> (expira_en, valor)
+        self._generaciones: Dict[Hashable, int] = {}
+        self._generacion_global = 0
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+        self.invalidaciones = 0
+
+    def _clave(self, ambito: Hashable, clave: Hashable) -> tuple:
+        return (self._generacion_global, ambito, self._generaciones.get(ambito, 0), clave)
+
+    def get(self, ambito: Hashable, clave: Hashable, default: Any = None) -> Any:
+        ahora = time.monotonic()
+        with self._lock:
+            k = self._clave(ambito, clave)
+            entrada = self._datos.get(k, _SIN_VALOR)
+            if entrada is _SIN_VALOR or entrada[0] <= ahora:
+                if entrada is not _SIN_VALOR:
+                    del self._datos[k]
+                self.fallos += 1
+                return default
+            self._datos.move_to_end(k)
+            self.aciertos += 1
+            return entrada[1]
+
+    def set(self, ambito: Hashable, clave: Hashable, valor: Any, generacion: Optional[tuple] = None):
+        """
+        Guarda un valor. Si se pasa la generación leída antes de consultar la BD
+        (ver generacion()) y el ámbito se invalidó mientras tanto, no se guarda:
+        así un resultado leído antes de una escritura no revive tras invalidar.
+        """
+        with self._lock:
+            if generacion is not None and generacion != (self._generacion_global, self._generaciones.get(ambito, 0)):
+                return
+            k = self._clave(ambito, clave)
+            self._datos[k] = (time.monotonic() + self.ttl_segundos, valor)
+            self._datos.move_to_end(k)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+                self.expulsiones += 1
+
+    def generacion(self, ambito: Hashable) -> tuple:
+        with self._lock:
+            return (self._generacion_global, self._generaciones.get(ambito, 0))
+
+    def invalidar(self, ambito: Hashable):
+        """Invalida todas las entradas de un ámbito (O(1))."""
+        with self._lock:
+            self._generaciones[ambito] = self._generaciones.get(ambito, 0) + 1
+            self.invalidaciones += 1
+
+    def invalidar_todo(self):
+        with self._lock:
+            self._generacion_global += 1
+            self._generaciones.clear()
+            self._datos.clear()
+            self.invalidaciones += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'nombre': self.nombre,
+                'entradas': len(self._datos),
+                'max_entradas': self.max_entradas,
+                'ttl_segundos': self.ttl_segundos,
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'expulsiones': self.expulsiones,
+                'invalidaciones': self.invalidaciones,
+            }
+
+
+# Registro de cachés del proceso (para /metrics)
+_caches: Dict[str, CacheTTL] = {}
+
+
+def crear_cache(nombre: str, max_entradas: int = 1000, ttl_segundos: float = 300.0) -> CacheTTL:
+    cache = CacheTTL(nombre, max_entradas, ttl_segundos)
+    _caches[nombre] = cache
+    return cache
+
+
+def stats_caches() -> Dict[str, Dict[str, Any]]:
+    return {nombre: c.stats() for nombre, c in _caches.items()}
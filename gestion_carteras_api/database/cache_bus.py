@@ -0,0 +1,181 @@
+"""
+Bus de invalidación de cachés entre instancias (PostgreSQL LISTEN/NOTIFY).
+
+Cada escritura publica `NOTIFY cache_invalidate, '<ámbito>:<clave>'` dentro de
+su transacción (p. ej. 'tarjetas:1001', 'empleados:3', 'cuenta:3' o
+'tarjetas:*'); PostgreSQL solo la entrega si la transacción se confirma. Un
+hilo por proceso escucha el canal con una conexión dedicada y llama al
+manejador registrado para el ámbito, que descarta las entradas locales.
+
+Si la conexión de escucha se cae se pueden perder avisos: al reconectar se
+invalidan todos los cachés registrados antes de volver a escuchar.
+"""
+import logging
+import os
+import select
+import threading
+from typing import Callable, Dict, Optional
+
+import psycopg2
+import psycopg2.extensions
+
+from .connection_pool import DatabasePool
+
+logger = logging.getLogger(__name__)
+
+CANAL = 'cache_invalidate'
+
+# ámbito -> manejador(clave | None); None invalida todo el ámbito
+_manejadores: Dict[str, Callable[[Optional[str]], None]] = {}
+
+
+def registrar_ambito(ambito: str, manejador: Callable[[Optional[str]], None]):
+    """Registra el manejador local de un ámbito (lo llama el módulo dueño del caché)."""
+    _manejadores[ambito] = manejador
+
+
+def _aplicar_local(ambito: str, clave: Optional[str]):
+    manejador = _manejadores.get(ambito)
+    if manejador is None:
+        return
+    try:
+        manejador(clave)
+    except Exception as e:
+        logger.error(f"Error al invalidar caché local '{ambito}': {e}")
+
+
+def _invalidar_todo_local():
+    for ambito in list(_manejadores):
+        _aplicar_local(ambito, None)
+
+
+def publicar(ambito: str, clave: Optional[str] = None):
+    """
+    Invalida el ámbito en este proceso tras el commit y lo anuncia a las demás
+    instancias con NOTIFY en la misma transacción. clave=None invalida todo el
+    ámbito. Si el aviso no se puede enviar se registra; las demás instancias
+    quedan cubiertas por el TTL del caché.
+    """
+    clave_str = None if clave is None else str(clave)
+    DatabasePool.despues_de_confirmar(lambda: _aplicar_local(ambito, clave_str))
+    try:
+        DatabasePool.notificar(CANAL, f"{ambito}:{'*' if clave_str is None else clave_str}")
+    except Exception as e:
+        logger.warning(f"No se pudo publicar invalidación de caché '{ambito}': {e}")
+
+
+def _procesar_payload(payload: str):
+    ambito, _, clave = (payload or '').partition(':')
+    if ambito == '*':
+        _invalidar_todo_local()
+        return
+    _aplicar_local(ambito, None if clave in ('', '*') else clave)
+
+
+class EscuchaInvalidaciones(threading.Thread):
+    """Hilo que mantiene LISTEN cache_invalidate en una conexión propia (fuera del pool)."""
+
+    def __init__(self, db_config: dict, espera_reconexion: float = 5.0):
+        super().__init__(name='cache-invalidate-listener', daemon=True)
+        self._db_config = {k: v for k, v in db_config.items() if k != 'cursor_factory'}
+        self._espera_reconexion = espera_reconexion
+        self._detener = threading.Event()
+        self.conectado = threading.Event()
+        self.recibidos = 0
+        self.reconexiones = 0
+
+    def detener(self):
+        self._detener.set()
+
+    def _conectar(self):
+        conn = psycopg2.connect(**self._db_config)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {CANAL}")
+        return conn
+
+    def run(self):
+        while not self._detener.is_set():
+            conn = None
+            try:
+                conn = self._conectar()
+                # Lo publicado mientras no escuchábamos se perdió: empezar de cero
+                if self.reconexiones:
+                    _invalidar_todo_local()
+                self.conectado.set()
+                logger.info(f"Escuchando invalidaciones de caché en el canal '{CANAL}'")
+                while not self._detener.is_set():
+                    if select.select([conn], [], [], 5.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        aviso = conn.notifies.pop(0)
+                        self.recibidos += 1
+                        _procesar_payload(aviso.payload)
+            except Exception as e:
+                if not self._detener.is_set():
+                    logger.warning(f"Escucha de invalidaciones caída; se reintenta en {self._espera_reconexion}s: {e}")
+            finally:
+                self.conectado.clear()
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            if not self._detener.is_set():
+                self.reconexiones += 1
+                self._detener.wait(self._espera_reconexion)
+
+
+_escucha: Optional[EscuchaInvalidaciones] = None
+
+
+def iniciar_escucha(db_config: dict):
+    """Arranca el hilo de escucha (CACHE_INVALIDATION_LISTENER=0 lo desactiva)."""
+    global _escucha
+    if os.getenv('CACHE_INVALIDATION_LISTENER', '1').lower() in ('0', 'false', 'no'):
+        logger.info("Escucha de invalidaciones de caché desactivada (CACHE_INVALIDATION_LISTENER=0)")
+        return
+    if _escucha is not None and _escucha.is_alive():
+        return
+    config = DatabasePool._preparar_config(dict(db_config))
+    _escucha = EscuchaInvalidaciones(config)
+    _escucha.start()
+    # Esperar brevemente la primera conexión para que los cachés arranquen activos
+    _escucha.conectado.wait(timeout=5.0)
+
+
+def detener_escucha():
+    global _escucha
+    if _escucha is not None:
+        _escucha.detener()
+        _escucha.join(timeout=10.0)
+        _escucha = None
+
+
+def escucha_activa() -> bool:
+    return _escucha is not None and _escucha.conectado.is_set()
+
+
+def cache_habilitado(variable_entorno: str) -> bool:
+    """
+    Si un caché compartido puede usarse: '1'/'0' en la variable lo fuerzan;
+    'auto' (por defecto) lo habilita solo mientras la escucha está conectada,
+    porque sin ella las escrituras de otras instancias no llegan.
+    """
+    valor = os.getenv(variable_entorno, 'auto').lower()
+    if valor in ('1', 'true', 'yes'):
+        return True
+    if valor in ('0', 'false', 'no'):
+        return False
+    return escucha_activa()
+
+
+def stats() -> dict:
+    if _escucha is None:
+        return {}
+    return {
+        'conectado': _escucha.conectado.is_set(),
+        'recibidos': _escucha.recibidos,
+        'reconexiones': _escucha.reconexiones,
+    }
@@ -1,6 +1,7 @@
 from .connection_pool import DatabasePool
+from .paginacion import consulta_keyset
 import logging
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from datetime import datetime, date
 
 logger = logging.getLogger(__name__)
@@ -160,8 +161,8 @@ def actualizar_cliente(identificacion: str, nombre: str, apellido: str,
             ))
             
             # Limpiar caché de tarjetas para que se actualice la vista
-            from .tarjetas_db import _cache
-            _cache.clear()
+            from .tarjetas_db import invalidar_cache_tarjetas
+            invalidar_cache_tarjetas()
             row = cursor.fetchone()
             if not row:
                 return None
@@ -189,19 +190,24 @@ def eliminar_cliente(identificacion: str) -> bool:
         logger.error(f"Error al eliminar cliente: {e}")
         return False
 
-def obtener_clientes(offset: int = 0, limit: int = 50) -> List[Dict]:
+# Clave de orden del listado (la identificación desempata homónimos)
+ORDEN_CLIENTES = (('nombre', 'nombre'), ('apellido', 'apellido'), ('identificacion', 'identificacion'))
+
+def obtener_clientes(offset: int = 0, limit: int = 50, despues: Optional[Tuple] = None) -> List[Dict]:
+    """Clientes por nombre; despues=(nombre, apellido, identificacion) pagina por cursor."""
     try:
         with DatabasePool.get_cursor() as cursor:
-            query = '''
+            query, params = consulta_keyset(
+                '''
                 SELECT 
                     identificacion, nombre, apellido,
                     telefono, direccion, observaciones,
                     COALESCE(score_global, 100)
                 FROM clientes 
-                ORDER BY nombre, apellido
-                OFFSET %s LIMIT %s
-            '''
-            cursor.execute(query, (offset, limit))
+                ''',
+                '', (), ORDEN_CLIENTES, despues, limit, offset=offset,
+            )
+            cursor.execute(query, params)
             clientes = cursor.fetchall()
             
             from datetime import date
@@ -224,7 +230,8 @@ def actualizar_score_historial(identificacion: str, score: int, historial: List[
     try:
         import json
         historial_json = json.dumps(historial)
-        with DatabasePool.get_cursor() as cursor:
+        # Escritura: siempre al primario, aunque el reporte que la invoca lea de la réplica
+        with DatabasePool.get_cursor(readonly=False) as cursor:
             query = '''
                 UPDATE clientes 
                 SET score_global = %s,
@@ -1,106 +1,894 @@
-from psycopg2 import pool
 import psycopg2
+import random
+import re
+import sys
+import threading
 import time
+from collections import deque
 from contextlib import contextmanager
+from contextvars import ContextVar
 import logging
 import os
 from psycopg2.pool import PoolError
+from typing import Optional
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+# Límites (segundos) del histograma de espera al pedir una conexión
+BUCKETS_ESPERA = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class PoolTimeoutError(PoolError):
+    """No se obtuvo una conexión del pool dentro del tiempo de espera configurado."""
+
+
+class _Espera:
+    """Un hilo en la cola de espera: recibe la conexión directamente (handoff)."""
+    __slots__ = ('evento', 'conn', 'abrir')
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.conn = None
+        self.abrir = False  # True: se liberó un cupo y debe abrir una conexión nueva
+
+
+class FairConnectionPool:
+    """
+    Pool de conexiones thread-safe con cola de espera FIFO.
+
+    - Si no hay conexiones libres y se alcanzó maxconn, el hilo se encola y
+      espera (sin sondeos) hasta que otro hilo le entregue una conexión, o hasta
+      vencer acquire_timeout (PoolTimeoutError).
+    - Las conexiones devueltas se entregan al PRIMER hilo en espera (FIFO).
+    - Las conexiones libres se conservan abiertas (no se cierran al bajar de
+      minconn como en ThreadedConnectionPool), evitando reconectar a RDS.
+    - Lleva estadísticas de espera (ver stats()).
+    - No valida en cada préstamo: un hilo validador hace ping (SELECT 1) a las
+      conexiones que llevan más de validate_interval segundos libres y
+      reemplaza las rotas.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, acquire_timeout: float = 5.0,
+                 validate_interval: float = 30.0, **kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise PoolError("Parámetros inválidos: se requiere 0 <= minconn <= maxconn y maxconn >= 1")
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.acquire_timeout = acquire_timeout
+        self._kwargs = kwargs
+        self._lock = threading.Lock()
+        self._libres = deque()  # (conn, monotonic de última devolución)
+        self._en_uso = set()
+        self._esperas = deque()
+        self._abiertas = 0
+        self.closed = False
+        # Estadísticas
+        self._adquisiciones = 0
+        self._esperas_total = 0
+        self._espera_segundos_total = 0.0
+        self._espera_segundos_max = 0.0
+        self._timeouts = 0
+        self._reemplazos = 0
+        self._hist_espera = [0] * len(BUCKETS_ESPERA)
+        self._hist_espera_suma = 0.0
+        self._hist_espera_cuenta = 0
+        for _ in range(minconn):
+            self._libres.append((self._conectar(), time.monotonic()))
+            self._abiertas += 1
+        self.validate_interval = validate_interval
+        self._detener = threading.Event()
+        self._validador = None
+        if validate_interval and validate_interval > 0:
+            self._validador = threading.Thread(
+                target=self._validar_periodicamente, name="db-pool-validator", daemon=True
+            )
+            self._validador.start()
+
+    def _conectar(self):
+        return psycopg2.connect(**self._kwargs)
+
+    def _abrir_reservada(self):
+        """Abre una conexión para un cupo ya reservado (fuera del lock)."""
+        try:
+            return self._conectar()
+        except Exception:
+            with self._lock:
+                self._abiertas -= 1
+                self._ceder_cupo()
+            raise
+
+    def _ceder_cupo(self):
+        """Con el lock tomado: si hay hilos esperando y hay cupo, el primero abrirá una conexión."""
+        if self._esperas and self._abiertas < self.maxconn:
+            espera = self._esperas.popleft()
+            self._abiertas += 1
+            espera.abrir = True
+            espera.evento.set()
+
+    def _observar_espera(self, segundos: float):
+        """Con el lock tomado: registra la espera de una adquisición en el histograma."""
+        self._hist_espera_cuenta += 1
+        self._hist_espera_suma += segundos
+        for i, limite in enumerate(BUCKETS_ESPERA):
+            if segundos <= limite:
+                self._hist_espera[i] += 1
+                break
+
+    def getconn(self, timeout: float = None):
+        """Obtiene una conexión; espera en cola FIFO si el pool está lleno."""
+        if timeout is None:
+            timeout = self.acquire_timeout
+        with self._lock:
+            if self.closed:
+                raise PoolError("El pool de conexiones está cerrado")
+            self._adquisiciones += 1
+            if self._libres and not self._esperas:
+                conn, _ = self._libres.pop()
+                self._en_uso.add(id(conn))
+                self._observar_espera(0.0)
+                return conn
+            if self._abiertas < self.maxconn and not self._esperas:
+                self._observar_espera(0.0)
+                self._abiertas += 1
+                espera = None
+            else:
+                espera = _Espera()
+                self._esperas.append(espera)
+
+        if espera is None:
+            conn = self._abrir_reservada()
+            with self._lock:
+                self._en_uso.add(id(conn))
+            return conn
+
+        inicio = time.monotonic()
+        espera.evento.wait(timeout)
+        with self._lock:
+            esperado = time.monotonic() - inicio
+            self._esperas_total += 1
+            self._espera_segundos_total += esperado
+            self._espera_segundos_max = max(self._espera_segundos_max, esperado)
+            self._observar_espera(esperado)
+            if espera.conn is None and not espera.abrir:
+                # Venció el tiempo sin recibir conexión
+                try:
+                    self._esperas.remove(espera)
+                except ValueError:
+                    pass
+                self._timeouts += 1
+                raise PoolTimeoutError(
+                    f"No hay conexiones disponibles tras esperar {esperado:.2f}s "
+                    f"(en uso={len(self._en_uso)}, max={self.maxconn}, en espera={len(self._esperas)})"
+                )
+            if espera.conn is not None:
+                self._en_uso.add(id(espera.conn))
+                return espera.conn
+
+        conn = self._abrir_reservada()
+        with self._lock:
+            self._en_uso.add(id(conn))
+        return conn
+
+    def putconn(self, conn, close: bool = False):
+        """Devuelve una conexión al pool (o la descarta si está rota / close=True)."""
+        if not close and not conn.closed:
+            try:
+                # Dejar la conexión limpia (sin transacción abierta) antes de reutilizarla
+                if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                close = True
+        with self._lock:
+            self._en_uso.discard(id(conn))
+            if self.closed or close or conn.closed:
+                self._abiertas -= 1
+                descartar = True
+            else:
+                descartar = False
+                if self._esperas:
+                    espera = self._esperas.popleft()
+                    espera.conn = conn
+                    espera.evento.set()
+                else:
+                    self._libres.append((conn, time.monotonic()))
+            if descartar:
+                self._ceder_cupo()
+        if descartar:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def replace(self, conn):
+        """
+        Cierra una conexión rota y abre otra en su MISMO cupo; la nueva queda
+        en uso por el hilo que la pidió (la contabilidad del pool no cambia).
+        """
+        with self._lock:
+            self._en_uso.discard(id(conn))
+        try:
+            conn.close()
+        except Exception:
+            pass
+        try:
+            nueva = self._conectar()
+        except Exception:
+            with self._lock:
+                self._abiertas -= 1
+                self._ceder_cupo()
+            raise
+        with self._lock:
+            self._en_uso.add(id(nueva))
+            self._reemplazos += 1
+        return nueva
+
+    def _validar_periodicamente(self):
+        while not self._detener.wait(self.validate_interval):
+            try:
+                self.validate_idle()
+            except Exception as e:
+                logger.warning(f"Validador del pool: {e}")
+
+    def validate_idle(self):
+        """
+        Hace ping a las conexiones libres que superan validate_interval sin uso.
+        Se sacan de la lista de libres mientras se prueban; las rotas se
+        reemplazan (o se libera su cupo si no se puede reconectar).
+        """
+        limite = time.monotonic() - self.validate_interval
+        with self._lock:
+            if self.closed:
+                return
+            viejas = [(c, ts) for c, ts in self._libres if ts <= limite]
+            if not viejas:
+                return
+            self._libres = deque((c, ts) for c, ts in self._libres if ts > limite)
+            for c, _ in viejas:
+                self._en_uso.add(id(c))
+        for conn, _ in viejas:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute('SELECT 1')
+                conn.rollback()
+                self.putconn(conn)
+            except Exception:
+                logger.warning("Conexión libre rota detectada por el validador; reemplazando")
+                try:
+                    nueva = self.replace(conn)
+                except Exception as e:
+                    logger.error(f"No se pudo reemplazar conexión rota: {e}")
+                    continue
+                self.putconn(nueva)
+
+    def closeall(self):
+        with self._lock:
+            self.closed = True
+            libres = [c for c, _ in self._libres]
+            self._libres.clear()
+            self._abiertas -= len(libres)
+        self._detener.set()
+        for conn in libres:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'max': self.maxconn,
+                'open': self._abiertas,
+                'in_use': len(self._en_uso),
+                'idle': len(self._libres),
+                'waiting': len(self._esperas),
+                'acquire_count': self._adquisiciones,
+                'wait_count': self._esperas_total,
+                'wait_seconds_total': round(self._espera_segundos_total, 6),
+                'wait_seconds_max': round(self._espera_segundos_max, 6),
+                'timeouts': self._timeouts,
+                'broken_replaced': self._reemplazos,
+                'wait_histogram': {
+                    'buckets': list(zip(BUCKETS_ESPERA, self._hist_espera)),
+                    'sum': self._hist_espera_suma,
+                    'count': self._hist_espera_cuenta,
+                },
+            }
+
+
+class UnidadDeTrabajo:
+    """
+    Una conexión del pool y UNA transacción compartidas por todos los
+    DatabasePool.get_cursor() que se ejecuten mientras esté activa.
+    Cada get_cursor() abre un SAVEPOINT: si el bloque falla solo se revierte
+    ese bloque (los helpers que capturan errores siguen funcionando igual) y
+    el commit/rollback final lo decide quien abrió la unidad.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._savepoints = 0
+        self.rota = False
+        self.al_confirmar = []  # callbacks a ejecutar tras el COMMIT final
+
+    @contextmanager
+    def cursor(self):
+        self._savepoints += 1
+        sp = f"uow_sp_{self._savepoints}"
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(f"SAVEPOINT {sp}")
+            yield cursor
+        except Exception:
+            try:
+                cursor.execute(f"ROLLBACK TO SAVEPOINT {sp}")
+            except Exception:
+                self.rota = True
+            raise
+        finally:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+
+class MedicionConsultas:
+    """Acumula cuántas sentencias ejecutó un request y cuánto tiempo tomaron."""
+    __slots__ = ('consultas', 'segundos')
+
+    def __init__(self):
+        self.consultas = 0
+        self.segundos = 0.0
+
+
+# Medición activa en el contexto actual (la inicia el middleware de métricas)
+_medicion_actual: ContextVar = ContextVar('db_medicion_consultas', default=None)
+
+
+_RE_LITERAL_TEXTO = re.compile(r"'(?:[^']|'')*'")
+_RE_LITERAL_NUMERO = re.compile(r"\b\d+(?:\.\d+)?\b")
+_RE_ESPACIOS = re.compile(r"\s+")
+_RE_ESCRITURA = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|TRUNCATE|CREATE|ALTER|DROP|GRANT|REVOKE|COPY|CALL|DO|SET|LOCK|NOTIFY|LISTEN|VACUUM)\b", re.IGNORECASE)
+_MODULOS_INTERNOS = ('connection_pool.py', 'contextlib.py', os.sep + 'psycopg2' + os.sep)
+
+
+def normalizar_sql(sql: str, max_len: int = 1000) -> str:
+    """SQL en una línea, sin literales (texto/números -> ?), para agrupar sentencias iguales."""
+    texto = _RE_LITERAL_TEXTO.sub('?', sql)
+    texto = _RE_LITERAL_NUMERO.sub('?', texto)
+    texto = _RE_ESPACIOS.sub(' ', texto).strip()
+    return texto if len(texto) <= max_len else texto[:max_len] + '...'
+
+
+def forma_parametros(params) -> str:
+    """Describe tipos y tamaños de los parámetros sin exponer sus valores."""
+    if params is None:
+        return 'None'
+    if isinstance(params, dict):
+        return '{' + ', '.join(f'{k}: {forma_parametros(v) if isinstance(v, (list, tuple, dict)) else type(v).__name__}'
+                               for k, v in params.items()) + '}'
+    if isinstance(params, (list, tuple)):
+        if len(params) > 10:
+            return f'{type(params).__name__}[{len(params)}]'
+        return '(' + ', '.join(
+            f'{type(v).__name__}[{len(v)}]' if isinstance(v, (list, tuple)) else type(v).__name__
+            for v in params
+        ) + ')'
+    return type(params).__name__
+
+
+def _funcion_llamadora() -> str:
+    """Primer frame fuera del pool/psycopg2/contextlib: módulo.función:línea."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        archivo = frame.f_code.co_filename
+        if not any(m in archivo for m in _MODULOS_INTERNOS):
+            modulo = frame.f_globals.get('__name__', '?')
+            return f"{modulo}.{frame.f_code.co_name}:{frame.f_lineno}"
+        frame = frame.f_back
+    return '?'
+
+
+class CursorMedido(psycopg2.extensions.cursor):
+    """
+    Cursor que cronometra cada sentencia y la suma a la medición del request.
+
+    Si una sentencia supera umbral_lento_segundos se registra en el log (SQL
+    normalizado, forma de los parámetros, función llamadora y duración). Con
+    explain_muestra > 0, una fracción de las sentencias lentas de solo lectura se
+    vuelve a ejecutar con EXPLAIN (ANALYZE, BUFFERS) y el plan se guarda en
+    explain_archivo o en la tabla db_planes_lentos (explain_destino='tabla').
+    La configuración la fija DatabasePool.initialize desde variables de entorno.
+    """
+
+    umbral_lento_segundos = 0.5
+    explain_muestra = 0.0
+    explain_destino = 'archivo'
+    explain_archivo = 'slow_queries_explain.log'
+    _lock_archivo = threading.Lock()
+
+    def execute(self, query, vars=None):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            duracion = time.perf_counter() - inicio
+            self._registrar(duracion)
+            if self.umbral_lento_segundos and duracion >= self.umbral_lento_segundos:
+                self._reportar_lenta(query, vars, duracion, explicar=True)
+
+    def executemany(self, query, vars_list):
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            duracion = time.perf_counter() - inicio
+            self._registrar(duracion)
+            if self.umbral_lento_segundos and duracion >= self.umbral_lento_segundos:
+                self._reportar_lenta(query, vars_list, duracion, explicar=False)
+
+    @staticmethod
+    def _registrar(segundos: float):
+        medicion = _medicion_actual.get()
+        if medicion is not None:
+            medicion.consultas += 1
+            medicion.segundos += segundos
+
+    def _sql_texto(self, query) -> str:
+        if isinstance(query, bytes):
+            return query.decode('utf-8', 'replace')
+        if isinstance(query, str):
+            return query
+        try:
+            return query.as_string(self.connection)  # psycopg2.sql.Composed
+        except Exception:
+            return str(query)
+
+    def _reportar_lenta(self, query, params, duracion: float, explicar: bool):
+        try:
+            sql = self._sql_texto(query)
+            normalizada = normalizar_sql(sql)
+            llamador = _funcion_llamadora()
+            logger.warning(
+                f"Consulta lenta ({duracion * 1000:.0f} ms) en {llamador}: {normalizada} | params={forma_parametros(params)}"
+            )
+            if explicar and self.explain_muestra > 0 and random.random() < self.explain_muestra:
+                self._capturar_explain(sql, params, normalizada, llamador, duracion)
+        except Exception as e:
+            logger.error(f"Error al reportar consulta lenta: {e}")
+
+    def _capturar_explain(self, sql: str, params, normalizada: str, llamador: str, duracion: float):
+        """EXPLAIN (ANALYZE, BUFFERS) de una sentencia de solo lectura, aislado en un SAVEPOINT."""
+        inicio_sql = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+        # ANALYZE ejecuta la sentencia: nunca repetir escrituras
+        if inicio_sql not in ('SELECT', 'WITH') or _RE_ESCRITURA.search(_RE_LITERAL_TEXTO.sub('', sql)):
+            return
+        conn = self.connection
+        if conn.closed or conn.autocommit:
+            return
+        if conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+            return
+        cur = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+        try:
+            cur.execute("SAVEPOINT explain_lenta")
+            try:
+                cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, params)
+                plan = '\n'.join(fila[0] for fila in cur.fetchall())
+                if self.explain_destino == 'tabla':
+                    cur.execute(
+                        """
+                        INSERT INTO db_planes_lentos (sql_normalizado, llamador, duracion_ms, plan)
+                        VALUES (%s, %s, %s, %s)
+                        """,
+                        (normalizada, llamador, round(duracion * 1000, 1), plan),
+                    )
+                cur.execute("RELEASE SAVEPOINT explain_lenta")
+            except Exception:
+                cur.execute("ROLLBACK TO SAVEPOINT explain_lenta")
+                raise
+            if self.explain_destino != 'tabla':
+                with self._lock_archivo, open(self.explain_archivo, 'a', encoding='utf-8') as f:
+                    f.write(
+                        f"=== {time.strftime('%Y-%m-%d %H:%M:%S')} | {duracion * 1000:.0f} ms | {llamador}\n"
+                        f"{normalizada}\n{plan}\n\n"
+                    )
+        except Exception as e:
+            logger.error(f"Error al capturar EXPLAIN de consulta lenta: {e}")
+        finally:
+            cur.close()
+
+
+# Unidad de trabajo activa en el contexto actual (request)
+_unidad_actual: ContextVar = ContextVar('db_unidad_de_trabajo', default=None)
+
+# Callbacks a ejecutar tras el commit de la transacción get_cursor() en curso
+_al_confirmar_actual: ContextVar = ContextVar('db_al_confirmar', default=None)
+
+# Cursor de la transacción get_cursor() en curso (para NOTIFY dentro de ella)
+_cursor_actual: ContextVar = ContextVar('db_cursor_actual', default=None)
+
+
+def _ejecutar_callbacks(callbacks):
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception as e:
+            logger.error(f"Error en callback posterior al commit: {e}")
+
+
+# El request actual es de solo lectura y puede leer de la réplica
+_lectura_replica: ContextVar = ContextVar('db_lectura_replica', default=False)
+
+# Retraso de la réplica en segundos (0 si está al día o si no es una réplica)
+_SQL_RETRASO_REPLICA = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+async def lectura_en_replica():
+    """
+    Dependencia FastAPI para endpoints de reportes: los get_cursor() del request
+    se atienden desde la réplica de lectura (si hay una configurada y al día).
+    """
+    token = _lectura_replica.set(True)
+    try:
+        yield
+    finally:
+        try:
+            _lectura_replica.reset(token)
+        except ValueError:
+            _lectura_replica.set(False)
+
+
 class DatabasePool:
     _pool = None
+    _pool_replica = None
+    _replica_retraso_max = 30.0
+    _replica_intervalo_revision = 10.0
+    _replica_revisada_en = 0.0
+    _replica_al_dia = False
+    _replica_lock = threading.Lock()
+    _lecturas_en_primario = 0
+
+    @staticmethod
+    def _preparar_config(db_config: dict) -> dict:
+        """Opciones comunes de conexión (keepalives, UTC, cursor medido)."""
+        db_config = dict(db_config)
+        # Opciones de socket/keepalive (si el server las soporta)
+        db_config.setdefault('connect_timeout', 10)
+        # sslmode ya viene desde DB_CONFIG si aplica
+        db_config.setdefault('keepalives', 1)
+        db_config.setdefault('keepalives_idle', 30)
+        db_config.setdefault('keepalives_interval', 10)
+        db_config.setdefault('keepalives_count', 3)
+        # Sesión en UTC desde el arranque de la conexión (coherencia de timestamps);
+        # evita un SET TIME ZONE en cada préstamo
+        opciones = db_config.get('options') or ''
+        if 'timezone' not in opciones:
+            db_config['options'] = (opciones + ' -c timezone=UTC').strip()
+        # Todas las sentencias se cronometran (métricas por request)
+        db_config.setdefault('cursor_factory', CursorMedido)
+        return db_config
 
     @classmethod
-    def initialize(cls, minconn=1, maxconn=10, **db_config):
-        """Inicializa el pool de conexiones"""
+    def initialize(cls, minconn=1, maxconn=10, replica_config: dict = None, **db_config):
+        """Inicializa el pool de conexiones (y el de la réplica de lectura, si se configura)"""
         try:
-            # Opciones de socket/keepalive (si el server las soporta)
-            db_config.setdefault('connect_timeout', 10)
-            # sslmode ya viene desde DB_CONFIG si aplica
-            # Thread-safe: FastAPI/uvicorn puede usar múltiples hilos (threadpool)
-            cls._pool = pool.ThreadedConnectionPool(
+            db_config = cls._preparar_config(db_config)
+            # Registro de consultas lentas (0 desactiva) y captura opcional de planes
+            CursorMedido.umbral_lento_segundos = float(os.getenv("DB_SLOW_QUERY_MS", "500")) / 1000.0
+            CursorMedido.explain_muestra = float(os.getenv("DB_SLOW_QUERY_EXPLAIN_SAMPLE", "0"))
+            CursorMedido.explain_destino = os.getenv("DB_SLOW_QUERY_EXPLAIN_TARGET", "archivo").lower()
+            CursorMedido.explain_archivo = os.getenv("DB_SLOW_QUERY_EXPLAIN_FILE", "slow_queries_explain.log")
+            # Tiempo máximo de espera por una conexión cuando el pool está lleno
+            acquire_timeout = float(os.getenv("POOL_ACQUIRE_TIMEOUT_SECONDS", "5"))
+            # Cada cuánto se validan (ping) las conexiones libres; 0 desactiva el validador
+            validate_interval = float(os.getenv("POOL_VALIDATE_INTERVAL_SECONDS", "30"))
+            # Thread-safe con cola FIFO: FastAPI/uvicorn usa múltiples hilos (threadpool)
+            cls._pool = FairConnectionPool(
                 minconn=minconn,
                 maxconn=maxconn,
+                acquire_timeout=acquire_timeout,
+                validate_interval=validate_interval,
                 **db_config
             )
-            logger.info(f"Pool de conexiones inicializado. Min: {minconn}, Max: {maxconn}")
+            logger.info(f"Pool de conexiones inicializado. Min: {minconn}, Max: {maxconn}, Timeout espera: {acquire_timeout}s")
         except Exception as e:
             logger.error(f"Error al inicializar el pool de conexiones: {e}")
             raise
+        if replica_config:
+            cls._inicializar_replica(replica_config, acquire_timeout, validate_interval)
+
+    @classmethod
+    def _inicializar_replica(cls, replica_config: dict, acquire_timeout: float, validate_interval: float):
+        """Pool de la réplica de lectura. Si falla, las lecturas siguen en el primario."""
+        try:
+            config = cls._preparar_config(replica_config)
+            # Sesiones de solo lectura: un reporte nunca escribe en la réplica
+            config['options'] = (config['options'] + ' -c default_transaction_read_only=on').strip()
+            cls._replica_retraso_max = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "30"))
+            cls._replica_intervalo_revision = float(os.getenv("DB_REPLICA_LAG_CHECK_SECONDS", "10"))
+            maxconn = int(os.getenv("DB_REPLICA_POOL_MAXCONN", "10"))
+            cls._pool_replica = FairConnectionPool(
+                minconn=0,
+                maxconn=maxconn,
+                acquire_timeout=acquire_timeout,
+                validate_interval=validate_interval,
+                **config
+            )
+            logger.info(f"Pool de réplica inicializado. Max: {maxconn}, retraso máximo: {cls._replica_retraso_max}s")
+        except Exception as e:
+            logger.error(f"Error al inicializar el pool de réplica (se leerá del primario): {e}")
+            cls._pool_replica = None
+
+    @classmethod
+    def _replica_utilizable(cls) -> bool:
+        """
+        True si hay réplica y su retraso está bajo DB_REPLICA_MAX_LAG_SECONDS.
+        El retraso se mide como mucho cada DB_REPLICA_LAG_CHECK_SECONDS; mientras
+        un hilo lo mide, los demás usan el último resultado.
+        """
+        if cls._pool_replica is None:
+            return False
+        if time.monotonic() - cls._replica_revisada_en < cls._replica_intervalo_revision:
+            return cls._replica_al_dia
+        if not cls._replica_lock.acquire(blocking=False):
+            return cls._replica_al_dia
+        try:
+            conn = None
+            roto = False
+            try:
+                conn = cls._pool_replica.getconn(timeout=1.0)
+                with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+                    cur.execute(_SQL_RETRASO_REPLICA)
+                    retraso = float(cur.fetchone()[0] or 0)
+                conn.rollback()
+                al_dia = retraso <= cls._replica_retraso_max
+                if not al_dia:
+                    logger.warning(f"Réplica atrasada {retraso:.1f}s; las lecturas van al primario")
+            except Exception as e:
+                roto = conn is not None
+                al_dia = False
+                logger.warning(f"Réplica no disponible; las lecturas van al primario: {e}")
+            finally:
+                if conn is not None:
+                    try:
+                        cls._pool_replica.putconn(conn, close=roto or bool(conn.closed))
+                    except Exception:
+                        pass
+            cls._replica_al_dia = al_dia
+            cls._replica_revisada_en = time.monotonic()
+            return al_dia
+        finally:
+            cls._replica_lock.release()
 
     @classmethod
     @contextmanager
-    def get_cursor(cls):
+    def get_cursor(cls, readonly: Optional[bool] = None):
+        """
+        Cursor en una transacción del pool (commit al salir, rollback si falla).
+        readonly=True lee de la réplica si está configurada y al día (si no, del
+        primario); None sigue la marca del request (lectura_en_replica) y False
+        fuerza el primario (escrituras dentro de un endpoint de reportes).
+        """
         conn = None
         cursor = None
+        roto = False
+        pool = cls._pool
         try:
             if cls._pool is None:
                 raise RuntimeError("DatabasePool no está inicializado. Llama DatabasePool.initialize() en startup.")
 
-            # Reintentos configurables: útil cuando el pool está momentáneamente lleno.
-            # Por defecto: 8 intentos con 250ms (≈2s de espera total) antes de fallar.
-            max_attempts = int(os.getenv("POOL_ACQUIRE_RETRIES", "8"))
-            base_sleep = float(os.getenv("POOL_ACQUIRE_SLEEP_SECONDS", "0.25"))
+            # Dentro de una unidad de trabajo: reutilizar su conexión/transacción
+            # (incluso para lecturas: deben ver lo que la unidad ya escribió)
+            unidad = _unidad_actual.get()
+            if unidad is not None:
+                with unidad.cursor() as cursor_unidad:
+                    yield cursor_unidad
+                return
 
-            attempts = 0
-            last_exc = None
-            while attempts < max_attempts:
-                try:
-                    conn = cls._pool.getconn()
-                    # Verificar conexión viva
-                    try:
-                        with conn.cursor() as _c:
-                            _c.execute('SELECT 1')
-                            _ = _c.fetchone()
-                            # Forzar sesión en UTC para coherencia de timestamps
-                            _c.execute("SET TIME ZONE 'UTC'")
-                    except Exception:
-                        # Reconectar si la conexión está rota
-                        try:
-                            conn.close()
-                        except Exception:
-                            pass
-                        # Crear una nueva conexión cruda y ponerla en el pool
-                        new_conn = psycopg2.connect(**cls._pool._kwargs)
-                        conn = new_conn
-                    cursor = conn.cursor()
-                    break
-                except PoolError as e:
-                    # Pool lleno: esperar un poco y reintentar (evita errores intermitentes en picos).
-                    last_exc = e
-                    attempts += 1
-                    time.sleep(base_sleep)
-                except Exception as e:
-                    last_exc = e
-                    attempts += 1
-                    time.sleep(0.5)
-            if cursor is None and last_exc:
-                raise last_exc
-            yield cursor
+            if readonly is None:
+                readonly = _lectura_replica.get()
+            if readonly:
+                if cls._replica_utilizable():
+                    pool = cls._pool_replica
+                elif cls._pool_replica is not None:
+                    cls._lecturas_en_primario += 1
+
+            # Espera en cola FIFO (sin sondeos) hasta POOL_ACQUIRE_TIMEOUT_SECONDS.
+            # Sin ping por préstamo: la zona horaria se fija al conectar y el
+            # validador del pool revisa las conexiones libres en segundo plano.
+            conn = pool.getconn()
+            if conn.closed:
+                caida, conn = conn, None
+                conn = pool.replace(caida)
+            cursor = conn.cursor()
+            callbacks = []
+            token_callbacks = _al_confirmar_actual.set(callbacks)
+            token_cursor = _cursor_actual.set(cursor)
+            try:
+                yield cursor
+            finally:
+                _cursor_actual.reset(token_cursor)
+                _al_confirmar_actual.reset(token_callbacks)
             conn.commit()
+            _ejecutar_callbacks(callbacks)
         except Exception as e:
             if conn:
-                conn.rollback()
+                try:
+                    conn.rollback()
+                except Exception:
+                    # Conexión caída a mitad de operación: no devolverla al pool como sana
+                    roto = True
             logger.error(f"Error en operación de BD: {e}")
             raise
         finally:
             if cursor:
-                cursor.close()
+                try:
+                    cursor.close()
+                except Exception:
+                    pass
             if conn:
                 try:
-                    cls._pool.putconn(conn)
+                    pool.putconn(conn, close=roto or bool(conn.closed))
                 except Exception:
                     try:
                         conn.close()
                     except Exception:
                         pass
 
+    @classmethod
+    def tiene_replica(cls) -> bool:
+        return cls._pool_replica is not None
+
+    @classmethod
+    def abrir_unidad(cls) -> UnidadDeTrabajo:
+        """Toma una conexión del pool para una unidad de trabajo (bloqueante)."""
+        if cls._pool is None:
+            raise RuntimeError("DatabasePool no está inicializado. Llama DatabasePool.initialize() en startup.")
+        conn = cls._pool.getconn()
+        if conn.closed:
+            conn = cls._pool.replace(conn)
+        return UnidadDeTrabajo(conn)
+
+    @classmethod
+    def cerrar_unidad(cls, unidad: UnidadDeTrabajo, confirmar: bool):
+        """Confirma (o revierte) la transacción de la unidad y devuelve la conexión."""
+        conn = unidad.conn
+        roto = unidad.rota
+        confirmada = False
+        try:
+            if confirmar and not roto:
+                conn.commit()
+                confirmada = True
+            else:
+                conn.rollback()
+        except Exception as e:
+            roto = True
+            logger.error(f"Error al cerrar unidad de trabajo: {e}")
+            if confirmar:
+                raise
+        finally:
+            try:
+                cls._pool.putconn(conn, close=roto or bool(conn.closed))
+            except Exception:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+        if confirmada:
+            _ejecutar_callbacks(unidad.al_confirmar)
+
+    @classmethod
+    def despues_de_confirmar(cls, callback):
+        """
+        Ejecuta callback cuando se confirme la transacción actual (la unidad de
+        trabajo o el get_cursor() en curso); si no hay ninguna, de inmediato.
+        Si la transacción se revierte, el callback no se ejecuta.
+        """
+        unidad = _unidad_actual.get()
+        if unidad is not None:
+            unidad.al_confirmar.append(callback)
+            return
+        callbacks = _al_confirmar_actual.get()
+        if callbacks is not None:
+            callbacks.append(callback)
+            return
+        _ejecutar_callbacks([callback])
+
+    @classmethod
+    def notificar(cls, canal: str, payload: str):
+        """
+        pg_notify dentro de la transacción actual (unidad de trabajo o get_cursor()
+        en curso): PostgreSQL lo entrega a los que escuchan solo si se confirma.
+        Sin transacción abierta se envía en una propia.
+        """
+        sql = "SELECT pg_notify(%s, %s)"
+        unidad = _unidad_actual.get()
+        if unidad is not None:
+            with unidad.cursor() as cursor:
+                cursor.execute(sql, (canal, payload))
+            return
+        cursor = _cursor_actual.get()
+        if cursor is not None and not cursor.closed:
+            cursor.execute(sql, (canal, payload))
+            return
+        with cls.get_cursor(readonly=False) as cursor:
+            cursor.execute(sql, (canal, payload))
+
+    @classmethod
+    def activar_unidad(cls, unidad: UnidadDeTrabajo):
+        """Hace que los get_cursor() del contexto actual usen la unidad. Retorna el token para desactivarla."""
+        return _unidad_actual.set(unidad)
+
+    @classmethod
+    def desactivar_unidad(cls, token):
+        try:
+            _unidad_actual.reset(token)
+        except ValueError:
+            # Token creado en otro contexto (p. ej. otro hilo): limpiar igualmente
+            _unidad_actual.set(None)
+
+    @classmethod
+    @contextmanager
+    def unidad_de_trabajo(cls):
+        """
+        Unidad de trabajo síncrona (scripts/tareas): una conexión y una transacción
+        para todos los get_cursor() del bloque; commit al final o rollback si falla.
+        """
+        unidad = cls.abrir_unidad()
+        token = cls.activar_unidad(unidad)
+        try:
+            yield unidad
+        except BaseException:
+            cls.desactivar_unidad(token)
+            cls.cerrar_unidad(unidad, confirmar=False)
+            raise
+        cls.desactivar_unidad(token)
+        cls.cerrar_unidad(unidad, confirmar=True)
+
+    @classmethod
+    def iniciar_medicion(cls):
+        """Comienza a medir las consultas del contexto actual. Retorna (medicion, token)."""
+        medicion = MedicionConsultas()
+        return medicion, _medicion_actual.set(medicion)
+
+    @classmethod
+    def finalizar_medicion(cls, token):
+        try:
+            _medicion_actual.reset(token)
+        except ValueError:
+            _medicion_actual.set(None)
+
+    @classmethod
+    def stats(cls) -> dict:
+        """Estadísticas del pool (conexiones en uso/libres, esperas, timeouts)."""
+        if cls._pool is None:
+            return {}
+        return cls._pool.stats()
+
+    @classmethod
+    def stats_replica(cls) -> dict:
+        """Estadísticas del pool de réplica, su estado y lecturas desviadas al primario."""
+        if cls._pool_replica is None:
+            return {}
+        datos = cls._pool_replica.stats()
+        datos['up_to_date'] = cls._replica_al_dia
+        datos['primary_fallbacks'] = cls._lecturas_en_primario
+        return datos
+
     @classmethod
     def close_all(cls):
         """Cierra todas las conexiones del pool"""
+        if cls._pool_replica:
+            cls._pool_replica.closeall()
+            cls._pool_replica = None
         if cls._pool:
             cls._pool.closeall()
             logger.info("Pool de conexiones cerrado") 
\ No newline at end of file
@@ -10,4 +10,13 @@ DB_CONFIG = {
     'user': os.getenv('DB_USER', ''),
     'password': os.getenv('DB_PASSWORD', ''),
     'port': os.getenv('DB_PORT', '5432'),
-}
\ No newline at end of file
+}
+# Réplica de lectura opcional para reportes. Solo DB_REPLICA_HOST es obligatorio;
+# el resto de los datos de conexión se toman del primario si no se indican.
+DB_REPLICA_CONFIG = {
+    'host': os.getenv('DB_REPLICA_HOST', ''),
+    'database': os.getenv('DB_REPLICA_NAME', DB_CONFIG['database']),
+    'user': os.getenv('DB_REPLICA_USER', DB_CONFIG['user']),
+    'password': os.getenv('DB_REPLICA_PASSWORD', DB_CONFIG['password']),
+    'port': os.getenv('DB_REPLICA_PORT', DB_CONFIG['port']),
+} if os.getenv('DB_REPLICA_HOST') else None
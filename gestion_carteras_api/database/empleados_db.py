@@ -1,10 +1,38 @@
 from .connection_pool import DatabasePool
+from .cache import crear_cache
+from . import cache_bus
 import logging
+import os
 from typing import List, Dict, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+# Caché de la lista de empleados por cuenta (invalidado entre instancias vía cache_bus)
+_cache = crear_cache(
+    'empleados',
+    max_entradas=int(os.getenv('CACHE_EMPLEADOS_MAX_ENTRADAS', '200')),
+    ttl_segundos=float(os.getenv('CACHE_EMPLEADOS_TTL_SECONDS', '300')),
+)
+
+def invalidar_cache_empleados(cuenta_id: Optional[int] = None):
+    """Invalida la lista de empleados de una cuenta (o de todas) en todas las instancias."""
+    cache_bus.publicar('empleados', cuenta_id)
+
+def _invalidar_cache_local(cuenta_id: Optional[str] = None):
+    if cuenta_id:
+        _cache.invalidar(str(cuenta_id))
+    else:
+        _cache.invalidar_todo()
+
+cache_bus.registrar_ambito('empleados', _invalidar_cache_local)
+
 def obtener_empleados(cuenta_id: int):
+    usar_cache = cache_bus.cache_habilitado('CACHE_EMPLEADOS_ENABLED')
+    if usar_cache:
+        cacheado = _cache.get(str(cuenta_id), 'lista')
+        if cacheado is not None:
+            return [dict(e) for e in cacheado]
+        generacion = _cache.generacion(str(cuenta_id))
     try:
         with DatabasePool.get_cursor() as cursor:
             cursor.execute('''
@@ -24,7 +52,9 @@ def obtener_empleados(cuenta_id: int):
                     'direccion': row[3]
                 }
                 empleados.append(empleado)
-            return empleados
+        if usar_cache:
+            _cache.set(str(cuenta_id), 'lista', [dict(e) for e in empleados], generacion)
+        return empleados
     except Exception as e:
         logger.error(f"Error al obtener empleados: {e}")
         return []
@@ -38,7 +68,9 @@ def insertar_empleado(identificacion: str, nombre: str, telefono: str, direccion
                 VALUES (%s, %s, %s, %s, %s)
                 RETURNING identificacion
             ''', (identificacion, nombre, telefono, direccion, cuenta_id))
-            return cursor.fetchone()[0]
+            nueva = cursor.fetchone()[0]
+            invalidar_cache_empleados(cuenta_id)
+            return nueva
     except Exception as e:
         logger.error(f"Error al insertar empleado: {e}")
         return None
@@ -53,7 +85,10 @@ def actualizar_empleado(identificacion: str, nombre: str, telefono: str, direcci
                 WHERE identificacion = %s AND cuenta_id = %s
                 RETURNING identificacion
             ''', (nombre, telefono, direccion, identificacion, cuenta_id))
-            return cursor.fetchone() is not None
+            actualizado = cursor.fetchone() is not None
+            if actualizado:
+                invalidar_cache_empleados(cuenta_id)
+            return actualizado
     except Exception as e:
         logger.error(f"Error al actualizar empleado: {e}")
         return False
@@ -63,7 +98,10 @@ def eliminar_empleado(identificacion: str, cuenta_id: int) -> bool:
         with DatabasePool.get_cursor() as cursor:
             cursor.execute('DELETE FROM empleados WHERE identificacion = %s AND cuenta_id = %s RETURNING identificacion', 
                          (identificacion, cuenta_id))
-            return cursor.fetchone() is not None
+            eliminado = cursor.fetchone() is not None
+            if eliminado:
+                invalidar_cache_empleados(cuenta_id)
+            return eliminado
     except Exception as e:
         logger.error(f"Error al eliminar empleado: {e}")
         return False
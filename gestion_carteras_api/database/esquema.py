@@ -0,0 +1,117 @@
+"""
+Registro de capacidades del esquema (tablas, columnas y funciones existentes).
+
+Se carga una vez al arrancar leyendo el catálogo (pg_class/pg_attribute para
+tablas y columnas, pg_proc para funciones) y los helpers deciden con él qué SQL
+usar, sin sondear el catálogo en cada request. Se refresca tras aplicar DDL (o
+con Esquema.refrescar()). Si la carga falla, el primer uso la reintenta como
+mucho cada ESQUEMA_REINTENTO_SECONDS.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Dict, FrozenSet, Tuple
+
+from .connection_pool import DatabasePool
+
+logger = logging.getLogger(__name__)
+
+
+class Esquema:
+    # tabla -> columnas en orden (attnum); solo el esquema public
+    _tablas: Dict[str, Tuple[str, ...]] = {}
+    # funciones del esquema public (p. ej. busqueda_normalizar de la migración 016)
+    _funciones: FrozenSet[str] = frozenset()
+    _cargado = False
+    _lock = threading.Lock()
+    # Último intento de carga perezosa (time.monotonic) y espera entre intentos
+    _ultimo_intento = 0.0
+    _reintento_segundos = float(os.getenv('ESQUEMA_REINTENTO_SECONDS', '30'))
+
+    @classmethod
+    def refrescar(cls) -> bool:
+        """Relee tablas, columnas y funciones del esquema public. Devuelve False si no pudo."""
+        try:
+            with DatabasePool.get_cursor(readonly=False) as cur:
+                cur.execute(
+                    """
+                    SELECT c.relname, a.attname
+                    FROM pg_class c
+                    JOIN pg_namespace n ON n.oid = c.relnamespace
+                    LEFT JOIN pg_attribute a
+                      ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+                    WHERE n.nspname = 'public'
+                      AND c.relkind IN ('r', 'p', 'v', 'm')
+                    ORDER BY c.relname, a.attnum
+                    """
+                )
+                filas = cur.fetchall()
+                cur.execute(
+                    """
+                    SELECT DISTINCT p.proname
+                    FROM pg_proc p
+                    JOIN pg_namespace n ON n.oid = p.pronamespace
+                    WHERE n.nspname = 'public'
+                    """
+                )
+                funciones = frozenset(f[0] for f in cur.fetchall())
+        except Exception as e:
+            logger.error(f"Error al cargar el esquema de la base de datos: {e}")
+            return False
+        tablas: Dict[str, list] = {}
+        for tabla, columna in filas:
+            columnas = tablas.setdefault(tabla, [])
+            if columna is not None:
+                columnas.append(columna)
+        with cls._lock:
+            cls._tablas = {t: tuple(cols) for t, cols in tablas.items()}
+            cls._funciones = funciones
+            cls._cargado = True
+        logger.info(f"Esquema cargado: {len(tablas)} tablas")
+        return True
+
+    @classmethod
+    def _asegurar_cargado(cls):
+        # Normalmente lo carga el startup; si falló, se reintenta al usarlo pero
+        # no más de una vez por intervalo (con la BD caída cada request no debe
+        # sumar dos consultas al catálogo que van a fallar)
+        if not cls._cargado:
+            with cls._lock:
+                if cls._cargado:
+                    return
+                ahora = time.monotonic()
+                if cls._ultimo_intento and ahora - cls._ultimo_intento < cls._reintento_segundos:
+                    return
+                cls._ultimo_intento = ahora
+            cls.refrescar()
+
+    @classmethod
+    def tiene_tabla(cls, tabla: str) -> bool:
+        cls._asegurar_cargado()
+        return tabla in cls._tablas
+
+    @classmethod
+    def tiene_columna(cls, tabla: str, columna: str) -> bool:
+        cls._asegurar_cargado()
+        return columna in cls._tablas.get(tabla, ())
+
+    @classmethod
+    def tiene_columnas(cls, tabla: str, *columnas: str) -> bool:
+        cls._asegurar_cargado()
+        existentes = cls._tablas.get(tabla, ())
+        return all(c in existentes for c in columnas)
+
+    @classmethod
+    def columnas(cls, tabla: str) -> Tuple[str, ...]:
+        cls._asegurar_cargado()
+        return cls._tablas.get(tabla, ())
+
+    @classmethod
+    def tiene_funcion(cls, funcion: str) -> bool:
+        cls._asegurar_cargado()
+        return funcion in cls._funciones
+
+    @classmethod
+    def cargado(cls) -> bool:
+        return cls._cargado
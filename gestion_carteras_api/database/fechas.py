@@ -0,0 +1,43 @@
+"""
+Límites UTC de un día local.
+
+Los timestamps se guardan en UTC sin zona. Filtrar un día local con
+`(col AT TIME ZONE 'UTC' AT TIME ZONE tz)::date = d` obliga a evaluar la
+expresión en cada fila; en su lugar se compara contra el rango semiabierto
+[inicio, fin) en UTC, que usa los índices sobre la columna.
+
+El rango es exactamente el conjunto de instantes cuya fecha local es `d`:
+inicio = medianoche local de d, fin = medianoche local de d+1 (en días con
+cambio de horario el rango dura 23 o 25 horas).
+"""
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Optional, Tuple
+
+from zoneinfo import ZoneInfo
+
+
+def zona_horaria(tz_name: Optional[str]):
+    """ZoneInfo de la cuenta/usuario; UTC si no viene o no es válida."""
+    try:
+        return ZoneInfo(tz_name) if tz_name else timezone.utc
+    except Exception:
+        return timezone.utc
+
+
+def _medianoche_utc(dia: date, tz) -> datetime:
+    # fold=0: si la medianoche cae en un salto de horario, se toma el instante
+    # del cambio; si se repite, su primera ocurrencia
+    local = datetime.combine(dia, time(0, 0), tzinfo=tz)
+    return local.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def limites_dia_utc(fecha: date, tz_name: Optional[str] = None) -> Tuple[datetime, datetime]:
+    """[inicio, fin) en UTC sin zona del día local `fecha`: usar `col >= inicio AND col < fin`."""
+    tz = zona_horaria(tz_name)
+    return _medianoche_utc(fecha, tz), _medianoche_utc(fecha + timedelta(days=1), tz)
+
+
+def limites_rango_utc(desde: date, hasta: date, tz_name: Optional[str] = None) -> Tuple[datetime, datetime]:
+    """[inicio, fin) en UTC sin zona de los días locales desde..hasta (ambos incluidos)."""
+    tz = zona_horaria(tz_name)
+    return _medianoche_utc(desde, tz), _medianoche_utc(hasta + timedelta(days=1), tz)
@@ -1,4 +1,5 @@
 from .connection_pool import DatabasePool
+from .paginacion import consulta_keyset
 import logging
 from datetime import datetime, date
 from typing import List, Dict, Optional, Tuple
@@ -13,18 +14,27 @@ def obtener_tipos_gastos() -> List[Tuple]:
     """Obtiene todos los tipos de gastos disponibles (valores fijos)"""
     return [(i+1, tipo, f'Gastos de {tipo.lower()}') for i, tipo in enumerate(TIPOS_GASTOS)]
 
-def obtener_todos_los_gastos(skip: int = 0, limit: int = 100) -> List[Dict]:
-    """Obtiene todos los gastos con paginación"""
+# Clave de orden del listado general (id desempata)
+ORDEN_GASTOS = (('g.fecha_creacion', 'fecha_creacion'), ('g.id', 'id'))
+
+def obtener_todos_los_gastos(skip: int = 0, limit: int = 100, despues: Optional[Tuple] = None) -> List[Dict]:
+    """
+    Obtiene todos los gastos con paginación, del más reciente al más antiguo.
+    despues=(fecha_creacion, id) de la última fila anterior pagina por cursor.
+    """
     try:
         with DatabasePool.get_cursor() as cursor:
-            cursor.execute('''
+            query, params = consulta_keyset(
+                '''
                 SELECT g.id, g.empleado_identificacion, e.nombre as empleado_nombre, 
                        g.tipo, g.valor, g.observacion, g.fecha, g.fecha_creacion
                 FROM gastos g
                 JOIN empleados e ON g.empleado_identificacion = e.identificacion
-                ORDER BY g.fecha_creacion DESC, g.id DESC
-                OFFSET %s LIMIT %s
-            ''', (skip, limit))
+                ''',
+                '', (), ORDEN_GASTOS, despues, limit,
+                descendente=True, lider_nullable=True, offset=skip,
+            )
+            cursor.execute(query, params)
             rows = cursor.fetchall()
             
             # Convertir tuplas a diccionarios para FastAPI
@@ -0,0 +1,76 @@
+import logging
+from typing import Dict, List, Tuple
+
+from .connection_pool import DatabasePool
+
+logger = logging.getLogger(__name__)
+
+# (tabla, nombre, columnas clave) de los índices que esperan las consultas calientes.
+# Los que vienen de restricciones se reconocen por columnas (su nombre puede variar).
+INDICES_ESPERADOS: List[Tuple[str, str, Tuple[str, ...]]] = [
+    ('abonos', 'idx_abonos_tarjeta_fecha', ('tarjeta_codigo', 'fecha')),
+    ('abonos', 'idx_abonos_fecha_brin', ('fecha',)),
+    ('tarjetas', 'idx_tarjetas_empleado_estado_ruta', ('empleado_identificacion', 'estado', 'numero_ruta')),
+    ('tarjetas', 'idx_tarjetas_activas_empleado_ruta', ('empleado_identificacion', 'numero_ruta')),
+    ('tarjetas', 'idx_tarjetas_cliente', ('cliente_identificacion',)),
+    ('gastos', 'idx_gastos_empleado_fecha', ('empleado_identificacion', 'fecha_creacion')),
+    # Búsqueda por trigramas (el de nombre es por expresión: sin columnas clave)
+    ('clientes', 'idx_clientes_nombre_completo_trgm', ()),
+    ('clientes', 'idx_clientes_identificacion_trgm', ('identificacion',)),
+    ('clientes', 'idx_clientes_telefono_trgm', ('telefono',)),
+    ('bases', 'bases_empleado_id_fecha_key', ('empleado_id', 'fecha')),
+    ('control_caja', 'control_caja_empleado_identificacion_fecha_key', ('empleado_identificacion', 'fecha')),
+]
+
+
+def reporte_indices() -> List[Dict]:
+    """
+    Estado de cada índice esperado: si existe, si es válido y cuánto se usa
+    (pg_stat_user_indexes; los contadores se acumulan desde el último reset de estadísticas).
+    """
+    tablas = sorted({t for t, _, _ in INDICES_ESPERADOS})
+    try:
+        with DatabasePool.get_cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT s.relname, s.indexrelname, s.idx_scan, s.idx_tup_read,
+                       pg_relation_size(s.indexrelid), i.indisvalid,
+                       ARRAY(
+                           SELECT a.attname
+                           FROM unnest(i.indkey[0:i.indnkeyatts - 1]) WITH ORDINALITY AS k(attnum, orden)
+                           JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+                           ORDER BY k.orden
+                       ),
+                       pg_get_indexdef(s.indexrelid)
+                FROM pg_stat_user_indexes s
+                JOIN pg_index i ON i.indexrelid = s.indexrelid
+                WHERE s.schemaname = 'public' AND s.relname = ANY(%s)
+                """,
+                (tablas,),
+            )
+            filas = cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Error al consultar estadísticas de índices: {e}")
+        return []
+
+    por_nombre = {fila[1]: fila for fila in filas}
+    reporte = []
+    for tabla, nombre, columnas in INDICES_ESPERADOS:
+        fila = por_nombre.get(nombre)
+        if fila is None:
+            # Restricciones con otro nombre: reconocer por tabla y columnas clave
+            fila = next((f for f in filas if f[0] == tabla and tuple(f[6]) == columnas), None)
+        item = {
+            'tabla': tabla,
+            'indice': fila[1] if fila else nombre,
+            'columnas': list(columnas),
+            'existe': fila is not None,
+            'valido': bool(fila[5]) if fila else False,
+            'escaneos': int(fila[2] or 0) if fila else 0,
+            'tuplas_leidas': int(fila[3] or 0) if fila else 0,
+            'tamano_bytes': int(fila[4] or 0) if fila else 0,
+            'definicion': fila[7] if fila else None,
+        }
+        item['en_uso'] = item['escaneos'] > 0
+        reporte.append(item)
+    return reporte
@@ -1,12 +1,119 @@
 from .connection_pool import DatabasePool
+from .async_pool import AsyncDatabasePool
 import logging
-from datetime import datetime, date, timezone
-from zoneinfo import ZoneInfo
-from typing import Dict, Optional
+from datetime import date
+from .fechas import limites_dia_utc
+from .tarjetas_db import consulta_tarjetas_sin_abono
+from typing import Dict, List, Optional, Tuple
 from decimal import Decimal
 
 logger = logging.getLogger(__name__)
 
+def _datos_liquidacion_vacios(empleado_identificacion: str, fecha: date) -> Dict:
+    return {
+        'empleado': empleado_identificacion,
+        'fecha': fecha,
+        'tarjetas_activas': 0,
+        'tarjetas_canceladas': 0,
+        'tarjetas_nuevas': 0,
+        'total_registros': 0,
+        'total_recaudado': Decimal('0'),
+        'base_dia': Decimal('0'),
+        'prestamos_otorgados': Decimal('0'),
+        'total_gastos': Decimal('0'),
+        'subtotal': Decimal('0'),
+        'total_final': Decimal('0'),
+        'tarjetas_sin_abono': 0
+    }
+
+def _consultas_liquidacion(empleado_identificacion: str, fecha: date, tz_name: str) -> List[Tuple[str, str, tuple]]:
+    """
+    Consultas de la liquidación diaria como (clave, sql, params). Las ejecutan
+    obtener_datos_liquidacion y su versión asíncrona, en este orden.
+    """
+    # Límites UTC [inicio, fin) del día local (columnas timestamp sin zona) y la fecha local (DATE)
+    start_naive, end_naive = limites_dia_utc(fecha, tz_name)
+    fecha_local = fecha
+
+    return [
+        # 1. Contar tarjetas activas (todas las activas)
+        ('tarjetas_activas', '''
+            SELECT COUNT(*) 
+            FROM tarjetas 
+            WHERE empleado_identificacion = %s AND estado = 'activas'
+        ''', (empleado_identificacion,)),
+        # 2. Contar tarjetas canceladas EN LA FECHA local (fecha_cancelacion es DATE)
+        ('tarjetas_canceladas', '''
+            SELECT COUNT(*) 
+            FROM tarjetas 
+            WHERE empleado_identificacion = %s 
+            AND estado = 'cancelada'
+            AND fecha_cancelacion = %s
+        ''', (empleado_identificacion, fecha_local)),
+        # 3. Contar tarjetas nuevas del día
+        ('tarjetas_nuevas', '''
+            SELECT COUNT(*) 
+            FROM tarjetas 
+            WHERE empleado_identificacion = %s 
+              AND fecha_creacion >= %s AND fecha_creacion < %s
+        ''', (empleado_identificacion, start_naive, end_naive)),
+        # 4. Total de registros (abonos del día)
+        ('total_registros', '''
+            SELECT COUNT(*) 
+            FROM abonos a
+            JOIN tarjetas t ON a.tarjeta_codigo = t.codigo
+            WHERE t.empleado_identificacion = %s 
+              AND a.fecha >= %s AND a.fecha < %s
+        ''', (empleado_identificacion, start_naive, end_naive)),
+        # 5. Total recaudado (suma de abonos del día)
+        ('total_recaudado', '''
+            SELECT COALESCE(SUM(a.monto), 0)
+            FROM abonos a
+            JOIN tarjetas t ON a.tarjeta_codigo = t.codigo
+            WHERE t.empleado_identificacion = %s 
+              AND a.fecha >= %s AND a.fecha < %s
+        ''', (empleado_identificacion, start_naive, end_naive)),
+        # 6. Base del día (desde tabla bases)
+        ('base_dia', '''
+            SELECT COALESCE(SUM(monto), 0)
+            FROM bases
+            WHERE empleado_id = %s 
+            AND fecha = %s
+        ''', (empleado_identificacion, fecha)),
+        # 7. Préstamos otorgados el día (monto de tarjetas nuevas)
+        ('prestamos_otorgados', '''
+            SELECT COALESCE(SUM(monto), 0)
+            FROM tarjetas 
+            WHERE empleado_identificacion = %s 
+              AND fecha_creacion >= %s AND fecha_creacion < %s
+        ''', (empleado_identificacion, start_naive, end_naive)),
+        # 8. Total gastos del día local (usar fecha_creacion entre límites UTC)
+        ('total_gastos', '''
+            SELECT COALESCE(SUM(valor), 0)
+            FROM gastos
+            WHERE empleado_identificacion = %s
+              AND fecha_creacion >= %s AND fecha_creacion < %s
+        ''', (empleado_identificacion, start_naive, end_naive)),
+        # 9. Contar tarjetas activas SIN abono hoy (No dieron): mismo anti-join que el listado
+        ('tarjetas_sin_abono',) + consulta_tarjetas_sin_abono(empleado_identificacion, fecha, tz_name or 'UTC', solo_conteo=True),
+    ]
+
+def _aplicar_resultado_liquidacion(datos: Dict, clave: str, valor) -> None:
+    if isinstance(datos[clave], Decimal):
+        datos[clave] = Decimal(str(valor)) if valor is not None else Decimal('0')
+    else:
+        datos[clave] = valor or 0
+
+def _totalizar_liquidacion(datos: Dict) -> Dict:
+    # Subtotal = Recaudado + Base - Préstamos
+    datos['subtotal'] = (datos['total_recaudado'] + 
+                       datos['base_dia'] - 
+                       datos['prestamos_otorgados'])
+    
+    # Total final = Subtotal - Gastos
+    datos['total_final'] = datos['subtotal'] - datos['total_gastos']
+    return datos
+
 def obtener_datos_liquidacion(empleado_identificacion: str, fecha: date, tz_name: str = 'UTC') -> Dict:
     """
     Obtiene todos los datos necesarios para la liquidación diaria de un empleado
@@ -14,164 +121,37 @@ def obtener_datos_liquidacion(empleado_identificacion: str, fecha: date, tz_name
     Returns:
         Dict con todas las métricas de liquidación
     """
+    datos = _datos_liquidacion_vacios(empleado_identificacion, fecha)
     try:
-        datos = {
-            'empleado': empleado_identificacion,
-            'fecha': fecha,
-            'tarjetas_activas': 0,
-            'tarjetas_canceladas': 0,
-            'tarjetas_nuevas': 0,
-            'total_registros': 0,
-            'total_recaudado': Decimal('0'),
-            'base_dia': Decimal('0'),
-            'prestamos_otorgados': Decimal('0'),
-            'total_gastos': Decimal('0'),
-            'subtotal': Decimal('0'),
-            'total_final': Decimal('0'),
-            'tarjetas_sin_abono': 0
-        }
-        
-        # Calcular límites UTC del día local y la fecha local (DATE)
-        try:
-            tz = ZoneInfo(tz_name or 'UTC')
-        except Exception:
-            tz = ZoneInfo('UTC')
-        start_local = datetime(fecha.year, fecha.month, fecha.day, 0, 0, 0, tzinfo=tz)
-        end_local = datetime(fecha.year, fecha.month, fecha.day, 23, 59, 59, 999000, tzinfo=tz)
-        start_utc = start_local.astimezone(timezone.utc)
-        end_utc = end_local.astimezone(timezone.utc)
-        # Para columnas timestamp sin zona, comparar con límites UTC sin tz (naive)
-        start_naive = start_utc.replace(tzinfo=None)
-        end_naive = end_utc.replace(tzinfo=None)
-        fecha_local = fecha
-        # debug removido
-
         with DatabasePool.get_cursor() as cursor:
-            # 1. Contar tarjetas activas (todas las activas)
-            cursor.execute('''
-                SELECT COUNT(*) 
-                FROM tarjetas 
-                WHERE empleado_identificacion = %s AND estado = 'activas'
-            ''', (empleado_identificacion,))
-            
-            datos['tarjetas_activas'] = cursor.fetchone()[0]
-            
-            # 2. Contar tarjetas canceladas EN LA FECHA local (fecha_cancelacion es DATE)
-            cursor.execute('''
-                SELECT COUNT(*) 
-                FROM tarjetas 
-                WHERE empleado_identificacion = %s 
-                AND estado = 'cancelada'
-                AND fecha_cancelacion = %s
-            ''', (empleado_identificacion, fecha_local))
-            
-            datos['tarjetas_canceladas'] = cursor.fetchone()[0]
-            # debug removido
-            
-            # 3. Contar tarjetas nuevas del día
-            cursor.execute('''
-                SELECT COUNT(*) 
-                FROM tarjetas 
-                WHERE empleado_identificacion = %s 
-                  AND fecha_creacion >= %s AND fecha_creacion <= %s
-            ''', (empleado_identificacion, start_naive, end_naive))
-            
-            datos['tarjetas_nuevas'] = cursor.fetchone()[0]
-            # debug removido
-            
-            # 4. Total de registros (abonos del día)
-            cursor.execute('''
-                SELECT COUNT(*) 
-                FROM abonos a
-                JOIN tarjetas t ON a.tarjeta_codigo = t.codigo
-                WHERE t.empleado_identificacion = %s 
-                  AND a.fecha >= %s AND a.fecha <= %s
-            ''', (empleado_identificacion, start_naive, end_naive))
-            
-            total_registros = cursor.fetchone()[0]
-            datos['total_registros'] = total_registros
-            logger.info(f"Abonos del día encontrados: {total_registros} para {empleado_identificacion} en {fecha}")
-            
-            # 5. Total recaudado (suma de abonos del día)
-            cursor.execute('''
-                SELECT COALESCE(SUM(a.monto), 0)
-                FROM abonos a
-                JOIN tarjetas t ON a.tarjeta_codigo = t.codigo
-                WHERE t.empleado_identificacion = %s 
-                  AND a.fecha >= %s AND a.fecha <= %s
-            ''', (empleado_identificacion, start_naive, end_naive))
-            
-            result = cursor.fetchone()[0]
-            datos['total_recaudado'] = Decimal(str(result)) if result else Decimal('0')
-            logger.info(f"Total recaudado: ${datos['total_recaudado']} para {empleado_identificacion} en {fecha}")
-            
-            # 6. Base del día (desde tabla bases)
-            cursor.execute('''
-                SELECT COALESCE(SUM(monto), 0)
-                FROM bases
-                WHERE empleado_id = %s 
-                AND fecha = %s
-            ''', (empleado_identificacion, fecha))
-            
-            result = cursor.fetchone()[0]
-            datos['base_dia'] = Decimal(str(result)) if result else Decimal('0')
-            
-            # 7. Préstamos otorgados el día (monto de tarjetas nuevas)
-            cursor.execute('''
-                SELECT COALESCE(SUM(monto), 0)
-                FROM tarjetas 
-                WHERE empleado_identificacion = %s 
-                  AND fecha_creacion >= %s AND fecha_creacion <= %s
-            ''', (empleado_identificacion, start_naive, end_naive))
-            
-            result = cursor.fetchone()[0]
-            datos['prestamos_otorgados'] = Decimal(str(result)) if result else Decimal('0')
-            logger.info(f"Préstamos otorgados: ${datos['prestamos_otorgados']} para {empleado_identificacion} en {fecha}")
-            
-            # 8. Total de gastos del día
-            # Total gastos del día local (usar fecha_creacion entre límites UTC)
-            cursor.execute('''
-                SELECT COALESCE(SUM(valor), 0)
-                FROM gastos
-                WHERE empleado_identificacion = %s
-                  AND fecha_creacion >= %s AND fecha_creacion <= %s
-            ''', (empleado_identificacion, start_naive, end_naive))
-            result = cursor.fetchone()[0]
-            datos['total_gastos'] = Decimal(str(result)) if result is not None else Decimal('0')
+            for clave, query, params in _consultas_liquidacion(empleado_identificacion, fecha, tz_name):
+                cursor.execute(query, params)
+                _aplicar_resultado_liquidacion(datos, clave, cursor.fetchone()[0])
 
-            # 9. Contar tarjetas activas SIN abono hoy (No dieron)
-            cursor.execute('''
-                SELECT COUNT(*)
-                FROM tarjetas t
-                WHERE t.empleado_identificacion = %s
-                  AND t.estado = 'activas'
-                  AND t.codigo NOT IN (
-                      SELECT a.tarjeta_codigo 
-                      FROM abonos a
-                      JOIN tarjetas t2 ON a.tarjeta_codigo = t2.codigo
-                      WHERE t2.empleado_identificacion = %s
-                        AND a.fecha >= %s 
-                        AND a.fecha <= %s
-                  )
-            ''', (empleado_identificacion, empleado_identificacion, start_naive, end_naive))
-            datos['tarjetas_sin_abono'] = cursor.fetchone()[0]
-            
-            # 10. Calcular totales
-            # Subtotal = Recaudado + Base - Préstamos
-            datos['subtotal'] = (datos['total_recaudado'] + 
-                               datos['base_dia'] - 
-                               datos['prestamos_otorgados'])
-            
-            # Total final = Subtotal - Gastos
-            datos['total_final'] = datos['subtotal'] - datos['total_gastos']
-            
-            logger.info(f"Liquidación calculada para {empleado_identificacion} - {fecha}")
-            return datos
+            logger.info(
+                f"Liquidación calculada para {empleado_identificacion} - {fecha}: "
+                f"abonos={datos['total_registros']} recaudado=${datos['total_recaudado']} "
+                f"prestamos=${datos['prestamos_otorgados']}"
+            )
+            return _totalizar_liquidacion(datos)
             
     except Exception as e:
         logger.error(f"Error al obtener datos de liquidación: {e}")
         return datos
 
+async def obtener_datos_liquidacion_async(empleado_identificacion: str, fecha: date, tz_name: str = 'UTC') -> Dict:
+    """Versión asíncrona de obtener_datos_liquidacion (mismas consultas y resultado)."""
+    datos = _datos_liquidacion_vacios(empleado_identificacion, fecha)
+    try:
+        async with AsyncDatabasePool.get_cursor() as cursor:
+            for clave, query, params in _consultas_liquidacion(empleado_identificacion, fecha, tz_name):
+                await cursor.execute(query, params)
+                _aplicar_resultado_liquidacion(datos, clave, (await cursor.fetchone())[0])
+        return _totalizar_liquidacion(datos)
+    except Exception as e:
+        logger.error(f"Error al obtener datos de liquidación (async): {e}")
+        return datos
+
 def obtener_base_empleado_fecha(empleado_identificacion: str, fecha: date) -> Decimal:
     """Obtiene la base asignada a un empleado en una fecha específica"""
     try:
@@ -236,8 +216,9 @@ def asignar_base_empleado(empleado_identificacion: str, fecha: date, monto: Deci
         logger.error(f"Error al asignar base: {e}")
         return False
 
-def obtener_resumen_financiero_fecha(fecha: date) -> Dict:
-    """Obtiene un resumen financiero de todos los empleados para una fecha"""
+def obtener_resumen_financiero_fecha(fecha: date, tz_name: Optional[str] = None) -> Dict:
+    """Obtiene un resumen financiero de todos los empleados para una fecha (día UTC si no se indica zona)"""
+    inicio, fin = limites_dia_utc(fecha, tz_name)
     try:
         resumen = {
             'fecha': fecha,
@@ -253,8 +234,8 @@ def obtener_resumen_financiero_fecha(fecha: date) -> Dict:
             cursor.execute('''
                 SELECT COALESCE(SUM(a.monto), 0)
                 FROM abonos a
-                WHERE DATE(a.fecha) = %s
-            ''', (fecha,))
+                WHERE a.fecha >= %s AND a.fecha < %s
+            ''', (inicio, fin))
             
             result = cursor.fetchone()[0]
             resumen['total_recaudado_todos'] = Decimal(str(result)) if result else Decimal('0')
@@ -273,8 +254,8 @@ def obtener_resumen_financiero_fecha(fecha: date) -> Dict:
             cursor.execute('''
                 SELECT COALESCE(SUM(monto), 0)
                 FROM tarjetas
-                WHERE DATE(fecha_creacion) = %s
-            ''', (fecha,))
+                WHERE fecha_creacion >= %s AND fecha_creacion < %s
+            ''', (inicio, fin))
             
             result = cursor.fetchone()[0]
             resumen['total_prestamos_otorgados'] = Decimal(str(result)) if result else Decimal('0')
@@ -313,6 +294,7 @@ def mover_liquidacion(empleado_identificacion: str, fecha_origen: date, fecha_de
             return True
 
         interval_str = f"{int(delta_days)} days"
+        inicio, fin = limites_dia_utc(fecha_origen, tz_name)
 
         with DatabasePool.get_cursor() as cursor:
             # 1. Abonos (ajustando timezone dinámico)
@@ -322,16 +304,16 @@ def mover_liquidacion(empleado_identificacion: str, fecha_origen: date, fecha_de
                 FROM tarjetas t
                 WHERE a.tarjeta_codigo = t.codigo
                   AND t.empleado_identificacion = %s
-                  AND (a.fecha AT TIME ZONE 'UTC' AT TIME ZONE %s)::date = %s
-            ''', (empleado_identificacion, tz_name, fecha_origen))
+                  AND a.fecha >= %s AND a.fecha < %s
+            ''', (empleado_identificacion, inicio, fin))
 
             # 2. Tarjetas creadas
             cursor.execute(f'''
                 UPDATE tarjetas
                 SET fecha_creacion = fecha_creacion + INTERVAL '{interval_str}'
                 WHERE empleado_identificacion = %s
-                  AND (fecha_creacion AT TIME ZONE 'UTC' AT TIME ZONE %s)::date = %s
-            ''', (empleado_identificacion, tz_name, fecha_origen))
+                  AND fecha_creacion >= %s AND fecha_creacion < %s
+            ''', (empleado_identificacion, inicio, fin))
 
             # 2.1 Tarjetas canceladas (fecha_cancelacion es DATE, no necesita tz shift si se almacena como tal)
             # Pero si se almacena con hora o si el usuario ve "cancelada hoy" y en DB es fecha, usualmente es DATE puro.
@@ -350,13 +332,16 @@ def mover_liquidacion(empleado_identificacion: str, fecha_origen: date, fecha_de
                   AND fecha_cancelacion = %s
             ''', (empleado_identificacion, fecha_origen))
 
+            from .tarjetas_db import invalidar_cache_tarjetas
+            invalidar_cache_tarjetas(empleado_identificacion)
+
             # 3. Gastos (fecha_creacion es TIMESTAMP)
             cursor.execute(f'''
                 UPDATE gastos
                 SET fecha_creacion = fecha_creacion + INTERVAL '{interval_str}'
                 WHERE empleado_identificacion = %s
-                  AND (fecha_creacion AT TIME ZONE 'UTC' AT TIME ZONE %s)::date = %s
-            ''', (empleado_identificacion, tz_name, fecha_origen))
+                  AND fecha_creacion >= %s AND fecha_creacion < %s
+            ''', (empleado_identificacion, inicio, fin))
             
             # 3.1 Gastos (fecha date column if exists)
             # Intentamos actualizar también la columna 'fecha' si coincide con origen
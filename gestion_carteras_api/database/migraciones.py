@@ -0,0 +1,286 @@
+"""
+Runner de migraciones versionadas (archivos .sql en database/migrations/).
+
+- Versión = nombre del archivo sin .sql; solo se toman los que empiezan con
+  tres dígitos (p. ej. 013_tarjetas_modalidad_pago.sql), en orden de nombre.
+  Los scripts manuales (diagnostico_*, zz_*, fechados) se ignoran.
+- Cada versión aplicada queda en schema_migraciones con su checksum (sha256).
+  Si un archivo ya aplicado cambia, el runner se detiene: no se editan
+  migraciones aplicadas, se agrega una nueva.
+- Un archivo se ejecuta en una sola transacción junto con su registro, salvo
+  que contenga CREATE/DROP INDEX CONCURRENTLY o la marca
+  "-- migracion: sin-transaccion": entonces cada sentencia va en autocommit.
+  Si una de esas falla a mitad, puede quedar un índice INVALID; la migración
+  debe poder reintentarse (DROP INDEX CONCURRENTLY IF EXISTS antes de crearlo).
+- Se corren como paso del deploy (scripts/migrate.py), antes de arrancar las
+  instancias nuevas. Todo corre bajo un advisory lock: si otro proceso está
+  migrando se espera como mucho DB_MIGRATION_WAIT_SECONDS (pg_try_advisory_lock
+  en bucle) y luego se lanza MigracionEnCurso, sin quedar bloqueado detrás de
+  un CREATE INDEX CONCURRENTLY o un backfill largo.
+- Las versiones hasta VERSION_BASE se aplicaron a mano antes del runner: al
+  crear la tabla de seguimiento se registran como 'baseline' sin ejecutarlas.
+  Las posteriores (011 en adelante) llegaron con el runner y siempre se
+  ejecutan; son idempotentes por si alguna ya se corrió a mano.
+"""
+import hashlib
+import logging
+import os
+import pathlib
+import re
+import time
+from typing import List, Optional, Tuple
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+DIRECTORIO = pathlib.Path(__file__).resolve().parent / "migrations"
+
+# Última versión aplicada a mano (con scripts/apply_sql.py) antes del runner
+VERSION_BASE = "010"
+
+# Clave del advisory lock (arbitraria, fija para toda la aplicación)
+CLAVE_LOCK = 7301001
+
+_PATRON_VERSION = re.compile(r"^\d{3}[a-z]?_.+\.sql$")
+_PATRON_SIN_TRANSACCION = re.compile(
+    r"--\s*migracion:\s*sin-transaccion|\b(CREATE|DROP)\s+(UNIQUE\s+)?INDEX\s+CONCURRENTLY\b",
+    re.IGNORECASE,
+)
+
+_SQL_TABLA_SEGUIMIENTO = """
+    CREATE TABLE IF NOT EXISTS schema_migraciones (
+        version TEXT PRIMARY KEY,
+        checksum TEXT NOT NULL,
+        modo VARCHAR(20) NOT NULL,          -- 'baseline' | 'transaccion' | 'sin_transaccion'
+        duracion_ms INTEGER,
+        aplicada_en TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'UTC')
+    )
+"""
+
+
+class MigracionError(Exception):
+    pass
+
+
+class MigracionEnCurso(MigracionError):
+    """Otro proceso tiene el lock de migraciones y no lo soltó dentro del plazo."""
+    pass
+
+
+def _tomar_lock(conn, espera_segundos: float):
+    """Toma el advisory lock de migraciones esperando como mucho `espera_segundos`."""
+    limite = time.monotonic() + max(espera_segundos, 0)
+    with conn.cursor() as cur:
+        while True:
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (CLAVE_LOCK,))
+            if cur.fetchone()[0]:
+                return
+            if time.monotonic() >= limite:
+                raise MigracionEnCurso(
+                    f"Otro proceso está aplicando migraciones (lock {CLAVE_LOCK} ocupado más de {espera_segundos:g}s)"
+                )
+            time.sleep(1)
+
+
+def split_statements(sql: str):
+    """
+    Separa el script en sentencias por ';' respetando comillas simples,
+    comentarios '--' y bloques $$...$$ (cuerpos de funciones plpgsql).
+    """
+    statements = []
+    buf = []
+    i = 0
+    n = len(sql)
+    dollar_tag = None
+    in_quote = False
+    while i < n:
+        ch = sql[i]
+        if dollar_tag:
+            if sql.startswith(dollar_tag, i):
+                buf.append(dollar_tag)
+                i += len(dollar_tag)
+                dollar_tag = None
+                continue
+        elif in_quote:
+            if ch == "'":
+                in_quote = False
+        elif ch == "'":
+            in_quote = True
+        elif sql.startswith('--', i):
+            fin = sql.find('\n', i)
+            fin = n if fin == -1 else fin
+            buf.append(sql[i:fin])
+            i = fin
+            continue
+        elif ch == '$':
+            m = re.match(r'\$[A-Za-z_]*\$', sql[i:])
+            if m:
+                dollar_tag = m.group(0)
+                buf.append(dollar_tag)
+                i += len(dollar_tag)
+                continue
+        elif ch == ';':
+            statements.append(''.join(buf))
+            buf = []
+            i += 1
+            continue
+        buf.append(ch)
+        i += 1
+    statements.append(''.join(buf))
+    # Descartar fragmentos vacíos o que solo contienen comentarios
+    result = []
+    for stmt in statements:
+        lineas = [l for l in stmt.strip().splitlines() if l.strip() and not l.strip().startswith('--')]
+        if lineas:
+            result.append(stmt.strip())
+    return result
+
+
+class Migracion:
+    def __init__(self, ruta: pathlib.Path):
+        self.ruta = ruta
+        self.version = ruta.stem
+        self.sql = ruta.read_text(encoding="utf-8")
+        self.checksum = hashlib.sha256(self.sql.encode("utf-8")).hexdigest()
+        self.sin_transaccion = bool(_PATRON_SIN_TRANSACCION.search(self.sql))
+
+    @property
+    def es_base(self) -> bool:
+        return self.version[:3] <= VERSION_BASE
+
+
+def descubrir(directorio: pathlib.Path = DIRECTORIO) -> List[Migracion]:
+    """Migraciones versionadas del directorio, en orden de aplicación."""
+    archivos = sorted(p for p in directorio.glob("*.sql") if _PATRON_VERSION.match(p.name))
+    return [Migracion(p) for p in archivos]
+
+
+def _aplicadas(cur) -> dict:
+    cur.execute("SELECT version, checksum FROM schema_migraciones")
+    return {version: checksum for version, checksum in cur.fetchall()}
+
+
+def _registrar(cur, migracion: Migracion, modo: str, duracion_ms: Optional[int]):
+    cur.execute(
+        "INSERT INTO schema_migraciones (version, checksum, modo, duracion_ms) VALUES (%s, %s, %s, %s)",
+        (migracion.version, migracion.checksum, modo, duracion_ms),
+    )
+
+
+def _crear_seguimiento(conn, migraciones: List[Migracion]):
+    """Crea la tabla de seguimiento; si es nueva, registra las versiones base sin ejecutarlas."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('public.schema_migraciones')")
+        existia = cur.fetchone()[0] is not None
+        if existia:
+            return
+        cur.execute(_SQL_TABLA_SEGUIMIENTO)
+        for migracion in migraciones:
+            if migracion.es_base:
+                _registrar(cur, migracion, 'baseline', None)
+    conn.commit()
+    logger.info("Tabla schema_migraciones creada; versiones hasta %s registradas como baseline", VERSION_BASE)
+
+
+def _aplicar(conn, migracion: Migracion, lock_timeout: str):
+    inicio = time.perf_counter()
+    sentencias = split_statements(migracion.sql)
+    if migracion.sin_transaccion:
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SET lock_timeout = %s", (lock_timeout,))
+                for sentencia in sentencias:
+                    cur.execute(sentencia)
+                _registrar(cur, migracion, 'sin_transaccion', int((time.perf_counter() - inicio) * 1000))
+        finally:
+            conn.autocommit = False
+    else:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SET LOCAL lock_timeout = %s", (lock_timeout,))
+                for sentencia in sentencias:
+                    cur.execute(sentencia)
+                _registrar(cur, migracion, 'transaccion', int((time.perf_counter() - inicio) * 1000))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    logger.info(f"Migración aplicada: {migracion.version} ({int((time.perf_counter() - inicio) * 1000)} ms)")
+
+
+def aplicar_migraciones(db_config: dict, directorio: pathlib.Path = DIRECTORIO) -> List[str]:
+    """
+    Aplica las migraciones pendientes bajo advisory lock y devuelve sus versiones.
+    Lanza MigracionError si un archivo aplicado cambió o una migración falla y
+    MigracionEnCurso si otro proceso retiene el lock más de DB_MIGRATION_WAIT_SECONDS.
+    """
+    migraciones = descubrir(directorio)
+    # Esperar locks de tablas calientes poco tiempo: mejor fallar el deploy que bloquear la operación
+    lock_timeout = os.getenv("DB_MIGRATION_LOCK_TIMEOUT", "10s")
+    espera_lock = float(os.getenv("DB_MIGRATION_WAIT_SECONDS", "60"))
+    config = {k: v for k, v in db_config.items() if k != 'cursor_factory'}
+    config.setdefault('connect_timeout', 10)
+    conn = psycopg2.connect(**config)
+    aplicadas_ahora: List[str] = []
+    try:
+        conn.autocommit = True
+        _tomar_lock(conn, espera_lock)
+        conn.autocommit = False
+        try:
+            _crear_seguimiento(conn, migraciones)
+            with conn.cursor() as cur:
+                aplicadas = _aplicadas(cur)
+            conn.commit()
+
+            for migracion in migraciones:
+                checksum = aplicadas.get(migracion.version)
+                if checksum is not None:
+                    if checksum != migracion.checksum:
+                        raise MigracionError(
+                            f"La migración {migracion.version} cambió después de aplicarse (checksum distinto)"
+                        )
+                    continue
+                try:
+                    _aplicar(conn, migracion, lock_timeout)
+                except Exception as e:
+                    raise MigracionError(f"Falló la migración {migracion.version}: {e}") from e
+                aplicadas_ahora.append(migracion.version)
+        finally:
+            # El lock es de sesión: cerrar la conexión también lo libera
+            try:
+                conn.rollback()
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute("SELECT pg_advisory_unlock(%s)", (CLAVE_LOCK,))
+            except Exception:
+                pass
+    finally:
+        conn.close()
+    if not aplicadas_ahora:
+        logger.info("Migraciones: esquema al día")
+    return aplicadas_ahora
+
+
+def estado_migraciones(db_config: dict, directorio: pathlib.Path = DIRECTORIO) -> List[Tuple[str, str]]:
+    """(versión, estado) de cada migración: aplicada, pendiente o modificada."""
+    migraciones = descubrir(directorio)
+    config = {k: v for k, v in db_config.items() if k != 'cursor_factory'}
+    conn = psycopg2.connect(**config)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('public.schema_migraciones')")
+            aplicadas = _aplicadas(cur) if cur.fetchone()[0] is not None else {}
+    finally:
+        conn.close()
+    resultado = []
+    for migracion in migraciones:
+        checksum = aplicadas.get(migracion.version)
+        if checksum is None:
+            resultado.append((migracion.version, 'pendiente'))
+        elif checksum != migracion.checksum:
+            resultado.append((migracion.version, 'modificada'))
+        else:
+            resultado.append((migracion.version, 'aplicada'))
+    return resultado
@@ -0,0 +1,81 @@
+-- Seguimiento de cambios para la descarga incremental de rutas
+-- (GET /empleados/{id}/changes?since=<token>).
+--
+-- Cada fila de tarjetas/abonos/clientes guarda en version_txid el txid de la
+-- última transacción que la escribió. El token que recibe la PWA es el xmin del
+-- snapshot del servidor: toda transacción con txid menor ya terminó, por lo que
+-- pedir "version_txid >= token" nunca pierde cambios confirmados más tarde.
+-- Los borrados (y tarjetas que cambian de empleado) quedan en sync_eliminados.
+
+ALTER TABLE tarjetas ADD COLUMN IF NOT EXISTS version_txid BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE abonos ADD COLUMN IF NOT EXISTS version_txid BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE clientes ADD COLUMN IF NOT EXISTS version_txid BIGINT NOT NULL DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS idx_tarjetas_empleado_version ON tarjetas (empleado_identificacion, version_txid);
+CREATE INDEX IF NOT EXISTS idx_abonos_version ON abonos (version_txid);
+CREATE INDEX IF NOT EXISTS idx_clientes_version ON clientes (version_txid);
+
+CREATE TABLE IF NOT EXISTS sync_eliminados (
+    id BIGSERIAL PRIMARY KEY,
+    tabla VARCHAR(20) NOT NULL,              -- 'tarjetas' | 'abonos'
+    clave TEXT NOT NULL,                     -- codigo de tarjeta o id de abono
+    tarjeta_codigo TEXT,
+    empleado_identificacion VARCHAR(20),
+    version_txid BIGINT NOT NULL DEFAULT txid_current(),
+    eliminado_en TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'UTC')
+);
+
+CREATE INDEX IF NOT EXISTS idx_sync_eliminados_empleado_version ON sync_eliminados (empleado_identificacion, version_txid);
+
+CREATE OR REPLACE FUNCTION fn_sync_marcar_version() RETURNS trigger AS $$
+BEGIN
+    NEW.version_txid := txid_current();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_tarjetas_version ON tarjetas;
+CREATE TRIGGER trg_tarjetas_version BEFORE INSERT OR UPDATE ON tarjetas
+    FOR EACH ROW EXECUTE FUNCTION fn_sync_marcar_version();
+
+DROP TRIGGER IF EXISTS trg_abonos_version ON abonos;
+CREATE TRIGGER trg_abonos_version BEFORE INSERT OR UPDATE ON abonos
+    FOR EACH ROW EXECUTE FUNCTION fn_sync_marcar_version();
+
+DROP TRIGGER IF EXISTS trg_clientes_version ON clientes;
+CREATE TRIGGER trg_clientes_version BEFORE INSERT OR UPDATE ON clientes
+    FOR EACH ROW EXECUTE FUNCTION fn_sync_marcar_version();
+
+-- Lápidas: tarjetas borradas o movidas a otro empleado
+CREATE OR REPLACE FUNCTION fn_sync_lapida_tarjeta() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO sync_eliminados (tabla, clave, tarjeta_codigo, empleado_identificacion)
+        VALUES ('tarjetas', OLD.codigo, OLD.codigo, OLD.empleado_identificacion);
+        RETURN OLD;
+    END IF;
+    IF NEW.empleado_identificacion IS DISTINCT FROM OLD.empleado_identificacion THEN
+        INSERT INTO sync_eliminados (tabla, clave, tarjeta_codigo, empleado_identificacion)
+        VALUES ('tarjetas', OLD.codigo, OLD.codigo, OLD.empleado_identificacion);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_tarjetas_lapida ON tarjetas;
+CREATE TRIGGER trg_tarjetas_lapida AFTER DELETE OR UPDATE OF empleado_identificacion ON tarjetas
+    FOR EACH ROW EXECUTE FUNCTION fn_sync_lapida_tarjeta();
+
+-- Lápidas: abonos borrados
+CREATE OR REPLACE FUNCTION fn_sync_lapida_abono() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO sync_eliminados (tabla, clave, tarjeta_codigo, empleado_identificacion)
+    SELECT 'abonos', OLD.id::text, OLD.tarjeta_codigo,
+           (SELECT t.empleado_identificacion FROM tarjetas t WHERE t.codigo = OLD.tarjeta_codigo);
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_abonos_lapida ON abonos;
+CREATE TRIGGER trg_abonos_lapida AFTER DELETE ON abonos
+    FOR EACH ROW EXECUTE FUNCTION fn_sync_lapida_abono();
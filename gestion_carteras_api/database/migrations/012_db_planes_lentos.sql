@@ -0,0 +1,13 @@
+-- Planes EXPLAIN (ANALYZE, BUFFERS) de consultas lentas muestreadas.
+-- Solo se usa con DB_SLOW_QUERY_EXPLAIN_TARGET=tabla (ver CursorMedido en connection_pool.py).
+
+CREATE TABLE IF NOT EXISTS db_planes_lentos (
+    id BIGSERIAL PRIMARY KEY,
+    capturado_en TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'UTC'),
+    sql_normalizado TEXT NOT NULL,
+    llamador TEXT,
+    duracion_ms NUMERIC(12, 1),
+    plan TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_db_planes_lentos_capturado ON db_planes_lentos (capturado_en);
@@ -0,0 +1,7 @@
+-- Modalidad de pago de las tarjetas (diario/semanal/quincenal/mensual).
+-- Antes la agregaba la API en cada arranque (ensure_modalidad_pago_column) y el
+-- script fechado 2025-12-15_add_modalidad_pago_tarjetas.sql.
+-- Con DEFAULT constante el ADD COLUMN no reescribe la tabla (PostgreSQL 11+).
+
+ALTER TABLE tarjetas
+ADD COLUMN IF NOT EXISTS modalidad_pago VARCHAR(20) NOT NULL DEFAULT 'diario';
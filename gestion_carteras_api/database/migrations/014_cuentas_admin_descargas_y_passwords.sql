@@ -0,0 +1,16 @@
+-- Columnas y tablas que antes se creaban desde los endpoints:
+--   - cuentas_admin.timezone_default (registro público de cuentas)
+--   - cuentas_admin.daily_routes_* / max_daily_routes (attempt-download y renovación)
+--   - cobrador_passwords (credenciales de cobradores)
+
+ALTER TABLE cuentas_admin
+    ADD COLUMN IF NOT EXISTS timezone_default TEXT,
+    ADD COLUMN IF NOT EXISTS daily_routes_date DATE,
+    ADD COLUMN IF NOT EXISTS daily_routes_empleados JSONB DEFAULT '{}'::jsonb,
+    ADD COLUMN IF NOT EXISTS max_daily_routes INTEGER;
+
+CREATE TABLE IF NOT EXISTS cobrador_passwords (
+    usuario_id INTEGER PRIMARY KEY,
+    password_plain TEXT NOT NULL,
+    FOREIGN KEY (usuario_id) REFERENCES usuarios(id) ON DELETE CASCADE
+);
@@ -0,0 +1,48 @@
+-- Índices para las consultas calientes (liquidación, listados de ruta, caja, sync).
+-- Se crean con CONCURRENTLY (el runner ejecuta este archivo fuera de
+-- transacción) para no bloquear escrituras en horario de operación.
+-- Cada índice va precedido de un DROP INDEX CONCURRENTLY IF EXISTS que borra
+-- cualquier índice con ese nombre, válido o no: así un intento fallido que dejó
+-- un índice INVALID se puede reintentar (CREATE ... IF NOT EXISTS lo saltaría),
+-- y un índice homónimo creado a mano se reconstruye con la definición de aquí.
+-- Un DROP condicional a pg_index.indisvalid no sirve: CONCURRENTLY no puede ir
+-- dentro de un bloque DO y el DROP normal toma un lock exclusivo de la tabla.
+--
+-- Ya cubiertos por restricciones existentes (no se duplican):
+--   bases (empleado_id, fecha)                  -> bases_empleado_id_fecha_key
+--   control_caja (empleado_identificacion, fecha) -> clave única del ON CONFLICT
+-- El estado de todos se consulta en GET /admin/indices.
+
+-- Abonos de una tarjeta por fecha; INCLUDE monto para sumar sin ir a la tabla
+DROP INDEX CONCURRENTLY IF EXISTS idx_abonos_tarjeta_fecha;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_abonos_tarjeta_fecha
+    ON abonos (tarjeta_codigo, fecha) INCLUDE (monto);
+
+-- Rangos de fecha sobre abonos (la tabla crece en orden de fecha: BRIN es diminuto)
+DROP INDEX CONCURRENTLY IF EXISTS idx_abonos_fecha_brin;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_abonos_fecha_brin
+    ON abonos USING brin (fecha);
+
+-- Tarjetas de un empleado por estado, en orden de ruta. Las activas las cubre
+-- el índice parcial de abajo; este sirve a los demás estados: el listado y la
+-- paginación de canceladas (obtener_tarjetas con estado='cancelada' y
+-- fecha_cancelacion_desde) y el conteo de canceladas del día en la liquidación
+DROP INDEX CONCURRENTLY IF EXISTS idx_tarjetas_empleado_estado_ruta;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tarjetas_empleado_estado_ruta
+    ON tarjetas (empleado_identificacion, estado, numero_ruta);
+
+-- Solo tarjetas activas (la ruta del día): pequeño y siempre en caché
+DROP INDEX CONCURRENTLY IF EXISTS idx_tarjetas_activas_empleado_ruta;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tarjetas_activas_empleado_ruta
+    ON tarjetas (empleado_identificacion, numero_ruta) INCLUDE (codigo)
+    WHERE estado = 'activas';
+
+-- Tarjetas de un cliente (historial, score, datacrédito)
+DROP INDEX CONCURRENTLY IF EXISTS idx_tarjetas_cliente;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tarjetas_cliente
+    ON tarjetas (cliente_identificacion);
+
+-- Gastos de un empleado por fecha; INCLUDE valor para los totales del día
+DROP INDEX CONCURRENTLY IF EXISTS idx_gastos_empleado_fecha;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_gastos_empleado_fecha
+    ON gastos (empleado_identificacion, fecha_creacion) INCLUDE (valor);
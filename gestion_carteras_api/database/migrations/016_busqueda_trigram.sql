@@ -0,0 +1,30 @@
+-- Búsqueda de tarjetas por cliente con pg_trgm (GIN), sin tildes ni mayúsculas.
+-- El archivo corre fuera de transacción (CREATE INDEX CONCURRENTLY); todas las
+-- sentencias son idempotentes para poder reintentarlo. Como en la 015, el DROP
+-- previo borra cualquier índice con ese nombre (también uno válido creado a
+-- mano) y lo reconstruye con esta definición.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+-- unaccent() es STABLE (depende del diccionario): los índices por expresión
+-- necesitan una versión IMMUTABLE con el diccionario fijo
+CREATE OR REPLACE FUNCTION busqueda_normalizar(texto TEXT)
+RETURNS TEXT
+LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+AS $$
+    SELECT lower(public.unaccent('public.unaccent'::regdictionary, texto))
+$$;
+
+-- Nombre completo: cubre nombre, apellido y "nombre apellido" con un solo índice
+DROP INDEX CONCURRENTLY IF EXISTS idx_clientes_nombre_completo_trgm;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_clientes_nombre_completo_trgm
+    ON clientes USING gin (busqueda_normalizar(nombre || ' ' || apellido) gin_trgm_ops);
+
+DROP INDEX CONCURRENTLY IF EXISTS idx_clientes_identificacion_trgm;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_clientes_identificacion_trgm
+    ON clientes USING gin (identificacion gin_trgm_ops);
+
+DROP INDEX CONCURRENTLY IF EXISTS idx_clientes_telefono_trgm;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_clientes_telefono_trgm
+    ON clientes USING gin (telefono gin_trgm_ops);
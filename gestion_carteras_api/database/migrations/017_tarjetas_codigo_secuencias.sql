@@ -0,0 +1,18 @@
+-- Contador por prefijo de los códigos de tarjeta (AAMMDD-XXXX-NNN).
+-- Reservar un número es un solo UPSERT ... RETURNING sobre la fila del prefijo:
+-- las altas concurrentes con el mismo prefijo se ordenan en el lock de esa fila
+-- en lugar de probar INSERTs que chocan. ultimo_n es el último NNN asignado.
+
+CREATE TABLE IF NOT EXISTS tarjetas_codigo_secuencias (
+    prefijo TEXT PRIMARY KEY,           -- 'AAMMDD-XXXX-'
+    ultimo_n INTEGER NOT NULL CHECK (ultimo_n >= 0)
+);
+
+-- Partir del máximo existente de cada prefijo
+INSERT INTO tarjetas_codigo_secuencias (prefijo, ultimo_n)
+SELECT left(codigo, -3), MAX(right(codigo, 3)::int)
+FROM tarjetas
+WHERE codigo ~ '^[0-9]{6}-.*-[0-9]{3}$'
+GROUP BY left(codigo, -3)
+ON CONFLICT (prefijo) DO UPDATE
+    SET ultimo_n = GREATEST(tarjetas_codigo_secuencias.ultimo_n, EXCLUDED.ultimo_n);
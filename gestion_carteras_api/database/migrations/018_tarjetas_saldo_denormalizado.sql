@@ -0,0 +1,105 @@
+-- Saldo denormalizado en tarjetas: total abonado, cantidad y fecha del último abono.
+-- Lo mantienen triggers de abonos a nivel de sentencia (tablas de transición):
+-- un INSERT masivo de /sync o el UPDATE de mover_liquidacion ajustan cada
+-- tarjeta afectada una sola vez. Las columnas se comparan con abonos y se
+-- reconstruyen con GET/POST /admin/saldos (database/saldos_db.py).
+
+ALTER TABLE tarjetas ADD COLUMN IF NOT EXISTS total_abonado NUMERIC NOT NULL DEFAULT 0;
+ALTER TABLE tarjetas ADD COLUMN IF NOT EXISTS abonos_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE tarjetas ADD COLUMN IF NOT EXISTS ultimo_abono_fecha TIMESTAMP;
+
+CREATE OR REPLACE FUNCTION fn_tarjetas_saldo_abonos() RETURNS trigger AS $$
+BEGIN
+    -- Deltas por tarjeta: + filas nuevas, - filas viejas (UPDATE aporta ambas)
+    IF TG_OP = 'INSERT' THEN
+        UPDATE tarjetas t
+        SET total_abonado = t.total_abonado + d.monto,
+            abonos_count = t.abonos_count + d.cantidad,
+            ultimo_abono_fecha = GREATEST(t.ultimo_abono_fecha, d.ultima)
+        FROM (
+            SELECT tarjeta_codigo, SUM(monto) AS monto, COUNT(*) AS cantidad, MAX(fecha) AS ultima
+            FROM abonos_nuevos
+            GROUP BY tarjeta_codigo
+        ) d
+        WHERE t.codigo = d.tarjeta_codigo;
+    ELSIF TG_OP = 'DELETE' THEN
+        -- La fecha del último abono se relee por el índice (tarjeta_codigo, fecha)
+        UPDATE tarjetas t
+        SET total_abonado = t.total_abonado - d.monto,
+            abonos_count = t.abonos_count - d.cantidad,
+            ultimo_abono_fecha = (SELECT MAX(a.fecha) FROM abonos a WHERE a.tarjeta_codigo = t.codigo)
+        FROM (
+            SELECT tarjeta_codigo, SUM(monto) AS monto, COUNT(*) AS cantidad
+            FROM abonos_viejos
+            GROUP BY tarjeta_codigo
+        ) d
+        WHERE t.codigo = d.tarjeta_codigo;
+    ELSE
+        UPDATE tarjetas t
+        SET total_abonado = t.total_abonado + d.monto,
+            abonos_count = t.abonos_count + d.cantidad,
+            ultimo_abono_fecha = (SELECT MAX(a.fecha) FROM abonos a WHERE a.tarjeta_codigo = t.codigo)
+        FROM (
+            SELECT tarjeta_codigo, SUM(monto) AS monto, SUM(cantidad) AS cantidad
+            FROM (
+                SELECT tarjeta_codigo, monto, 1 AS cantidad FROM abonos_nuevos
+                UNION ALL
+                SELECT tarjeta_codigo, -monto, -1 FROM abonos_viejos
+            ) cambios
+            GROUP BY tarjeta_codigo
+        ) d
+        WHERE t.codigo = d.tarjeta_codigo;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- El version_txid de tarjetas (migración 011) no debe moverse cuando solo
+-- cambian las columnas denormalizadas: si no, cada abono (y la carga inicial
+-- de abajo) haría que /changes devolviera la tarjeta completa otra vez. Esas
+-- columnas no viajan en el snapshot; el abono nuevo ya llega por su cuenta.
+CREATE OR REPLACE FUNCTION fn_tarjetas_marcar_version() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE'
+       AND (to_jsonb(NEW) - ARRAY['total_abonado', 'abonos_count', 'ultimo_abono_fecha', 'version_txid'])
+         = (to_jsonb(OLD) - ARRAY['total_abonado', 'abonos_count', 'ultimo_abono_fecha', 'version_txid']) THEN
+        NEW.version_txid := OLD.version_txid;
+        RETURN NEW;
+    END IF;
+    NEW.version_txid := txid_current();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_tarjetas_version ON tarjetas;
+CREATE TRIGGER trg_tarjetas_version BEFORE INSERT OR UPDATE ON tarjetas
+    FOR EACH ROW EXECUTE FUNCTION fn_tarjetas_marcar_version();
+
+-- Una función, tres triggers: las tablas de transición admiten un solo evento por trigger
+DROP TRIGGER IF EXISTS trg_abonos_saldo_insert ON abonos;
+CREATE TRIGGER trg_abonos_saldo_insert AFTER INSERT ON abonos
+    REFERENCING NEW TABLE AS abonos_nuevos
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_tarjetas_saldo_abonos();
+
+DROP TRIGGER IF EXISTS trg_abonos_saldo_update ON abonos;
+CREATE TRIGGER trg_abonos_saldo_update AFTER UPDATE ON abonos
+    REFERENCING OLD TABLE AS abonos_viejos NEW TABLE AS abonos_nuevos
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_tarjetas_saldo_abonos();
+
+DROP TRIGGER IF EXISTS trg_abonos_saldo_delete ON abonos;
+CREATE TRIGGER trg_abonos_saldo_delete AFTER DELETE ON abonos
+    REFERENCING OLD TABLE AS abonos_viejos
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_tarjetas_saldo_abonos();
+
+-- Carga inicial (en la misma transacción que crea los triggers: no se pierde
+-- ningún abono). Va después del trigger de versión: no marca las tarjetas como cambiadas.
+UPDATE tarjetas t
+SET total_abonado = r.total,
+    abonos_count = r.cantidad,
+    ultimo_abono_fecha = r.ultima
+FROM (
+    SELECT tarjeta_codigo, SUM(monto) AS total, COUNT(*) AS cantidad, MAX(fecha) AS ultima
+    FROM abonos
+    GROUP BY tarjeta_codigo
+) r
+WHERE t.codigo = r.tarjeta_codigo;
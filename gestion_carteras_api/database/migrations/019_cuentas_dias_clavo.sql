@@ -0,0 +1,8 @@
+-- Umbral de "clavo" por cuenta: días desde el vencimiento de la tarjeta
+-- (creación + cuotas x factor de modalidad) a partir de los cuales su saldo
+-- cuenta como clavo. NULL = valor por defecto de la aplicación (60 días).
+
+ALTER TABLE cuentas_admin ADD COLUMN IF NOT EXISTS dias_clavo INTEGER;
+
+ALTER TABLE cuentas_admin DROP CONSTRAINT IF EXISTS cuentas_admin_dias_clavo_check;
+ALTER TABLE cuentas_admin ADD CONSTRAINT cuentas_admin_dias_clavo_check CHECK (dias_clavo IS NULL OR dias_clavo > 0);
@@ -0,0 +1,18 @@
+-- Retención de las lápidas de sincronización (sync_eliminados).
+--
+-- Las lápidas solo sirven a clientes cuyo token es anterior al borrado. La
+-- purga (scripts/purge_sync_eliminados.py) elimina las más viejas que la
+-- ventana de retención y sube sync_retencion.token_minimo por encima del
+-- version_txid de la última lápida borrada: un token menor ya no puede recibir
+-- todos sus borrados y /changes le responde full_resync (la PWA vuelve a
+-- descargar la ruta con /snapshot).
+
+CREATE TABLE IF NOT EXISTS sync_retencion (
+    id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    token_minimo BIGINT NOT NULL DEFAULT 0,
+    purgado_en TIMESTAMP
+);
+
+INSERT INTO sync_retencion (id, token_minimo) VALUES (1, 0) ON CONFLICT (id) DO NOTHING;
+
+CREATE INDEX IF NOT EXISTS idx_sync_eliminados_eliminado_en ON sync_eliminados (eliminado_en);
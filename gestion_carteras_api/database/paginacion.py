@@ -0,0 +1,163 @@
+"""
+Paginación por cursor (keyset) para los listados.
+
+En lugar de OFFSET (que recorre y descarta todas las filas anteriores y se
+corre si entran filas nuevas) cada página continúa después de la clave de
+orden de la última fila devuelta: `(col1, col2) > (v1, v2)`, que el índice
+resuelve como un rango. El costo de una página no depende de su profundidad.
+
+El cursor que ve el cliente es opaco: base64 de la lista tipada de valores
+de la clave más el nombre del listado (un cursor de tarjetas no sirve para
+gastos). La clave de orden debe ser única (se agrega el código o id como
+desempate).
+"""
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import List, Optional, Sequence, Tuple
+
+# Tamaño máximo del cursor aceptado (evita decodificar basura grande)
+_MAX_LARGO_CURSOR = 512
+
+
+class CursorInvalido(ValueError):
+    pass
+
+
+def _codificar_valor(valor) -> list:
+    if valor is None:
+        return ['N', None]
+    if isinstance(valor, bool):
+        return ['I', int(valor)]
+    if isinstance(valor, Decimal):
+        return ['D', str(valor)]
+    if isinstance(valor, datetime):
+        return ['T', valor.isoformat()]
+    if isinstance(valor, date):
+        return ['F', valor.isoformat()]
+    if isinstance(valor, int):
+        return ['I', valor]
+    return ['S', str(valor)]
+
+
+def _decodificar_valor(par):
+    tipo, valor = par
+    if tipo == 'N':
+        return None
+    if tipo == 'D':
+        return Decimal(valor)
+    if tipo == 'T':
+        return datetime.fromisoformat(valor)
+    if tipo == 'F':
+        return date.fromisoformat(valor)
+    if tipo == 'I':
+        return int(valor)
+    if tipo == 'S':
+        return str(valor)
+    raise CursorInvalido(f"Tipo de valor desconocido en el cursor: {tipo}")
+
+
+def codificar_cursor(listado: str, valores: Sequence) -> str:
+    """Cursor opaco (base64 url-safe) con la clave de orden de la última fila."""
+    datos = {'l': listado, 'v': [_codificar_valor(v) for v in valores]}
+    crudo = json.dumps(datos, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(crudo).decode('ascii').rstrip('=')
+
+
+def decodificar_cursor(listado: str, cursor: str, largo: int) -> Tuple:
+    """Clave de orden del cursor. Lanza CursorInvalido si no corresponde al listado."""
+    if not cursor or len(cursor) > _MAX_LARGO_CURSOR:
+        raise CursorInvalido("Cursor inválido")
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        datos = json.loads(base64.urlsafe_b64decode(cursor + relleno).decode('utf-8'))
+        if datos.get('l') != listado:
+            raise CursorInvalido("El cursor no corresponde a este listado")
+        valores = tuple(_decodificar_valor(par) for par in datos['v'])
+    except CursorInvalido:
+        raise
+    except Exception:
+        raise CursorInvalido("Cursor inválido")
+    if len(valores) != largo:
+        raise CursorInvalido("Cursor inválido")
+    return valores
+
+
+def siguiente_cursor(listado: str, filas: Sequence, limite: int, *claves) -> Optional[str]:
+    """
+    Cursor de la página siguiente a partir de la última fila (tupla o dict;
+    `claves` son sus índices o nombres). None si la página no vino llena.
+    """
+    if not filas or limite <= 0 or len(filas) < limite:
+        return None
+    ultima = filas[-1]
+    return codificar_cursor(listado, [ultima[k] for k in claves])
+
+
+def consulta_keyset(
+    select_sql: str,
+    where_sql: str,
+    params: Sequence,
+    orden: Sequence[Tuple[str, str]],
+    despues: Optional[Tuple],
+    limite: int,
+    descendente: bool = False,
+    lider_nullable: bool = False,
+    offset: int = 0,
+) -> Tuple[str, List]:
+    """
+    Arma la consulta de una página.
+
+    orden: [(expresión SQL, nombre de la columna en el SELECT), ...]; todas en
+    la misma dirección. Si la primera columna admite NULL (lider_nullable), los
+    NULL van al final en ambas direcciones y se paginan por el resto de la clave.
+    offset solo se aplica sin cursor (compatibilidad con skip).
+    """
+    where_sql = where_sql or 'TRUE'
+    direccion = 'DESC' if descendente else 'ASC'
+    op = '<' if descendente else '>'
+    exprs = [e for e, _ in orden]
+    nulls = ' NULLS LAST' if lider_nullable else ''
+
+    def _order_by(columnas):
+        partes = [f"{columnas[0]} {direccion}{nulls}"] + [f"{c} {direccion}" for c in columnas[1:]]
+        return ', '.join(partes)
+
+    def _fila(columnas):
+        return '(' + ', '.join(columnas) + ')'
+
+    def _marcas(n):
+        return '(' + ', '.join(['%s'] * n) + ')'
+
+    base = list(params)
+    if despues is None:
+        sql = f"{select_sql} WHERE {where_sql} ORDER BY {_order_by(exprs)} OFFSET %s LIMIT %s"
+        return sql, base + [max(offset, 0), limite]
+
+    if lider_nullable and despues[0] is None:
+        # Ya en el tramo de NULL: solo resta la clave secundaria
+        sql = (
+            f"{select_sql} WHERE {where_sql} AND {exprs[0]} IS NULL"
+            f" AND {_fila(exprs[1:])} {op} {_marcas(len(exprs) - 1)}"
+            f" ORDER BY {_order_by(exprs[1:])} LIMIT %s"
+        )
+        return sql, base + list(despues[1:]) + [limite]
+
+    sql = (
+        f"{select_sql} WHERE {where_sql} AND {_fila(exprs)} {op} {_marcas(len(exprs))}"
+        f" ORDER BY {_order_by(exprs)} LIMIT %s"
+    )
+    parametros = base + list(despues) + [limite]
+    if not lider_nullable:
+        return sql, parametros
+
+    # Las filas con NULL en la primera columna van después de todas las demás:
+    # cada rama usa su propio rango del índice y solo se ordenan 2*limite filas
+    sql_nulos = (
+        f"{select_sql} WHERE {where_sql} AND {exprs[0]} IS NULL"
+        f" ORDER BY {_order_by(exprs[1:])} LIMIT %s"
+    )
+    alias = [a for _, a in orden]
+    sql = f"SELECT * FROM (({sql}) UNION ALL ({sql_nulos})) AS pagina ORDER BY {_order_by(alias)} LIMIT %s"
+    return sql, parametros + base + [limite, limite]
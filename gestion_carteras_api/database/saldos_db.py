@@ -0,0 +1,172 @@
+"""
+Saldo denormalizado de las tarjetas (migración 018).
+
+tarjetas.total_abonado, abonos_count y ultimo_abono_fecha los mantienen los
+triggers de abonos; aquí están las expresiones SQL que los usan (con la suma
+sobre abonos como respaldo si la migración aún no se aplicó), la transición
+automática cancelada/activa por saldo y el verificador que los compara con
+abonos y los reconstruye.
+"""
+import logging
+from datetime import date
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .connection_pool import DatabasePool
+from .esquema import Esquema
+
+logger = logging.getLogger(__name__)
+
+ESTADOS_ACTIVA = ('activas', 'activa')
+ESTADOS_CANCELADA = ('cancelada', 'canceladas')
+
+
+def saldos_disponibles() -> bool:
+    return Esquema.tiene_columnas('tarjetas', 'total_abonado', 'abonos_count', 'ultimo_abono_fecha')
+
+
+def expr_total_abonado(alias: str = 't') -> str:
+    """Total abonado de la tarjeta `alias`: la columna o, sin la migración, la suma de sus abonos."""
+    if saldos_disponibles():
+        return f"{alias}.total_abonado"
+    return f"(SELECT COALESCE(SUM(a_s.monto), 0) FROM abonos a_s WHERE a_s.tarjeta_codigo = {alias}.codigo)"
+
+
+def expr_abonos_count(alias: str = 't') -> str:
+    if saldos_disponibles():
+        return f"{alias}.abonos_count"
+    return f"(SELECT COUNT(*) FROM abonos a_s WHERE a_s.tarjeta_codigo = {alias}.codigo)"
+
+
+def expr_ultimo_abono(alias: str = 't') -> str:
+    if saldos_disponibles():
+        return f"{alias}.ultimo_abono_fecha"
+    return f"(SELECT MAX(a_s.fecha) FROM abonos a_s WHERE a_s.tarjeta_codigo = {alias}.codigo)"
+
+
+def expr_monto_total(alias: str = 't') -> str:
+    """Monto a pagar (capital + interés) de la tarjeta `alias`."""
+    return f"({alias}.monto * (1 + COALESCE({alias}.interes, 0)::numeric / 100))"
+
+
+def expr_saldo(alias: str = 't') -> str:
+    return f"({expr_monto_total(alias)} - {expr_total_abonado(alias)})"
+
+
+def actualizar_estado_por_saldo(cursor, codigos: Sequence[str], fecha_cancelacion: date) -> List[Tuple[str, str, str]]:
+    """
+    Aplica la transición automática en una sola sentencia: cancela las tarjetas
+    activas con saldo <= 0 y reactiva las canceladas con saldo > 0.
+    Devuelve (codigo, nuevo_estado, empleado) de las que cambiaron; el caché lo
+    invalida quien llama.
+    """
+    if not codigos:
+        return []
+    saldo = expr_saldo('t')
+    cursor.execute(
+        f"""
+        UPDATE tarjetas t
+        SET estado = CASE WHEN {saldo} > 0 THEN 'activas' ELSE 'cancelada' END,
+            fecha_cancelacion = CASE WHEN {saldo} > 0 THEN NULL ELSE %s::date END
+        WHERE t.codigo = ANY(%s)
+          AND (
+                (t.estado = ANY(%s) AND {saldo} <= 0)
+             OR (t.estado = ANY(%s) AND {saldo} > 0)
+          )
+        RETURNING t.codigo, t.estado, t.empleado_identificacion
+        """,
+        (fecha_cancelacion, list(codigos), list(ESTADOS_ACTIVA), list(ESTADOS_CANCELADA)),
+    )
+    return cursor.fetchall()
+
+
+_SQL_DIFERENCIAS = """
+    WITH reales AS (
+        SELECT a.tarjeta_codigo, SUM(a.monto) AS total, COUNT(*) AS cantidad, MAX(a.fecha) AS ultima
+        FROM abonos a
+        GROUP BY a.tarjeta_codigo
+    )
+    SELECT t.codigo,
+           t.total_abonado, COALESCE(r.total, 0),
+           t.abonos_count, COALESCE(r.cantidad, 0),
+           t.ultimo_abono_fecha, r.ultima
+    FROM tarjetas t
+    {join_cuenta}
+    LEFT JOIN reales r ON r.tarjeta_codigo = t.codigo
+    WHERE {filtro_tarjetas}
+      AND (t.total_abonado <> COALESCE(r.total, 0)
+           OR t.abonos_count <> COALESCE(r.cantidad, 0)
+           OR t.ultimo_abono_fecha IS DISTINCT FROM r.ultima)
+    ORDER BY t.codigo
+"""
+
+
+def _consulta_diferencias(cuenta_id: Optional[int]) -> Tuple[str, list]:
+    if cuenta_id is None:
+        return _SQL_DIFERENCIAS.format(join_cuenta='', filtro_tarjetas='TRUE'), []
+    return _SQL_DIFERENCIAS.format(
+        join_cuenta='JOIN empleados e ON e.identificacion = t.empleado_identificacion',
+        filtro_tarjetas='e.cuenta_id = %s',
+    ), [cuenta_id]
+
+
+def verificar_saldos(cuenta_id: Optional[int] = None, reparar: bool = False, muestra: int = 50) -> Optional[Dict]:
+    """
+    Compara las columnas denormalizadas con la suma real de abonos (recorre
+    todos los abonos de la cuenta: es una tarea de mantenimiento). Con
+    reparar=True reconstruye las tarjetas con diferencias: las bloquea y
+    recalcula después del bloqueo, así un abono concurrente no se pierde.
+    Devuelve None si las columnas no existen o hubo error.
+    """
+    if not saldos_disponibles():
+        return None
+    try:
+        with DatabasePool.get_cursor(readonly=False) as cursor:
+            sql, params = _consulta_diferencias(cuenta_id)
+            cursor.execute(sql, params)
+            filas = cursor.fetchall()
+            reparadas = 0
+            if reparar and filas:
+                codigos = [f[0] for f in filas]
+                cursor.execute(
+                    "SELECT codigo FROM tarjetas WHERE codigo = ANY(%s) ORDER BY codigo FOR UPDATE",
+                    (codigos,),
+                )
+                cursor.execute(
+                    """
+                    UPDATE tarjetas t
+                    SET total_abonado = COALESCE(r.total, 0),
+                        abonos_count = COALESCE(r.cantidad, 0),
+                        ultimo_abono_fecha = r.ultima
+                    FROM (SELECT unnest(%s::text[]) AS codigo) c
+                    LEFT JOIN (
+                        SELECT tarjeta_codigo, SUM(monto) AS total, COUNT(*) AS cantidad, MAX(fecha) AS ultima
+                        FROM abonos
+                        WHERE tarjeta_codigo = ANY(%s)
+                        GROUP BY tarjeta_codigo
+                    ) r ON r.tarjeta_codigo = c.codigo
+                    WHERE t.codigo = c.codigo
+                    """,
+                    (codigos, codigos),
+                )
+                reparadas = cursor.rowcount
+                logger.warning(f"Saldos denormalizados reconstruidos en {reparadas} tarjetas")
+    except Exception as e:
+        logger.error(f"Error al verificar saldos de tarjetas: {e}")
+        return None
+
+    return {
+        'inconsistentes': len(filas),
+        'reparadas': reparadas,
+        'muestra': [
+            {
+                'codigo': f[0],
+                'total_abonado': f[1],
+                'total_real': f[2],
+                'abonos_count': f[3],
+                'abonos_count_real': f[4],
+                'ultimo_abono_fecha': f[5],
+                'ultimo_abono_fecha_real': f[6],
+            }
+            for f in filas[:max(0, muestra)]
+        ],
+    }
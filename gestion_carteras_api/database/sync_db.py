@@ -0,0 +1,344 @@
+"""
+Operaciones en lote usadas por /sync.
+
+Todas las funciones reciben el cursor de la transacción abierta por el endpoint,
+de modo que clientes, tarjetas, gastos y bases se escriben sobre UNA conexión y
+se confirman (o revierten) juntos. Ante datos inválidos lanzan ValueError para
+que el endpoint responda 400 y la transacción completa se revierta.
+"""
+
+import logging
+from datetime import datetime, date, time, timezone
+from decimal import Decimal
+from typing import List, Dict, Optional
+
+from psycopg2.extras import execute_values
+
+from .gastos_db import TIPOS_GASTOS
+from .tarjetas_db import (
+    _RutasEmpleado, _calcular_numero_ruta, _modalidad_column_exists, _reservar_codigos, _resincronizar_codigo,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _texto_o_none(valor: Optional[str]) -> Optional[str]:
+    """Devuelve None si el valor viene vacío (solo espacios incluidos)."""
+    if valor is None or str(valor).strip() == '':
+        return None
+    return valor
+
+
+def upsert_clientes_lote(cursor, clientes: List[Dict]) -> int:
+    """
+    Crea o actualiza clientes en una sola sentencia.
+    - Los valores NO vacíos del payload ganan sobre los existentes.
+    - nombre, apellido, direccion y observaciones se guardan en MAYÚSCULAS.
+    Retorna la cantidad de clientes distintos procesados.
+    """
+    # Consolidar por identificación (el último valor no vacío gana), igual que
+    # si se hubieran procesado uno a uno en orden.
+    por_id: Dict[str, Dict] = {}
+    for c in clientes:
+        ident = c.get('identificacion')
+        if not ident:
+            raise ValueError("Cliente sin identificación en sincronización")
+        actual = por_id.setdefault(ident, {'identificacion': ident})
+        for campo in ('nombre', 'apellido', 'telefono', 'direccion', 'observaciones'):
+            v = _texto_o_none(c.get(campo))
+            if v is not None:
+                actual[campo] = v
+
+    if not por_id:
+        return 0
+
+    filas = []
+    for ident, c in por_id.items():
+        direccion = c.get('direccion')
+        observaciones = c.get('observaciones')
+        filas.append((
+            ident,
+            (c.get('nombre') or '').upper(),
+            (c.get('apellido') or '').upper(),
+            c.get('telefono'),
+            direccion.upper() if direccion else None,
+            observaciones.upper() if observaciones else None,
+        ))
+
+    execute_values(
+        cursor,
+        """
+        INSERT INTO clientes (
+            identificacion, nombre, apellido,
+            telefono, direccion, observaciones
+        ) VALUES %s
+        ON CONFLICT (identificacion) DO UPDATE SET
+            nombre = UPPER(COALESCE(NULLIF(EXCLUDED.nombre, ''), clientes.nombre)),
+            apellido = UPPER(COALESCE(NULLIF(EXCLUDED.apellido, ''), clientes.apellido)),
+            telefono = COALESCE(EXCLUDED.telefono, clientes.telefono),
+            direccion = UPPER(COALESCE(EXCLUDED.direccion, clientes.direccion)),
+            observaciones = UPPER(COALESCE(EXCLUDED.observaciones, clientes.observaciones))
+        """,
+        filas,
+        page_size=max(1, len(filas)),
+    )
+    return len(filas)
+
+
+def crear_tarjetas_lote(cursor, tarjetas: List[Dict]) -> List[str]:
+    """
+    Inserta tarjetas nuevas y retorna sus códigos EN EL MISMO ORDEN de entrada.
+    - numero_ruta: si no viene, se calcula con las mismas reglas que
+      obtener_siguiente_numero_ruta (rutas vecinas de las tarjetas activas),
+      considerando las tarjetas ya asignadas en el lote.
+    - codigo: AAMMDD-XXXX-NNN; los NNN de cada prefijo se reservan juntos en el
+      contador tarjetas_codigo_secuencias (una sentencia para todo el lote).
+    """
+    if not tarjetas:
+        return []
+
+    for t in tarjetas:
+        if not all([
+            t.get('cliente_identificacion'),
+            t.get('empleado_identificacion'),
+            t.get('monto'),
+            t.get('cuotas'),
+            isinstance(t.get('interes'), (int, float))
+        ]):
+            raise ValueError("Faltan campos requeridos para crear la tarjeta")
+
+    # Rutas activas por empleado: consultas por vecindad sobre el índice + las asignadas en el lote
+    rutas_por_empleado: Dict[str, _RutasEmpleado] = {}
+
+    # Fecha efectiva para código y registro (UTC naive, igual que crear_tarjeta)
+    target_dt = datetime.now(timezone.utc).replace(tzinfo=None)
+    fecha_pref = target_dt.strftime('%y%m%d')
+    prefijos = [f"{fecha_pref}-{t['cliente_identificacion'][-4:]}-" for t in tarjetas]
+
+    # Reservar los números de todo el lote por prefijo
+    cantidades: Dict[str, int] = {}
+    for prefijo in prefijos:
+        cantidades[prefijo] = cantidades.get(prefijo, 0) + 1
+    siguiente_n = _reservar_codigos(cursor, cantidades)
+
+    col_ok = _modalidad_column_exists()
+    filas = []
+    for t, prefijo in zip(tarjetas, prefijos):
+        emp = t['empleado_identificacion']
+        rutas = rutas_por_empleado.get(emp)
+        if rutas is None:
+            rutas = rutas_por_empleado[emp] = _RutasEmpleado(cursor, emp)
+        numero_ruta = t.get('numero_ruta')
+        if numero_ruta is None:
+            pa = t.get('posicion_anterior')
+            ps = t.get('posicion_siguiente')
+            numero_ruta = _calcular_numero_ruta(
+                rutas,
+                int(pa) if pa is not None else None,
+                int(ps) if ps is not None else None,
+            )
+        rutas.agregar(int(numero_ruta))
+
+        n = siguiente_n[prefijo]
+        siguiente_n[prefijo] = n + 1
+
+        fila = [
+            f"{prefijo}{n:03d}",
+            t['cliente_identificacion'],
+            emp,
+            numero_ruta,
+            t['monto'],
+            t['cuotas'],
+            t['interes'],
+            t.get('observaciones'),
+            target_dt,
+        ]
+        if col_ok:
+            fila.append(t.get('modalidad_pago') or 'diario')
+        filas.append(fila)
+
+    columnas = (
+        "codigo, cliente_identificacion, empleado_identificacion, "
+        "numero_ruta, monto, cuotas, interes, observaciones, fecha_creacion"
+    )
+    plantilla = "(%s, %s, %s, %s, %s, %s, %s, %s, %s"
+    if col_ok:
+        columnas += ", modalidad_pago"
+        plantilla += ", %s"
+    plantilla += ", 'activas')"
+    columnas += ", estado"
+
+    insertadas = execute_values(
+        cursor,
+        f"""
+        INSERT INTO tarjetas ({columnas})
+        VALUES %s
+        ON CONFLICT (codigo) DO NOTHING
+        RETURNING codigo
+        """,
+        filas,
+        template=plantilla,
+        page_size=max(1, len(filas)),
+        fetch=True,
+    )
+    ok = {r[0] for r in insertadas}
+
+    # Colisiones: solo con códigos creados sin pasar por el contador (p. ej. una
+    # instancia con la versión anterior durante un despliegue). Alinear el
+    # contador del prefijo y reintentar la fila
+    codigos = []
+    for fila, prefijo in zip(filas, prefijos):
+        if fila[0] in ok:
+            codigos.append(fila[0])
+            continue
+        _resincronizar_codigo(cursor, prefijo)
+        while True:
+            n = _reservar_codigos(cursor, {prefijo: 1})[prefijo]
+            fila[0] = f"{prefijo}{n:03d}"
+            cursor.execute(
+                f"""
+                INSERT INTO tarjetas ({columnas})
+                VALUES {plantilla}
+                ON CONFLICT (codigo) DO NOTHING
+                RETURNING codigo
+                """,
+                fila,
+            )
+            got = cursor.fetchone()
+            if got and got[0]:
+                codigos.append(got[0])
+                break
+    return codigos
+
+
+def insertar_abonos_lote(cursor, abonos: List[Dict]) -> List[int]:
+    """
+    Inserta todos los abonos del lote en UNA sentencia y retorna los ids
+    generados EN EL MISMO ORDEN de entrada.
+    - indice_orden = MAX(indice_orden) actual de la tarjeta + posición del abono
+      dentro del lote para esa tarjeta (ROW_NUMBER sobre el orden de entrada).
+    - Las tarjetas afectadas se bloquean (FOR UPDATE) para que dos lotes
+      concurrentes no calculen el mismo indice_orden.
+    """
+    if not abonos:
+        return []
+
+    codigos = [a['tarjeta_codigo'] for a in abonos]
+    montos = [a['monto'] for a in abonos]
+    metodos = [a.get('metodo_pago') or 'efectivo' for a in abonos]
+
+    cursor.execute(
+        """
+        SELECT codigo FROM tarjetas
+        WHERE codigo = ANY(%s)
+        ORDER BY codigo
+        FOR UPDATE
+        """,
+        (sorted(set(codigos)),),
+    )
+
+    cursor.execute(
+        """
+        WITH entrada AS (
+            SELECT e.tarjeta_codigo, e.monto, e.metodo_pago, e.ord
+            FROM unnest(%s::text[], %s::numeric[], %s::text[])
+                 WITH ORDINALITY AS e(tarjeta_codigo, monto, metodo_pago, ord)
+        ),
+        maximos AS (
+            SELECT d.tarjeta_codigo,
+                   COALESCE((SELECT MAX(a.indice_orden) FROM abonos a
+                             WHERE a.tarjeta_codigo = d.tarjeta_codigo), 0) AS max_idx
+            FROM (SELECT DISTINCT tarjeta_codigo FROM entrada) d
+        ),
+        numerados AS (
+            SELECT e.ord, e.tarjeta_codigo, e.monto, e.metodo_pago,
+                   m.max_idx + ROW_NUMBER() OVER (PARTITION BY e.tarjeta_codigo ORDER BY e.ord) AS indice_orden
+            FROM entrada e
+            JOIN maximos m ON m.tarjeta_codigo = e.tarjeta_codigo
+        ),
+        insertados AS (
+            INSERT INTO abonos (tarjeta_codigo, fecha, monto, indice_orden, metodo_pago)
+            SELECT tarjeta_codigo, NOW(), monto, indice_orden, metodo_pago
+            FROM numerados
+            ORDER BY ord
+            RETURNING id, tarjeta_codigo, indice_orden
+        )
+        SELECT i.id
+        FROM insertados i
+        JOIN numerados n
+          ON n.tarjeta_codigo = i.tarjeta_codigo
+         AND n.indice_orden = i.indice_orden
+        ORDER BY n.ord
+        """,
+        (codigos, montos, metodos),
+    )
+    ids = [r[0] for r in cursor.fetchall()]
+    if len(ids) != len(abonos):
+        raise ValueError("No se pudieron registrar todos los abonos del lote")
+    return ids
+
+
+def insertar_gastos_lote(cursor, gastos: List[Dict]) -> int:
+    """
+    Inserta gastos en una sola sentencia.
+    fecha_creacion: NOW() si la fecha es HOY; si no, esa fecha a las 12:00:00
+    (mismo criterio que agregar_gasto).
+    """
+    if not gastos:
+        return 0
+    hoy = date.today()
+    filas = []
+    for g in gastos:
+        tipo = g.get('tipo')
+        if tipo not in TIPOS_GASTOS:
+            logger.error(f"Tipo de gasto inválido: {tipo}")
+            raise ValueError(f"Tipo de gasto inválido: {tipo}")
+        fecha = g.get('fecha') or hoy
+        ts_creacion = None if fecha == hoy else datetime.combine(fecha, time(12, 0, 0))
+        filas.append((
+            g.get('empleado_identificacion'),
+            tipo,
+            fecha,
+            g.get('valor'),
+            g.get('observacion'),
+            ts_creacion,
+        ))
+    ids = execute_values(
+        cursor,
+        """
+        INSERT INTO gastos (empleado_identificacion, tipo, fecha, valor, observacion, fecha_creacion)
+        VALUES %s
+        RETURNING id
+        """,
+        filas,
+        template="(%s, %s, %s, %s, %s, COALESCE(%s, NOW()))",
+        page_size=max(1, len(filas)),
+        fetch=True,
+    )
+    return len(ids)
+
+
+def upsert_bases_lote(cursor, bases: List[Dict]) -> int:
+    """
+    Inserta o actualiza bases (una por empleado/día) en una sola sentencia.
+    Si el lote trae la misma fecha repetida, gana el último monto.
+    Retorna la cantidad de bases recibidas.
+    """
+    if not bases:
+        return 0
+    por_clave: Dict[tuple, Decimal] = {}
+    for b in bases:
+        por_clave[(b.get('empleado_id'), b.get('fecha'))] = b.get('monto')
+    filas = [(emp, fecha, monto) for (emp, fecha), monto in por_clave.items()]
+    execute_values(
+        cursor,
+        """
+        INSERT INTO bases (empleado_id, fecha, monto)
+        VALUES %s
+        ON CONFLICT (empleado_id, fecha)
+        DO UPDATE SET monto = EXCLUDED.monto
+        """,
+        filas,
+        page_size=max(1, len(filas)),
+    )
+    return len(bases)
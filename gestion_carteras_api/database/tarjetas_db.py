@@ -1,74 +1,74 @@
 from .connection_pool import DatabasePool
+from .async_pool import AsyncDatabasePool
+from .cache import crear_cache
+from .esquema import Esquema
+from .fechas import limites_dia_utc
+from .paginacion import consulta_keyset
+from .saldos_db import actualizar_estado_por_saldo, expr_abonos_count, expr_monto_total, expr_saldo, expr_total_abonado, expr_ultimo_abono
+from . import cache_bus
+import bisect
 import logging
+import os
 from datetime import datetime, date
 from typing import List, Dict, Optional, Tuple
 from decimal import Decimal
 
 logger = logging.getLogger(__name__)
 
-# Cache para almacenar resultados frecuentes
-_cache = {}
-_cache_timeout = 300  # 5 minutos
-_modalidad_col_ok: Optional[bool] = None
+# Caché de listados de tarjetas (TTL + LRU, invalidación por empleado)
+_cache = crear_cache(
+    'tarjetas',
+    max_entradas=int(os.getenv('CACHE_TARJETAS_MAX_ENTRADAS', '500')),
+    ttl_segundos=float(os.getenv('CACHE_TARJETAS_TTL_SECONDS', '300')),
+)
+# Ámbito de los listados sin filtro de empleado (los invalida cualquier cambio)
+_AMBITO_TODAS = '__todas__'
+
+def cache_tarjetas_en_endpoints() -> bool:
+    """
+    Si los endpoints de listados usan el caché: por defecto solo mientras la
+    escucha de invalidaciones (LISTEN/NOTIFY) está conectada.
+    """
+    return cache_bus.cache_habilitado('CACHE_TARJETAS_ENABLED')
 
 def _modalidad_column_exists() -> bool:
-    global _modalidad_col_ok
-    if _modalidad_col_ok is not None:
-        return bool(_modalidad_col_ok)
-    try:
-        with DatabasePool.get_cursor() as cursor:
-            cursor.execute(
-                """
-                SELECT 1
-                FROM information_schema.columns
-                WHERE table_schema = 'public'
-                AND table_name = 'tarjetas'
-                AND column_name = 'modalidad_pago'
-                LIMIT 1
-                """
-            )
-            _modalidad_col_ok = bool(cursor.fetchone())
-    except Exception:
-        _modalidad_col_ok = False
-    return bool(_modalidad_col_ok)
+    """Si tarjetas tiene modalidad_pago (según el registro de esquema cargado al arrancar)."""
+    return Esquema.tiene_columna('tarjetas', 'modalidad_pago')
 
-def ensure_modalidad_pago_column():
+def invalidar_cache_tarjetas(empleado_identificacion: Optional[str] = None):
     """
-    Asegura que exista la columna modalidad_pago en la tabla tarjetas.
-    - No revienta el arranque si no hay permisos (solo loggea warning).
+    Invalida el caché de tarjetas en todas las instancias. Si se especifica
+    empleado, solo ese empleado (y los listados globales). Dentro de una
+    transacción se aplica al confirmarla, para que ninguna lectura concurrente
+    vuelva a cachear datos viejos.
     """
-    try:
-        with DatabasePool.get_cursor() as cursor:
-            cursor.execute(
-                "ALTER TABLE tarjetas "
-                "ADD COLUMN IF NOT EXISTS modalidad_pago VARCHAR(20) NOT NULL DEFAULT 'diario'"
-            )
-        # Si lo logramos (o ya existía), marcar flag
-        global _modalidad_col_ok
-        _modalidad_col_ok = True
-    except Exception as e:
-        logger.warning(f"No se pudo asegurar columna modalidad_pago en tarjetas: {e}")
+    cache_bus.publicar('tarjetas', empleado_identificacion)
 
-def invalidar_cache_tarjetas(empleado_identificacion: Optional[str] = None):
-    """Invalida el caché de tarjetas. Si se especifica empleado, solo invalida ese empleado."""
-    global _cache
+def _invalidar_cache_local(empleado_identificacion: Optional[str] = None):
     if empleado_identificacion:
-        # Invalidar solo las entradas de ese empleado
-        keys_to_delete = [k for k in _cache.keys() if f"tarjetas_{empleado_identificacion}_" in k]
-        for k in keys_to_delete:
-            del _cache[k]
+        _cache.invalidar(str(empleado_identificacion))
+        _cache.invalidar(_AMBITO_TODAS)
         logger.debug(f"Caché de tarjetas invalidado para empleado {empleado_identificacion}")
     else:
-        # Invalidar todo el caché
-        _cache = {}
+        _cache.invalidar_todo()
         logger.debug("Caché de tarjetas invalidado completamente")
 
-def obtener_todas_las_tarjetas(skip: int = 0, limit: int = 100) -> List[Dict]:
-    """Obtiene todas las tarjetas con paginación (para endpoint API)"""
+cache_bus.registrar_ambito('tarjetas', _invalidar_cache_local)
+
+# Claves de orden de los listados (la última columna desempata)
+ORDEN_TARJETAS_RUTA = (('t.numero_ruta', 'numero_ruta'), ('t.codigo', 'codigo'))
+ORDEN_TARJETAS_RECIENTES = (('t.fecha_creacion', 'fecha_creacion'), ('t.codigo', 'codigo'))
+
+def obtener_todas_las_tarjetas(skip: int = 0, limit: int = 100, despues: Optional[Tuple] = None) -> List[Dict]:
+    """
+    Obtiene todas las tarjetas con paginación (para endpoint API), de la más
+    reciente a la más antigua. despues=(fecha_creacion, codigo) de la última
+    fila de la página anterior pagina por cursor en lugar de skip.
+    """
     try:
         with DatabasePool.get_cursor() as cursor:
             modalidad_expr = "COALESCE(t.modalidad_pago, 'diario')" if _modalidad_column_exists() else "'diario'"
-            cursor.execute(f'''
+            select_sql = f'''
                 SELECT 
                     t.codigo,
                     t.monto,
@@ -88,9 +88,12 @@ def obtener_todas_las_tarjetas(skip: int = 0, limit: int = 100) -> List[Dict]:
                 FROM tarjetas t
                 JOIN clientes c ON t.cliente_identificacion = c.identificacion
                 JOIN empleados e ON t.empleado_identificacion = e.identificacion
-                ORDER BY t.fecha_creacion DESC
-                OFFSET %s LIMIT %s
-            ''', (skip, limit))
+            '''
+            query, params = consulta_keyset(
+                select_sql, '', (), ORDEN_TARJETAS_RECIENTES, despues, limit,
+                descendente=True, lider_nullable=True, offset=skip,
+            )
+            cursor.execute(query, params)
             rows = cursor.fetchall()
             
             # Convertir tuplas a diccionarios para FastAPI con estructura anidada
@@ -128,7 +131,8 @@ def obtener_tarjetas(empleado_identificacion: Optional[str] = None,
                     offset: int = 0, 
                     limit: int = 200,  # Límite ajustado
                     use_cache: bool = True,
-                    fecha_cancelacion_desde: Optional[date] = None) -> List[Tuple]:
+                    fecha_cancelacion_desde: Optional[date] = None,
+                    despues: Optional[Tuple] = None) -> List[Tuple]:
                     
     """
     Obtiene las tarjetas según filtros especificados.
@@ -139,60 +143,336 @@ def obtener_tarjetas(empleado_identificacion: Optional[str] = None,
         offset: Número de registros a saltar
         limit: Número máximo de registros a retornar
         use_cache: Si se debe usar el caché
+        despues: Clave (numero_ruta, codigo) de la última fila de la página
+            anterior; si viene, se pagina por cursor y offset se ignora
     """
-    cache_key = f"tarjetas_{empleado_identificacion}_{estado}_{offset}_{limit}_{fecha_cancelacion_desde}"
+    ambito = str(empleado_identificacion) if empleado_identificacion else _AMBITO_TODAS
+    cache_key = (estado, offset, limit, fecha_cancelacion_desde, despues)
     
-    if use_cache and cache_key in _cache:
-        return _cache[cache_key]
+    if use_cache:
+        cacheado = _cache.get(ambito, cache_key)
+        if cacheado is not None:
+            return cacheado
+        generacion = _cache.generacion(ambito)
         
     try:
         with DatabasePool.get_cursor() as cursor:
-            modalidad_expr = "COALESCE(t.modalidad_pago, 'diario')" if _modalidad_column_exists() else "'diario'"
-            query = f'''
-                SELECT 
-                    t.codigo,
-                    t.monto,
-                    t.interes,
-                    c.nombre, 
-                    c.apellido,
-                    t.cuotas,
-                    t.numero_ruta,
-                    t.estado,
-                    t.fecha_creacion,
-                    t.cliente_identificacion,
-                    t.empleado_identificacion,
-                    t.observaciones,
-                    t.fecha_cancelacion,
-                    {modalidad_expr} as modalidad_pago
-                FROM tarjetas t
-                JOIN clientes c ON t.cliente_identificacion = c.identificacion
-                WHERE t.estado = %s
-                AND (CASE WHEN %s IS NULL THEN TRUE 
-                         ELSE t.empleado_identificacion = %s END)
-            '''
-            params: List = [estado, empleado_identificacion, empleado_identificacion]
-
-            # Si se listan canceladas y se pide un "desde", filtrar por fecha_cancelacion (DATE)
-            if estado in ('cancelada', 'canceladas') and fecha_cancelacion_desde is not None:
-                query += ' AND t.fecha_cancelacion IS NOT NULL AND t.fecha_cancelacion >= %s'
-                params.append(fecha_cancelacion_desde)
-
-            query += '''
-                ORDER BY t.numero_ruta, t.codigo
-                OFFSET %s LIMIT %s
-            '''
-            params.extend([offset, limit])
-            cursor.execute(query, tuple(params))
+            query, params = _consulta_tarjetas(empleado_identificacion, estado, offset, limit, fecha_cancelacion_desde, despues)
+            cursor.execute(query, params)
             result = cursor.fetchall()
             
             if use_cache:
-                _cache[cache_key] = result
+                _cache.set(ambito, cache_key, result, generacion)
             return result
             
     except Exception as e:
         logger.error(f"Error al obtener tarjetas: {e}")
         return []
 
+async def obtener_tarjetas_async(empleado_identificacion: Optional[str] = None,
+                                 estado: str = 'activas',
+                                 offset: int = 0,
+                                 limit: int = 200,
+                                 use_cache: bool = True,
+                                 fecha_cancelacion_desde: Optional[date] = None,
+                                 despues: Optional[Tuple] = None) -> List[Tuple]:
+    """Versión asíncrona de obtener_tarjetas (mismo caché, mismas filas y mismo orden)."""
+    ambito = str(empleado_identificacion) if empleado_identificacion else _AMBITO_TODAS
+    cache_key = (estado, offset, limit, fecha_cancelacion_desde, despues)
+    if use_cache:
+        cacheado = _cache.get(ambito, cache_key)
+        if cacheado is not None:
+            return cacheado
+        generacion = _cache.generacion(ambito)
+    try:
+        query, params = _consulta_tarjetas(empleado_identificacion, estado, offset, limit, fecha_cancelacion_desde, despues)
+        async with AsyncDatabasePool.get_cursor() as cursor:
+            await cursor.execute(query, params)
+            result = await cursor.fetchall()
+        if use_cache:
+            _cache.set(ambito, cache_key, result, generacion)
+        return result
+    except Exception as e:
+        logger.error(f"Error al obtener tarjetas (async): {e}")
+        return []
+
+def _consulta_tarjetas(empleado_identificacion: Optional[str], estado: str, offset: int, limit: int,
+                       fecha_cancelacion_desde: Optional[date], despues: Optional[Tuple] = None) -> Tuple[str, tuple]:
+    """SQL y parámetros de obtener_tarjetas (compartido por la versión síncrona y la asíncrona)."""
+    modalidad_expr = "COALESCE(t.modalidad_pago, 'diario')" if _modalidad_column_exists() else "'diario'"
+    select_sql = f'''
+        SELECT 
+            t.codigo,
+            t.monto,
+            t.interes,
+            c.nombre, 
+            c.apellido,
+            t.cuotas,
+            t.numero_ruta,
+            t.estado,
+            t.fecha_creacion,
+            t.cliente_identificacion,
+            t.empleado_identificacion,
+            t.observaciones,
+            t.fecha_cancelacion,
+            {modalidad_expr} as modalidad_pago
+        FROM tarjetas t
+        JOIN clientes c ON t.cliente_identificacion = c.identificacion
+    '''
+    # Filtros simples (sin CASE) para que el índice (empleado, estado, numero_ruta) resuelva el rango
+    condiciones = ['t.estado = %s']
+    params: List = [estado]
+    if empleado_identificacion is not None:
+        condiciones.append('t.empleado_identificacion = %s')
+        params.append(empleado_identificacion)
+
+    # Si se listan canceladas y se pide un "desde", filtrar por fecha_cancelacion (DATE)
+    if estado in ('cancelada', 'canceladas') and fecha_cancelacion_desde is not None:
+        condiciones.append('t.fecha_cancelacion IS NOT NULL AND t.fecha_cancelacion >= %s')
+        params.append(fecha_cancelacion_desde)
+
+    query, params = consulta_keyset(
+        select_sql, ' AND '.join(condiciones), params, ORDEN_TARJETAS_RUTA, despues, limit,
+        lider_nullable=True, offset=offset,
+    )
+    return query, tuple(params)
+
+def _columnas_snapshot_tarjeta() -> str:
+    modalidad_expr = "COALESCE(t.modalidad_pago, 'diario')" if _modalidad_column_exists() else "'diario'"
+    return f"""
+        t.codigo, t.monto, t.interes, t.cuotas, t.numero_ruta,
+        t.estado, t.fecha_creacion, t.cliente_identificacion,
+        t.empleado_identificacion, t.observaciones, t.fecha_cancelacion,
+        {modalidad_expr} AS modalidad_pago
+    """
+
+def _filas_a_dicts(cursor) -> List[Dict]:
+    columnas = [d[0] for d in cursor.description]
+    return [dict(zip(columnas, row)) for row in cursor.fetchall()]
+
+def _sync_token_actual(cursor) -> str:
+    """
+    Token de sincronización: xmin del snapshot actual. Toda transacción con
+    txid menor ya terminó, así que 'version_txid >= token' no pierde cambios.
+    """
+    cursor.execute("SELECT txid_snapshot_xmin(txid_current_snapshot())")
+    return str(cursor.fetchone()[0])
+
+def _cargar_clientes_y_abonos(cursor, tarjetas: List[Dict]) -> Tuple[Dict[str, Dict], Dict[str, List[Dict]]]:
+    """Carga (por conjuntos) los clientes y TODOS los abonos de las tarjetas dadas."""
+    codigos = [t['codigo'] for t in tarjetas]
+    cedulas = sorted({t['cliente_identificacion'] for t in tarjetas if t['cliente_identificacion']})
+
+    clientes: Dict[str, Dict] = {}
+    abonos: Dict[str, List[Dict]] = {c: [] for c in codigos}
+    if cedulas:
+        cursor.execute('''
+            SELECT identificacion, nombre, apellido,
+                   telefono, direccion, observaciones
+            FROM clientes
+            WHERE identificacion = ANY(%s)
+        ''', (cedulas,))
+        for c in _filas_a_dicts(cursor):
+            clientes[c['identificacion']] = c
+
+    if codigos:
+        cursor.execute('''
+            SELECT id, tarjeta_codigo, fecha, monto, indice_orden,
+                   COALESCE(metodo_pago, 'efectivo') AS metodo_pago
+            FROM abonos
+            WHERE tarjeta_codigo = ANY(%s)
+            ORDER BY tarjeta_codigo, fecha DESC
+        ''', (codigos,))
+        for a in _filas_a_dicts(cursor):
+            abonos[a['tarjeta_codigo']].append(a)
+    return clientes, abonos
+
+# Tarjetas por bloque en la descarga de ruta (cada bloque es una consulta corta)
+BLOQUE_SNAPSHOT = int(os.getenv('SNAPSHOT_BLOQUE_TARJETAS', '500'))
+
+def iniciar_snapshot_empleado(empleado_identificacion: str) -> Optional[Dict]:
+    """
+    Cabecera de la descarga de ruta: {'sync_token': str, 'total_tarjetas': int}
+    o None si ocurre un error. El token se toma ANTES de leer los bloques, así
+    cualquier cambio confirmado mientras se emiten llega luego por /changes.
+    """
+    try:
+        with DatabasePool.get_cursor() as cursor:
+            sync_token = _sync_token_actual(cursor)
+            cursor.execute('''
+                SELECT COUNT(*) FROM tarjetas t
+                WHERE t.empleado_identificacion = %s
+                AND t.estado = 'activas'
+            ''', (empleado_identificacion,))
+            return {'sync_token': sync_token, 'total_tarjetas': int(cursor.fetchone()[0])}
+
+    except Exception as e:
+        logger.error(f"Error al iniciar snapshot del empleado: {e}")
+        return None
+
+def iterar_snapshot_empleado(empleado_identificacion: str, bloque: int = BLOQUE_SNAPSHOT):
+    """
+    Generador de la descarga de ruta: (tarjetas, clientes, abonos) por bloques
+    de tarjetas activas en orden de ruta, cada bloque con sus clientes y TODOS
+    sus abonos (3 consultas por bloque).
+
+    Cada bloque se lee en su propia transacción y continúa por keyset después
+    de la última tarjeta del anterior: en memoria solo hay un bloque y no se
+    retiene una conexión del pool mientras el cliente descarga. Los errores se
+    propagan (la respuesta ya empezó y se corta).
+    """
+    despues = None
+    while True:
+        with DatabasePool.get_cursor() as cursor:
+            query, params = consulta_keyset(
+                f'SELECT {_columnas_snapshot_tarjeta()} FROM tarjetas t',
+                "t.empleado_identificacion = %s AND t.estado = 'activas'",
+                [empleado_identificacion], ORDEN_TARJETAS_RUTA, despues, bloque,
+                lider_nullable=True,
+            )
+            cursor.execute(query, tuple(params))
+            tarjetas = _filas_a_dicts(cursor)
+            clientes, abonos = _cargar_clientes_y_abonos(cursor, tarjetas)
+        if tarjetas:
+            yield tarjetas, clientes, abonos
+        if len(tarjetas) < bloque:
+            return
+        despues = (tarjetas[-1]['numero_ruta'], tarjetas[-1]['codigo'])
+
+# Días que se conservan las lápidas de sync_eliminados
+SYNC_RETENCION_DIAS = int(os.getenv('SYNC_RETENCION_DIAS', '30'))
+
+def _token_minimo_sync(cursor) -> int:
+    """Token más antiguo que /changes todavía puede atender (0 sin migración 020)."""
+    if not Esquema.tiene_tabla('sync_retencion'):
+        return 0
+    cursor.execute("SELECT token_minimo FROM sync_retencion WHERE id = 1")
+    fila = cursor.fetchone()
+    return int(fila[0]) if fila else 0
+
+def purgar_sync_eliminados(dias: int = SYNC_RETENCION_DIAS) -> Optional[Dict]:
+    """
+    Elimina las lápidas de sync_eliminados con más de 'dias' de antigüedad.
+
+    Se borran todas las lápidas con version_txid hasta el de la más reciente
+    de las vencidas y token_minimo pasa a ese txid + 1: los tokens menores
+    reciben full_resync, los demás siguen viendo todas sus lápidas.
+    Pensado para un cron (scripts/purge_sync_eliminados.py).
+
+    Retorna {'eliminadas': int, 'token_minimo': int} o None si ocurre un error.
+    """
+    try:
+        with DatabasePool.get_cursor() as cursor:
+            cursor.execute('''
+                SELECT MAX(version_txid) FROM sync_eliminados
+                WHERE eliminado_en < (NOW() AT TIME ZONE 'UTC') - make_interval(days => %s)
+            ''', (dias,))
+            limite = cursor.fetchone()[0]
+            if limite is None:
+                return {'eliminadas': 0, 'token_minimo': _token_minimo_sync(cursor)}
+
+            cursor.execute('DELETE FROM sync_eliminados WHERE version_txid <= %s', (limite,))
+            eliminadas = cursor.rowcount
+            cursor.execute('''
+                UPDATE sync_retencion
+                SET token_minimo = GREATEST(token_minimo, %s),
+                    purgado_en = (NOW() AT TIME ZONE 'UTC')
+                WHERE id = 1
+                RETURNING token_minimo
+            ''', (limite + 1,))
+            return {'eliminadas': eliminadas, 'token_minimo': int(cursor.fetchone()[0])}
+
+    except Exception as e:
+        logger.error(f"Error al purgar lápidas de sincronización: {e}")
+        return None
+
+def obtener_cambios_empleado(empleado_identificacion: str, desde_token: int) -> Optional[Dict]:
+    """
+    Cambios de la ruta de un empleado desde un token de sincronización.
+    - tarjetas: tarjetas del empleado modificadas (cualquier estado); las activas
+      vienen con su cliente y TODOS sus abonos para reemplazarlas completas.
+    - abonos: abonos nuevos/modificados de tarjetas activas no incluidas arriba.
+    - clientes: clientes modificados que tienen tarjetas activas con el empleado.
+    - eliminados: lápidas de tarjetas (borradas o movidas) y abonos borrados.
+    Retorna {'full_resync': True} si el token es anterior a las lápidas
+    purgadas (ver purgar_sync_eliminados) y None si ocurre un error (p. ej.
+    migración 011 no aplicada).
+    """
+    try:
+        with DatabasePool.get_cursor() as cursor:
+            if desde_token < _token_minimo_sync(cursor):
+                return {'full_resync': True}
+            sync_token = _sync_token_actual(cursor)
+
+            cursor.execute(f'''
+                SELECT {_columnas_snapshot_tarjeta()}
+                FROM tarjetas t
+                WHERE t.empleado_identificacion = %s
+                AND t.version_txid >= %s
+                ORDER BY t.numero_ruta, t.codigo
+            ''', (empleado_identificacion, desde_token))
+            tarjetas = _filas_a_dicts(cursor)
+            activas = [t for t in tarjetas if t['estado'] == 'activas']
+            clientes, abonos = _cargar_clientes_y_abonos(cursor, activas)
+            cambiadas = [t['codigo'] for t in tarjetas]
+
+            cursor.execute('''
+                SELECT a.id, a.tarjeta_codigo, a.fecha, a.monto, a.indice_orden,
+                       COALESCE(a.metodo_pago, 'efectivo') AS metodo_pago
+                FROM abonos a
+                JOIN tarjetas t ON t.codigo = a.tarjeta_codigo
+                WHERE a.version_txid >= %s
+                AND t.empleado_identificacion = %s
+                AND t.estado = 'activas'
+                AND NOT (a.tarjeta_codigo = ANY(%s))
+                ORDER BY a.tarjeta_codigo, a.fecha DESC
+            ''', (desde_token, empleado_identificacion, cambiadas))
+            abonos_cambiados = _filas_a_dicts(cursor)
+
+            cursor.execute('''
+                SELECT c.identificacion, c.nombre, c.apellido,
+                       c.telefono, c.direccion, c.observaciones
+                FROM clientes c
+                WHERE c.version_txid >= %s
+                AND EXISTS (
+                    SELECT 1 FROM tarjetas t
+                    WHERE t.cliente_identificacion = c.identificacion
+                    AND t.empleado_identificacion = %s
+                    AND t.estado = 'activas'
+                )
+            ''', (desde_token, empleado_identificacion))
+            clientes_cambiados = _filas_a_dicts(cursor)
+
+            cursor.execute('''
+                SELECT tabla, clave, tarjeta_codigo
+                FROM sync_eliminados
+                WHERE empleado_identificacion = %s
+                AND version_txid >= %s
+            ''', (empleado_identificacion, desde_token))
+            eliminados = {'tarjetas': [], 'abonos': []}
+            vigentes = set(cambiadas)
+            for tabla, clave, tarjeta_codigo in cursor.fetchall():
+                if tabla == 'tarjetas':
+                    # Si la tarjeta volvió a este empleado, la fila actual manda
+                    if clave not in vigentes:
+                        eliminados['tarjetas'].append(clave)
+                elif tabla == 'abonos':
+                    eliminados['abonos'].append({'id': int(clave), 'tarjeta_codigo': tarjeta_codigo})
+
+            return {
+                'sync_token': sync_token,
+                'tarjetas': tarjetas,
+                'clientes': clientes,
+                'abonos': abonos,
+                'abonos_cambiados': abonos_cambiados,
+                'clientes_cambiados': clientes_cambiados,
+                'eliminados': eliminados,
+            }
+
+    except Exception as e:
+        logger.error(f"Error al obtener cambios del empleado: {e}")
+        return None
+
 def obtener_tarjeta_por_codigo(codigo: str) -> Optional[Dict]:
     """Obtiene una tarjeta específica por su código"""
     try:
@@ -214,7 +494,10 @@ def obtener_tarjeta_por_codigo(codigo: str) -> Optional[Dict]:
                     {modalidad_expr} as modalidad_pago,
                     c.nombre,
                     c.apellido,
-                    c.telefono
+                    c.telefono,
+                    {expr_total_abonado('t')},
+                    {expr_abonos_count('t')},
+                    {expr_ultimo_abono('t')}
                 FROM tarjetas t
                 JOIN clientes c ON t.cliente_identificacion = c.identificacion
                 WHERE t.codigo = %s
@@ -238,7 +521,10 @@ def obtener_tarjeta_por_codigo(codigo: str) -> Optional[Dict]:
                     'modalidad_pago': result[11] or 'diario',
                     'cliente_nombre': result[12],
                     'cliente_apellido': result[13],
-                    'cliente_telefono': result[14]
+                    'cliente_telefono': result[14],
+                    'total_abonado': result[15],
+                    'abonos_count': result[16],
+                    'ultimo_abono_fecha': result[17]
                 }
             return None
             
@@ -258,13 +544,14 @@ def actualizar_estado_tarjeta(tarjeta_codigo: str, nuevo_estado: str) -> bool:
                 SET estado = %s,
                     fecha_cancelacion = %s
                 WHERE codigo = %s
-                RETURNING codigo
+                RETURNING codigo, empleado_identificacion
             '''
             cursor.execute(query, (nuevo_estado, fecha_cancelacion, tarjeta_codigo))
             result = cursor.fetchone()
             
             # Limpiar caché relacionado con tarjetas
-            _cache.clear()
+            if result is not None:
+                invalidar_cache_tarjetas(result[1])
             
             return result is not None
             
@@ -285,7 +572,7 @@ def actualizar_rutas_masivo(updates: List[Tuple[str, Decimal]]) -> bool:
             params = [(ruta, codigo) for codigo, ruta in updates]
             cursor.executemany(query, params)
             
-            _cache.clear()
+            invalidar_cache_tarjetas()
             return True
     except Exception as e:
         logger.error(f"Error al actualizar rutas masivamente: {e}")
@@ -310,6 +597,159 @@ def contar_tarjetas_por_estado(empleado_identificacion: Optional[str] = None,
         logger.error(f"Error al contar tarjetas: {e}")
         return 0 
 
+class _RutasEmpleado:
+    """
+    Rutas de las tarjetas ACTIVAS de un empleado, consultadas punto a punto
+    (vecina anterior/siguiente, existencia, máximo) sobre el índice parcial
+    idx_tarjetas_activas_empleado_ruta: cada consulta es O(log n) en lugar de
+    leer todas las rutas del empleado. `agregar` registra rutas asignadas en
+    la misma transacción que aún no están insertadas (lotes de /sync).
+
+    Las reglas trabajan con rutas enteras (numero_ruta::int, que redondea):
+    int(r) > x equivale a r >= x + 0.5 y int(r) < x a r < x - 0.5, así los
+    filtros quedan sobre la columna y usan el índice.
+    """
+
+    _MEDIO = Decimal('0.5')
+
+    def __init__(self, cursor, empleado_identificacion: str):
+        self._cursor = cursor
+        self._empleado = empleado_identificacion
+        self._agregadas: List[int] = []
+
+    def _escalar(self, select: str, condicion: str = 'TRUE', params: tuple = ()):
+        self._cursor.execute(f"""
+            SELECT {select}
+            FROM tarjetas
+            WHERE empleado_identificacion = %s AND estado = 'activas'
+              AND numero_ruta IS NOT NULL AND {condicion}
+        """, (self._empleado,) + params)
+        fila = self._cursor.fetchone()
+        return fila[0] if fila else None
+
+    def agregar(self, ruta: int):
+        bisect.insort(self._agregadas, int(ruta))
+
+    def hay_rutas(self) -> bool:
+        """Si el empleado tiene alguna tarjeta activa con ruta (se detiene en la primera)."""
+        if self._agregadas:
+            return True
+        self._cursor.execute("""
+            SELECT EXISTS (
+                SELECT 1 FROM tarjetas
+                WHERE empleado_identificacion = %s AND estado = 'activas'
+                  AND numero_ruta IS NOT NULL
+            )
+        """, (self._empleado,))
+        fila = self._cursor.fetchone()
+        return bool(fila and fila[0])
+
+    def maximo(self) -> Optional[int]:
+        candidatos = [self._escalar('MAX(numero_ruta)::int')]
+        if self._agregadas:
+            candidatos.append(self._agregadas[-1])
+        candidatos = [c for c in candidatos if c is not None]
+        return max(candidatos) if candidatos else None
+
+    def existe(self, ruta: int) -> bool:
+        i = bisect.bisect_left(self._agregadas, ruta)
+        if i < len(self._agregadas) and self._agregadas[i] == ruta:
+            return True
+        return bool(self._escalar(
+            'COUNT(*) > 0', 'numero_ruta >= %s AND numero_ruta < %s',
+            (Decimal(ruta) - self._MEDIO, Decimal(ruta) + self._MEDIO),
+        ))
+
+    def siguiente(self, ruta: int) -> Optional[int]:
+        """Menor ruta mayor que `ruta`."""
+        candidatos = [self._escalar('MIN(numero_ruta)::int', 'numero_ruta >= %s', (Decimal(ruta) + self._MEDIO,))]
+        i = bisect.bisect_right(self._agregadas, ruta)
+        if i < len(self._agregadas):
+            candidatos.append(self._agregadas[i])
+        candidatos = [c for c in candidatos if c is not None]
+        return min(candidatos) if candidatos else None
+
+    def anterior(self, ruta: int) -> Optional[int]:
+        """Mayor ruta menor que `ruta`."""
+        candidatos = [self._escalar('MAX(numero_ruta)::int', 'numero_ruta < %s', (Decimal(ruta) - self._MEDIO,))]
+        i = bisect.bisect_left(self._agregadas, ruta)
+        if i > 0:
+            candidatos.append(self._agregadas[i - 1])
+        candidatos = [c for c in candidatos if c is not None]
+        return max(candidatos) if candidatos else None
+
+def _calcular_numero_ruta(rutas: _RutasEmpleado, pa: Optional[int] = None, ps: Optional[int] = None) -> Decimal:
+    """
+    Aplica las reglas de asignación de ruta (mitad entera / siguiente centena)
+    consultando solo las rutas vecinas de las tarjetas activas del empleado.
+    Sin tarjetas activas la primera ruta es 100; el máximo solo se consulta
+    cuando no hay posición de referencia.
+    """
+    def siguiente_centena(max_ruta: int) -> int:
+        c = ((max_ruta // 100) + 1) * 100
+        return min(c, 9900)
+
+    # Caso con ambas posiciones: usar exactamente la mitad entera si es posible
+    if pa is not None and ps is not None:
+        if not rutas.hay_rutas():
+            return Decimal('100')
+        if ps - pa > 1:
+            mitad = (pa + ps) // 2
+            if mitad > pa and mitad < ps and not rutas.existe(mitad):
+                return Decimal(mitad)
+        # Sin hueco entero exacto: avanzar a la siguiente centena disponible
+        return Decimal(siguiente_centena(max(pa, ps)))
+
+    # Solo anterior: buscar siguiente y aplicar misma estrategia
+    if pa is not None:
+        # Buscar siguiente existente mayor a pa
+        ps2 = rutas.siguiente(pa)
+        if ps2 is not None:
+            if ps2 - pa > 1:
+                mitad = (pa + ps2) // 2
+                if mitad > pa and mitad < ps2 and not rutas.existe(mitad):
+                    return Decimal(mitad)
+            # Si no hay hueco entero, usar la siguiente centena completa
+            return Decimal(siguiente_centena(ps2))
+        if not rutas.hay_rutas():
+            return Decimal('100')
+        # No hay siguiente: ir a la siguiente centena de inmediato
+        return Decimal(siguiente_centena(pa))
+
+    # Solo siguiente: buscar anterior y aplicar estrategia simétrica
+    if ps is not None:
+        pa2 = rutas.anterior(ps)
+        if pa2 is not None:
+            if ps - pa2 > 1:
+                mitad = (pa2 + ps) // 2
+                if mitad > pa2 and mitad < ps and not rutas.existe(mitad):
+                    return Decimal(mitad)
+            # Sin hueco entero, bajar a la centena anterior si existe
+            cent = ((ps - 1) // 100) * 100
+            if cent >= 100 and not rutas.existe(cent):
+                return Decimal(cent)
+            return Decimal(max(100, ps - 1))
+        if not rutas.hay_rutas():
+            return Decimal('100')
+        # No hay anterior: tomar la centena previa
+        cent = ((ps - 1) // 100) * 100
+        return Decimal(max(100, cent))
+
+    max_r = rutas.maximo()
+    # Si no hay rutas, empezar en 100
+    if max_r is None:
+        return Decimal('100')
+
+    # Sin referencia: si hay espacio para centena siguiente
+    cand = siguiente_centena(max_r)
+    if not rutas.existe(cand):
+        return Decimal(cand)
+    # Ya en 9900: la siguiente unidad sobre el máximo está libre (nada es mayor que él)
+    if max_r + 1 <= 9999:
+        return Decimal(max_r + 1)
+    # Fallback a 9900
+    return Decimal('9900')
+
 def obtener_siguiente_numero_ruta(empleado_identificacion: str, posicion_anterior: Optional[Decimal] = None, posicion_siguiente: Optional[Decimal] = None) -> Decimal:
     try:
         with DatabasePool.get_cursor() as cursor:
@@ -317,83 +757,54 @@ def obtener_siguiente_numero_ruta(empleado_identificacion: str, posicion_anterio
             pa = int(posicion_anterior) if posicion_anterior is not None else None
             ps = int(posicion_siguiente) if posicion_siguiente is not None else None
 
-            # Leer todas las rutas del empleado
-            cursor.execute("""
-                SELECT numero_ruta::int
-                FROM tarjetas
-                WHERE empleado_identificacion = %s
-                ORDER BY numero_ruta::int
-            """, (empleado_identificacion,))
-            rutas = [r[0] for r in cursor.fetchall()]
-
-            # Si no hay rutas, empezar en 100
-            if not rutas:
-                return Decimal('100')
-
-            def siguiente_centena(max_ruta: int) -> int:
-                c = ((max_ruta // 100) + 1) * 100
-                return min(c, 9900)
-
-            # Caso con ambas posiciones: usar exactamente la mitad entera si es posible
-            if pa is not None and ps is not None:
-                if ps - pa > 1:
-                    mitad = (pa + ps) // 2
-                    if mitad > pa and mitad < ps and mitad not in rutas:
-                        return Decimal(mitad)
-                # Sin hueco entero exacto: avanzar a la siguiente centena disponible
-                return Decimal(siguiente_centena(max(pa, ps)))
-
-            # Solo anterior: buscar siguiente y aplicar misma estrategia
-            if pa is not None:
-                # Buscar siguiente existente mayor a pa
-                siguientes = [r for r in rutas if r > pa]
-                if siguientes:
-                    ps2 = siguientes[0]
-                    if ps2 - pa > 1:
-                        mitad = (pa + ps2) // 2
-                        if mitad > pa and mitad < ps2 and mitad not in rutas:
-                            return Decimal(mitad)
-                    # Si no hay hueco entero, usar la siguiente centena completa
-                    return Decimal(siguiente_centena(ps2))
-                else:
-                    # No hay siguiente: ir a la siguiente centena de inmediato
-                    return Decimal(siguiente_centena(pa))
-
-            # Solo siguiente: buscar anterior y aplicar estrategia simétrica
-            if ps is not None:
-                anteriores = [r for r in rutas if r < ps]
-                if anteriores:
-                    pa2 = anteriores[-1]
-                    if ps - pa2 > 1:
-                        mitad = (pa2 + ps) // 2
-                        if mitad > pa2 and mitad < ps and mitad not in rutas:
-                            return Decimal(mitad)
-                    # Sin hueco entero, bajar a la centena anterior si existe
-                    cent = ((ps - 1) // 100) * 100
-                    if cent >= 100 and cent not in rutas:
-                        return Decimal(cent)
-                    return Decimal(max(100, ps - 1))
-                else:
-                    # No hay anterior: tomar la centena previa
-                    cent = ((ps - 1) // 100) * 100
-                    return Decimal(max(100, cent))
-
-            # Sin referencia: si hay espacio para centena siguiente
-            max_r = rutas[-1]
-            cand = siguiente_centena(max_r)
-            if cand not in rutas:
-                return Decimal(cand)
-            # Si ya estamos en 9900, intentar la siguiente unidad disponible hasta 9999
-            for c in range(max_r + 1, 10000):
-                if c not in rutas and c <= 9999:
-                    return Decimal(c)
-            # Fallback a 9900
-            return Decimal('9900')
+            return _calcular_numero_ruta(_RutasEmpleado(cursor, empleado_identificacion), pa, ps)
 
     except Exception as e:
         logger.error(f"Error al obtener siguiente número de ruta: {e}")
         return Decimal('1.000')
 
+def _reservar_codigos(cursor, cantidades: Dict[str, int]) -> Dict[str, int]:
+    """
+    Reserva `cantidad` números consecutivos por prefijo ('AAMMDD-XXXX-') en
+    tarjetas_codigo_secuencias con una sola sentencia y devuelve el primero de
+    cada prefijo. La fila del prefijo queda bloqueada hasta el commit (las altas
+    concurrentes del mismo prefijo esperan su turno) y si la transacción se
+    revierte el contador también. Lanza ValueError si se pasa de 999.
+    """
+    prefijos = sorted(cantidades)
+    cursor.execute("""
+        INSERT INTO tarjetas_codigo_secuencias AS s (prefijo, ultimo_n)
+        SELECT p.prefijo, p.cantidad
+        FROM unnest(%s::text[], %s::int[]) AS p(prefijo, cantidad)
+        ORDER BY p.prefijo
+        ON CONFLICT (prefijo) DO UPDATE SET ultimo_n = s.ultimo_n + EXCLUDED.ultimo_n
+        RETURNING prefijo, ultimo_n
+    """, (prefijos, [cantidades[p] for p in prefijos]))
+    primeros: Dict[str, int] = {}
+    for prefijo, ultimo_n in cursor.fetchall():
+        if ultimo_n > 999:
+            logger.error("No hay secuencias disponibles para prefijo %s", prefijo)
+            raise ValueError(f"No hay secuencias disponibles para prefijo {prefijo}")
+        primeros[prefijo] = ultimo_n - cantidades[prefijo] + 1
+    return primeros
+
+def _resincronizar_codigo(cursor, prefijo: str):
+    """
+    Lleva el contador del prefijo al máximo código existente. Solo hace falta si
+    un código se creó sin pasar por el contador (p. ej. una instancia con la
+    versión anterior durante un despliegue).
+    """
+    cursor.execute("SELECT MAX(codigo) FROM tarjetas WHERE codigo LIKE %s", (prefijo + '%',))
+    fila = cursor.fetchone()
+    try:
+        maximo = int(fila[0][-3:]) if fila and fila[0] else 0
+    except ValueError:
+        maximo = 0
+    cursor.execute("""
+        UPDATE tarjetas_codigo_secuencias SET ultimo_n = GREATEST(ultimo_n, %s)
+        WHERE prefijo = %s
+    """, (maximo, prefijo))
+
 def crear_tarjeta(
     cliente_identificacion: str,
     empleado_identificacion: str,
@@ -433,79 +844,54 @@ def crear_tarjeta(
             target_dt_raw = fecha_creacion or datetime.now(_tz.utc)
             # Normalizar a UTC naive (DB TIMESTAMP sin TZ)
             target_dt = target_dt_raw.astimezone(_tz.utc).replace(tzinfo=None)
-            # logs de diagnóstico removidos tras estabilizar la migración
             # Prefijo AAMMDD-XXXX-
             fecha_pref = target_dt.strftime('%y%m%d')
             ultimos = cliente_identificacion[-4:]
             prefix = f"{fecha_pref}-{ultimos}-"
 
-            # Calcular punto de inicio consultando el máximo existente con ese prefijo
-            try:
-                cursor.execute("SELECT MAX(codigo) FROM tarjetas WHERE codigo LIKE %s", (prefix + '%',))
-                row = cursor.fetchone()
-                start_n = int(row[0][-3:]) + 1 if row and row[0] else 1
-            except Exception:
-                start_n = 1
-
-            # Intentar insertar de forma atómica evitando colisiones de PK
-            col_ok = _modalidad_column_exists()
-            for n in range(start_n, 1000):
-                codigo_try = f"{prefix}{n:03d}"
-                if col_ok:
-                    query = '''
-                        INSERT INTO tarjetas (
-                            codigo, cliente_identificacion, empleado_identificacion,
-                            numero_ruta, monto, cuotas, interes,
-                            estado, observaciones, fecha_creacion, modalidad_pago
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, 'activas', %s, %s, %s)
-                        ON CONFLICT (codigo) DO NOTHING
-                        RETURNING codigo
-                    '''
-                    cursor.execute(query, (
-                        codigo_try,
-                        cliente_identificacion,
-                        empleado_identificacion,
-                        numero_ruta,
-                        monto,
-                        cuotas,
-                        interes,
-                        observaciones,
-                        target_dt,
-                        (modalidad_pago or 'diario')
-                    ))
-                else:
-                    query = '''
-                        INSERT INTO tarjetas (
-                            codigo, cliente_identificacion, empleado_identificacion,
-                            numero_ruta, monto, cuotas, interes,
-                            estado, observaciones, fecha_creacion
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, 'activas', %s, %s)
-                        ON CONFLICT (codigo) DO NOTHING
-                        RETURNING codigo
-                    '''
-                    cursor.execute(query, (
-                        codigo_try,
-                        cliente_identificacion,
-                        empleado_identificacion,
-                        numero_ruta,
-                        monto,
-                        cuotas,
-                        interes,
-                        observaciones,
-                        target_dt
-                    ))
+            columnas = (
+                "codigo, cliente_identificacion, empleado_identificacion, "
+                "numero_ruta, monto, cuotas, interes, estado, observaciones, fecha_creacion"
+            )
+            marcas = "%s, %s, %s, %s, %s, %s, %s, 'activas', %s, %s"
+            valores = [
+                cliente_identificacion,
+                empleado_identificacion,
+                numero_ruta,
+                monto,
+                cuotas,
+                interes,
+                observaciones,
+                target_dt,
+            ]
+            if _modalidad_column_exists():
+                columnas += ", modalidad_pago"
+                marcas += ", %s"
+                valores.append(modalidad_pago or 'diario')
+            query = f'''
+                INSERT INTO tarjetas ({columnas})
+                VALUES ({marcas})
+                ON CONFLICT (codigo) DO NOTHING
+                RETURNING codigo
+            '''
+
+            # El número sale del contador del prefijo: un solo UPSERT, sin probar códigos
+            codigo_tarjeta = None
+            for intento in range(2):
+                n = _reservar_codigos(cursor, {prefix: 1})[prefix]
+                cursor.execute(query, [f"{prefix}{n:03d}"] + valores)
                 got = cursor.fetchone()
                 if got and got[0]:
                     codigo_tarjeta = got[0]
-                    # comprobación post-inserción removida (innecesaria en producción)
                     break
-            else:
-                # no se pudo encontrar un código libre
-                logger.error("No hay secuencias disponibles para prefijo %s", prefix)
+                # El código ya existía fuera del contador: alinearlo y reintentar una vez
+                _resincronizar_codigo(cursor, prefix)
+            if codigo_tarjeta is None:
+                logger.error("No se pudo asignar un código libre para el prefijo %s", prefix)
                 return None
             
             # Limpiar el caché después de crear la tarjeta
-            _cache.clear()
+            invalidar_cache_tarjetas(empleado_identificacion)
             
             return codigo_tarjeta
             
@@ -558,48 +944,123 @@ def actualizar_tarjeta(
                 UPDATE tarjetas 
                 SET {', '.join(updates)}
                 WHERE codigo = %s
-                RETURNING codigo
+                RETURNING codigo, empleado_identificacion
             '''
             params.append(tarjeta_codigo)
             cursor.execute(query, params)
             
-            _cache.clear()
-            return cursor.fetchone() is not None
+            row = cursor.fetchone()
+            if row is not None:
+                invalidar_cache_tarjetas(row[1])
+            return row is not None
     except Exception as e:
         logger.error(f"Error al actualizar tarjeta: {e}")
         return False
 
+# Máximo de resultados de una búsqueda
+LIMITE_BUSQUEDA_MAX = 200
+
+def _escapar_like(texto: str) -> str:
+    return texto.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
 def buscar_tarjetas(
     termino: str,
     empleado_identificacion: Optional[str] = None,
-    estado: str = 'activas'
-) -> List[Tuple]:
-    """Busca tarjetas por nombre o apellido del cliente"""
+    estado: str = 'activas',
+    limite: int = 50,
+) -> List[Dict]:
+    """
+    Busca tarjetas por nombre, apellido, identificación o teléfono del cliente.
+
+    Con la migración 016 (pg_trgm + unaccent) la coincidencia ignora tildes y
+    mayúsculas, tolera errores de tipeo y se ordena por similitud; los índices
+    GIN de trigramas sobre clientes evitan el recorrido secuencial. Devuelve en
+    una sola consulta todos los campos del esquema Tarjeta.
+    """
+    termino = (termino or '').strip()
+    if not termino:
+        return []
+    limite = max(1, min(int(limite or 50), LIMITE_BUSQUEDA_MAX))
+    patron = f'%{_escapar_like(termino)}%'
+    modalidad_expr = "COALESCE(t.modalidad_pago, 'diario')" if _modalidad_column_exists() else "'diario'"
+    condiciones = ['t.estado = %s']
+    filtros: List = [estado]
+    if empleado_identificacion is not None:
+        condiciones.append('t.empleado_identificacion = %s')
+        filtros.append(empleado_identificacion)
+
+    if Esquema.tiene_funcion('busqueda_normalizar'):
+        # El término se normaliza en SQL con la misma función de los índices;
+        # al ser IMMUTABLE sobre una constante, el planificador la evalúa una vez
+        nombre_expr = "busqueda_normalizar(c.nombre || ' ' || c.apellido)"
+        relevancia = f'''GREATEST(
+                    word_similarity(busqueda_normalizar(%s), {nombre_expr}),
+                    CASE WHEN c.identificacion LIKE %s OR c.telefono LIKE %s THEN 1 ELSE 0 END
+                )'''
+        coincidencia = f'''(
+                    {nombre_expr} LIKE '%%' || busqueda_normalizar(%s) || '%%'
+                    OR busqueda_normalizar(%s) <%% {nombre_expr}
+                    OR c.identificacion LIKE %s
+                    OR c.telefono LIKE %s
+                )'''
+        params_relevancia = [termino, patron, patron]
+        params_coincidencia = [_escapar_like(termino), termino, patron, patron]
+    else:
+        # Sin la migración 016: coincidencia por ILIKE, sin ranking
+        relevancia = '0'
+        coincidencia = '''(
+                    c.nombre ILIKE %s OR c.apellido ILIKE %s
+                    OR c.identificacion LIKE %s OR c.telefono LIKE %s
+                )'''
+        params_relevancia = []
+        params_coincidencia = [patron, patron, patron, patron]
+
+    query = f'''
+        SELECT
+            t.codigo, t.monto, t.interes,
+            c.nombre, c.apellido,
+            t.cuotas, t.numero_ruta, t.estado, t.fecha_creacion,
+            t.cliente_identificacion, t.empleado_identificacion,
+            t.observaciones, t.fecha_cancelacion,
+            {modalidad_expr} AS modalidad_pago,
+            {relevancia} AS relevancia
+        FROM clientes c
+        JOIN tarjetas t ON t.cliente_identificacion = c.identificacion
+        WHERE {' AND '.join(condiciones)}
+          AND {coincidencia}
+        ORDER BY relevancia DESC, t.numero_ruta, t.codigo
+        LIMIT %s
+    '''
+    params = params_relevancia + filtros + params_coincidencia + [limite]
     try:
         with DatabasePool.get_cursor() as cursor:
-            query = '''
-                SELECT t.codigo, t.codigo, t.numero_ruta, 
-                       c.nombre, c.apellido,
-                       t.fecha_creacion, t.monto, t.cuotas
-                FROM tarjetas t
-                JOIN clientes c ON t.cliente_identificacion = c.identificacion
-                WHERE t.estado = %s
-                AND (LOWER(c.nombre) LIKE LOWER(%s) OR 
-                     LOWER(c.apellido) LIKE LOWER(%s))
-                AND (CASE WHEN %s IS NULL THEN TRUE 
-                         ELSE t.empleado_identificacion = %s END)
-                ORDER BY t.numero_ruta
-            '''
-            termino_busqueda = f'%{termino}%'
-            cursor.execute(query, (
-                estado, termino_busqueda, termino_busqueda,
-                empleado_identificacion, empleado_identificacion
-            ))
-            return cursor.fetchall()
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
     except Exception as e:
         logger.error(f"Error al buscar tarjetas: {e}")
         return []
 
+    return [{
+        'codigo': row[0],
+        'monto': row[1],
+        'interes': row[2],
+        'cliente': {
+            'nombre': row[3],
+            'apellido': row[4],
+            'identificacion': row[9]
+        },
+        'cuotas': row[5],
+        'numero_ruta': row[6],
+        'estado': row[7],
+        'fecha_creacion': row[8],
+        'cliente_identificacion': row[9],
+        'empleado_identificacion': row[10],
+        'observaciones': row[11],
+        'fecha_cancelacion': row[12],
+        'modalidad_pago': row[13] or 'diario',
+        'relevancia': float(row[14] or 0),
+    } for row in rows]
+
 def mover_tarjeta(
     tarjeta_codigo: str,
     nuevo_empleado_identificacion: str,
@@ -628,7 +1089,8 @@ def mover_tarjeta(
                 nuevo_empleado_identificacion, nuevo_numero_ruta, tarjeta_codigo
             ))
             
-            _cache.clear()
+            # Cambia de empleado: afecta al origen y al destino
+            invalidar_cache_tarjetas()
             return cursor.fetchone() is not None
     except Exception as e:
         logger.error(f"Error al mover tarjeta: {e}")
@@ -642,10 +1104,12 @@ def eliminar_tarjeta(tarjeta_codigo: str) -> bool:
             cursor.execute('DELETE FROM abonos WHERE tarjeta_codigo = %s', (tarjeta_codigo,))
             
             # Luego eliminar la tarjeta
-            cursor.execute('DELETE FROM tarjetas WHERE codigo = %s RETURNING codigo', (tarjeta_codigo,))
+            cursor.execute('DELETE FROM tarjetas WHERE codigo = %s RETURNING codigo, empleado_identificacion', (tarjeta_codigo,))
             
-            _cache.clear()  # Limpiar caché
-            return cursor.fetchone() is not None
+            row = cursor.fetchone()
+            if row is not None:
+                invalidar_cache_tarjetas(row[1])  # Limpiar caché
+            return row is not None
             
     except Exception as e:
         logger.error(f"Error al eliminar tarjeta: {e}")
@@ -929,226 +1393,372 @@ def verificar_reactivacion_tarjeta(tarjeta_codigo: str) -> bool:
     Verifica el saldo de una tarjeta y actualiza su estado automáticamente.
     - Si saldo > 0 y estaba cancelada -> Reactiva a 'activas' y quita fecha_cancelacion.
     - Si saldo <= 0 y estaba activa -> Cancela y pone fecha_cancelacion.
+    El saldo sale de tarjetas.total_abonado: una sola sentencia sobre la fila.
     Retorna True si hubo cambio de estado.
     """
     try:
-        # Importación local para evitar circularidad
-        from .abonos_db import obtener_saldo_tarjeta
-        
-        saldo = obtener_saldo_tarjeta(tarjeta_codigo)
-        if saldo is None:
-            return False
-            
-        tarjeta = obtener_tarjeta_por_codigo(tarjeta_codigo)
-        if not tarjeta:
-            return False
-            
-        estado_actual = tarjeta.get('estado')
-        nuevo_estado = None
-        nueva_fecha_cancelacion = None
-        cambio_necesario = False
-        
-        # Lógica de transición
-        if saldo > 0 and estado_actual in ('cancelada', 'canceladas'):
-            nuevo_estado = 'activas'
-            nueva_fecha_cancelacion = None
-            cambio_necesario = True
-            logger.info(f"Reactivando tarjeta {tarjeta_codigo} (Saldo: {saldo})")
-            
-        elif saldo <= 0 and estado_actual == 'activas':
-            nuevo_estado = 'cancelada'
-            nueva_fecha_cancelacion = date.today()
-            cambio_necesario = True
-            logger.info(f"Cancelando tarjeta {tarjeta_codigo} (Saldo: {saldo})")
-            
-        if cambio_necesario:
-            with DatabasePool.get_cursor() as cursor:
-                query = '''
-                    UPDATE tarjetas 
-                    SET estado = %s,
-                        fecha_cancelacion = %s
-                    WHERE codigo = %s
-                '''
-                cursor.execute(query, (nuevo_estado, nueva_fecha_cancelacion, tarjeta_codigo))
-                
-            _cache.clear()
-            return True
-            
-        return False
+        with DatabasePool.get_cursor() as cursor:
+            cambios = actualizar_estado_por_saldo(cursor, [tarjeta_codigo], date.today())
+            for codigo, nuevo_estado, empleado in cambios:
+                logger.info(f"Tarjeta {codigo} pasa a '{nuevo_estado}' por saldo")
+                invalidar_cache_tarjetas(empleado)
+        return bool(cambios)
         
     except Exception as e:
         logger.error(f"Error al verificar reactivación de tarjeta {tarjeta_codigo}: {e}")
         return False
 
+def consulta_tarjetas_sin_abono(empleado_identificacion: str, fecha_filtro: date, timezone_name: Optional[str] = None,
+                                solo_conteo: bool = False) -> Tuple[str, tuple]:
+    """
+    SQL y parámetros de las tarjetas ACTIVAS del empleado sin abonos en el día
+    local `fecha_filtro` ("No dieron"). La comprobación es un anti-join
+    NOT EXISTS por tarjeta sobre el rango UTC del día: cada tarjeta activa
+    (idx_tarjetas_activas_empleado_ruta) sondea idx_abonos_tarjeta_fecha.
+
+    Con solo_conteo devuelve una sola fila con el COUNT (paso 9 de la
+    liquidación); si no, las filas con total pagado y atraso calculados en SQL:
+    atraso = max(0, cuotas teóricas - cuotas pagadas), con
+    cuotas teóricas = (fecha - creación) / factor de modalidad y
+    cuotas pagadas = floor(total pagado * cuotas / monto con interés).
+    """
+    # Día local como rango UTC [inicio, fin): usa el índice de abonos por fecha
+    inicio, fin = limites_dia_utc(fecha_filtro, timezone_name or 'America/Bogota')
+    where_sql = '''
+        WHERE t.empleado_identificacion = %s
+          AND t.estado = 'activas'
+          AND NOT EXISTS (
+              SELECT 1
+              FROM abonos a
+              WHERE a.tarjeta_codigo = t.codigo
+                AND a.fecha >= %s AND a.fecha < %s
+          )
+    '''
+    if solo_conteo:
+        return f"SELECT COUNT(*) FROM tarjetas t {where_sql}", (empleado_identificacion, inicio, fin)
+
+    modalidad_expr = "COALESCE(t.modalidad_pago, 'diario')" if _modalidad_column_exists() else "'diario'"
+    query = f'''
+        SELECT
+            s.codigo, s.monto, s.cuotas, s.nombre, s.apellido, s.numero_ruta, s.interes,
+            s.total_pagado,
+            COALESCE(GREATEST(
+                0,
+                (%s::date - s.fecha_creacion::date) / s.factor
+                - CASE
+                    WHEN s.cuotas <= 0 THEN floor(s.total_pagado)
+                    WHEN s.monto_total > 0 THEN floor(s.total_pagado * s.cuotas / s.monto_total)
+                    ELSE 0
+                  END
+            ), 0)::int AS atraso
+        FROM (
+            SELECT
+                t.codigo,
+                COALESCE(t.monto, 0) AS monto,
+                -- 0 o NULL cuentan como 1 cuota (igual que el cálculo anterior en Python)
+                COALESCE(NULLIF(t.cuotas, 0), 1) AS cuotas,
+                c.nombre, c.apellido, t.numero_ruta,
+                COALESCE(t.interes, 0) AS interes,
+                t.fecha_creacion,
+                CASE
+                    WHEN {modalidad_expr} ILIKE '%%semanal%%' THEN 7
+                    WHEN {modalidad_expr} ILIKE '%%quincenal%%' THEN 15
+                    WHEN {modalidad_expr} ILIKE '%%mensual%%' THEN 30
+                    ELSE 1
+                END AS factor,
+                {expr_monto_total('t')} AS monto_total,
+                {expr_total_abonado('t')} AS total_pagado
+            FROM tarjetas t
+            JOIN clientes c ON t.cliente_identificacion = c.identificacion
+            {where_sql}
+        ) s
+        ORDER BY s.numero_ruta ASC, s.codigo ASC
+    '''
+    return query, (fecha_filtro, empleado_identificacion, inicio, fin)
+
+
 def listar_tarjetas_sin_abono_dia(empleado_identificacion: str, fecha_filtro: date, timezone_name: Optional[str] = None) -> List[Dict]:
     """
     Lista las tarjetas ACTIVAS asignadas al empleado que NO tienen abonos
-    registrados en la fecha específica (fecha local del usuario).
+    registrados en la fecha específica (fecha local del usuario), con el
+    total pagado y el atraso en cuotas.
     """
     try:
-        from datetime import datetime, timezone
-        from zoneinfo import ZoneInfo
-        
-        tz_name = timezone_name or 'America/Bogota'
-        
-        # ... (código existente comentado o eliminado en el replace) ...
-
+        query, params = consulta_tarjetas_sin_abono(empleado_identificacion, fecha_filtro, timezone_name)
         with DatabasePool.get_cursor() as cursor:
-            modalidad_expr = "COALESCE(t.modalidad_pago, 'diario')" if _modalidad_column_exists() else "'diario'"
-            
-            query = f'''
-                SELECT 
-                    t.codigo, t.monto, t.cuotas,
-                    c.nombre, c.apellido, t.numero_ruta,
-                    t.interes,
-                    t.fecha_creacion,
-                    {modalidad_expr},
-                    COALESCE(SUM(ah.monto), 0) as total_pagado
-                FROM tarjetas t
-                JOIN clientes c ON t.cliente_identificacion = c.identificacion
-                LEFT JOIN abonos ah ON t.codigo = ah.tarjeta_codigo
-                WHERE t.empleado_identificacion = %s
-                  AND t.estado = 'activas'
-                  AND t.codigo NOT IN (
-                      SELECT a.tarjeta_codigo 
-                      FROM abonos a
-                      JOIN tarjetas t2 ON a.tarjeta_codigo = t2.codigo
-                      WHERE t2.empleado_identificacion = %s
-                        AND (a.fecha AT TIME ZONE 'UTC' AT TIME ZONE %s)::date = %s
-                  )
-                GROUP BY t.codigo, c.identificacion
-                ORDER BY t.numero_ruta ASC, t.codigo ASC
-            '''
-            cursor.execute(query, (empleado_identificacion, empleado_identificacion, tz_name, fecha_filtro))
-            rows = cursor.fetchall()
-            
-            resultado = []
-            for row in rows:
-                codigo = row[0]
-                monto = Decimal(str(row[1] or 0))
-                cuotas = int(row[2] or 1)
-                interes = Decimal(str(row[6] or 0))
-                fecha_creacion = row[7]
-                if hasattr(fecha_creacion, 'date'): fecha_creacion = fecha_creacion.date()
-                modalidad = str(row[8] or 'diario').lower()
-                pagado = Decimal(str(row[9] or 0))
-                
-                # Calcular atraso
-                if 'semanal' in modalidad: factor = 7
-                elif 'quincenal' in modalidad: factor = 15
-                elif 'mensual' in modalidad: factor = 30
-                else: factor = 1
-                
-                dias_transcurridos = (fecha_filtro - fecha_creacion).days
-                cuotas_teoricas = dias_transcurridos // factor
-                
-                monto_total_deuda = monto * (1 + interes/100)
-                valor_cuota = monto_total_deuda / cuotas if cuotas > 0 else Decimal(1)
-                
-                cuotas_pagadas = int(pagado / valor_cuota) if valor_cuota > 0 else 0
-                atraso = max(0, cuotas_teoricas - cuotas_pagadas)
-
-                resultado.append({
-                    'codigo': codigo,
-                    'monto': float(monto),
-                    'cuotas': cuotas,
+            cursor.execute(query, params)
+            return [
+                {
+                    'codigo': row[0],
+                    'monto': float(row[1]),
+                    'cuotas': int(row[2]),
                     'cliente_nombre': row[3],
                     'cliente_apellido': row[4],
                     'numero_ruta': row[5],
-                    'interes': float(interes),
-                    'atraso': atraso
-                })
-            return resultado
+                    'interes': float(row[6]),
+                    'total_pagado': float(row[7]),
+                    'atraso': row[8],
+                }
+                for row in cursor.fetchall()
+            ]
 
     except Exception as e:
         logger.error(f"Error al listar tarjetas sin abono: {e}")
         return []
 
-def calcular_total_clavos(empleado_identificacion: Optional[str], fecha_corte: date, cuenta_id: Optional[int] = None) -> Decimal:
+
+def contar_tarjetas_sin_abono_dia(empleado_identificacion: str, fecha_filtro: date, timezone_name: Optional[str] = None) -> int:
+    """Cantidad de tarjetas activas del empleado sin abonos en el día local (sin armar las filas)."""
+    try:
+        query, params = consulta_tarjetas_sin_abono(empleado_identificacion, fecha_filtro, timezone_name, solo_conteo=True)
+        with DatabasePool.get_cursor() as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchone()[0] or 0
+    except Exception as e:
+        logger.error(f"Error al contar tarjetas sin abono: {e}")
+        return 0
+
+# Máximo de tarjetas por llamada a obtener_resumenes_tarjetas
+LIMITE_RESUMENES = 1000
+
+
+def obtener_resumenes_tarjetas(codigos: Optional[List[str]] = None, empleado_identificacion: Optional[str] = None,
+                               estado: Optional[str] = 'activas', cuenta_id: Optional[int] = None,
+                               solo_empleado: Optional[str] = None) -> Optional[List[Dict]]:
     """
-    Calcula el saldo total de tarjetas 'activas' que tienen más de 60 días de vencidas
-    a la fecha de corte. Aislado por cuenta si se proporciona cuenta_id.
-    
-    Criterio Clavo: (Fecha Corte - Fecha Vencimiento) >= 60 días.
-    Fecha Vencimiento = Fecha Creación + (Cuotas * Factor Modalidad)
-    Factor Modalidad: diario=1, semanal=7, quincenal=15, mensual=30.
+    Datos para el resumen de muchas tarjetas en una sola consulta: por lista de
+    códigos o por empleado (+ estado). El total abonado es la columna
+    denormalizada; el resto del cálculo lo hace quien llama.
+
+    Aislado por cuenta (cuenta_id) y, para cobradores, por su empleado
+    (solo_empleado). Trae hasta LIMITE_RESUMENES + 1 filas: si vienen más de
+    LIMITE_RESUMENES, quien llama debe rechazar el pedido en vez de truncarlo.
+    Retorna None si ocurre un error (una lista vacía es "no hay tarjetas").
     """
+    if codigos is not None:
+        codigos = list(dict.fromkeys(str(c) for c in codigos if c))
+        if not codigos:
+            return []
+        condiciones = ['t.codigo = ANY(%s)']
+        params: List = [codigos]
+    elif empleado_identificacion:
+        condiciones = ['t.empleado_identificacion = %s']
+        params = [empleado_identificacion]
+        if estado:
+            condiciones.append('t.estado = %s')
+            params.append(estado)
+    else:
+        return []
+    if solo_empleado is not None:
+        condiciones.append('t.empleado_identificacion = %s')
+        params.append(solo_empleado)
+    if cuenta_id is not None:
+        condiciones.append('e.cuenta_id = %s')
+        params.append(cuenta_id)
     try:
         with DatabasePool.get_cursor() as cursor:
-            # Filtros de aislamiento
-            where_clauses = ["t.estado = 'activas'"]
-            params = []
-            
-            if empleado_identificacion:
-                where_clauses.append("t.empleado_identificacion = %s")
-                params.append(empleado_identificacion)
-            
-            if cuenta_id is not None:
-                where_clauses.append("e.cuenta_id = %s")
-                params.append(cuenta_id)
-
             modalidad_expr = "COALESCE(t.modalidad_pago, 'diario')" if _modalidad_column_exists() else "'diario'"
-            
-            where_sql = " AND ".join(where_clauses)
-            
-            query = f'''
-                SELECT 
-                    t.codigo, 
-                    t.fecha_creacion, 
-                    t.cuotas, 
-                    {modalidad_expr},
-                    t.monto,
-                    t.interes,
-                    COALESCE(SUM(a.monto), 0) as abonado
+            cursor.execute(
+                f'''
+                SELECT t.codigo, t.estado, t.monto, t.interes, t.cuotas, {modalidad_expr},
+                       t.fecha_creacion, {expr_total_abonado('t')}, t.empleado_identificacion
                 FROM tarjetas t
                 JOIN empleados e ON t.empleado_identificacion = e.identificacion
-                LEFT JOIN abonos a ON t.codigo = a.tarjeta_codigo
-                WHERE {where_sql}
-                GROUP BY t.codigo, t.fecha_creacion, t.cuotas, t.modalidad_pago, t.monto, t.interes
-            '''
+                WHERE {" AND ".join(condiciones)}
+                ORDER BY t.numero_ruta ASC, t.codigo ASC
+                LIMIT %s
+                ''',
+                params + [LIMITE_RESUMENES + 1],
+            )
+            return [
+                {
+                    'codigo': row[0],
+                    'estado': row[1],
+                    'monto': row[2],
+                    'interes': row[3],
+                    'cuotas': row[4],
+                    'modalidad_pago': row[5],
+                    'fecha_creacion': row[6],
+                    'total_abonado': row[7],
+                    'empleado_identificacion': row[8],
+                }
+                for row in cursor.fetchall()
+            ]
+    except Exception as e:
+        logger.error(f"Error al obtener resúmenes de tarjetas: {e}")
+        return None
+
+# Días desde el vencimiento a partir de los cuales una tarjeta es "clavo"
+# (cuentas_admin.dias_clavo lo cambia por cuenta, migración 019)
+DIAS_CLAVO_DEFECTO = 60
+
+
+def _consulta_clavos(empleado_identificacion: Optional[str], fecha_corte: date, cuenta_id: Optional[int],
+                     detalle: bool, desglose: bool = True) -> Tuple[str, list]:
+    """
+    SQL y parámetros de los clavos a la fecha de corte: tarjetas 'activas' con
+    saldo > 0 y (fecha_corte - vencimiento) >= umbral, donde
+    vencimiento = fecha_creacion + cuotas x factor (diario=1, semanal=7,
+    quincenal=15, mensual=30).
+
+    Una sola consulta con GROUPING SETS: la fila del total, una por empleado
+    (desglose) y, con detalle, una por tarjeta.
+    """
+    modalidad_expr = "COALESCE(t.modalidad_pago, 'diario')" if _modalidad_column_exists() else "'diario'"
+    params: List = [fecha_corte]
+    if cuenta_id is not None and Esquema.tiene_columna('cuentas_admin', 'dias_clavo'):
+        umbral_sql = "COALESCE((SELECT dias_clavo FROM cuentas_admin WHERE id = %s), %s)"
+        params.extend([cuenta_id, DIAS_CLAVO_DEFECTO])
+    else:
+        umbral_sql = "%s"
+        params.append(DIAS_CLAVO_DEFECTO)
+
+    where_clauses = ["t.estado = 'activas'", "t.fecha_creacion IS NOT NULL"]
+    if empleado_identificacion:
+        where_clauses.append("t.empleado_identificacion = %s")
+        params.append(empleado_identificacion)
+    if cuenta_id is not None:
+        where_clauses.append("e.cuenta_id = %s")
+        params.append(cuenta_id)
+
+    # GROUPING() y las columnas de agrupación solo valen si están en algún conjunto
+    if desglose or detalle:
+        conjuntos = ['()', '(empleado_identificacion)']
+        grupo_empleado = "GROUPING(empleado_identificacion) AS sin_empleado, empleado_identificacion"
+        if detalle:
+            conjuntos.append('(empleado_identificacion, codigo)')
+            grupo_codigo = "GROUPING(codigo) AS sin_codigo, codigo"
+        else:
+            grupo_codigo = "1 AS sin_codigo, NULL AS codigo"
+        agrupacion = f"""
+        GROUP BY GROUPING SETS ({", ".join(conjuntos)})
+        ORDER BY sin_empleado DESC, empleado_identificacion, sin_codigo DESC, dias_vencida DESC, codigo"""
+    else:
+        grupo_empleado = "1 AS sin_empleado, NULL AS empleado_identificacion"
+        grupo_codigo = "1 AS sin_codigo, NULL AS codigo"
+        agrupacion = ""
+
+    query = f'''
+        WITH corte AS (
+            SELECT %s::date AS fecha, {umbral_sql}::int AS dias
+        ),
+        vencimientos AS (
+            SELECT
+                t.codigo,
+                t.empleado_identificacion,
+                t.cliente_identificacion,
+                t.fecha_creacion::date + COALESCE(t.cuotas, 0) * (
+                    CASE
+                        WHEN {modalidad_expr} ILIKE '%%semanal%%' THEN 7
+                        WHEN {modalidad_expr} ILIKE '%%quincenal%%' THEN 15
+                        WHEN {modalidad_expr} ILIKE '%%mensual%%' THEN 30
+                        ELSE 1
+                    END
+                ) AS vencimiento,
+                {expr_saldo('t')} AS saldo
+            FROM tarjetas t
+            JOIN empleados e ON t.empleado_identificacion = e.identificacion
+            WHERE {" AND ".join(where_clauses)}
+        ),
+        clavos AS (
+            SELECT v.*, c.fecha - v.vencimiento AS dias_vencida
+            FROM vencimientos v
+            CROSS JOIN corte c
+            WHERE v.saldo > 0
+              AND c.fecha - v.vencimiento >= c.dias
+        )
+        SELECT
+            {grupo_empleado},
+            {grupo_codigo},
+            COALESCE(SUM(saldo), 0) AS saldo,
+            COUNT(*) AS cantidad,
+            MAX(cliente_identificacion) AS cliente_identificacion,
+            MIN(vencimiento) AS vencimiento,
+            MAX(dias_vencida) AS dias_vencida,
+            (SELECT dias FROM corte) AS umbral
+        FROM clavos{agrupacion}
+    '''
+    return query, params
+
+
+def _armar_clavos(filas, fecha_corte: date, detalle: bool) -> Dict:
+    resultado = {
+        'fecha_corte': fecha_corte,
+        'umbral_dias': DIAS_CLAVO_DEFECTO,
+        'total': Decimal(0),
+        'cantidad': 0,
+        'por_empleado': [],
+        'tarjetas': [] if detalle else None,
+    }
+    for sin_empleado, empleado, sin_codigo, codigo, saldo, cantidad, cliente, vencimiento, dias, umbral in filas:
+        if sin_empleado:
+            resultado['total'] = saldo
+            resultado['cantidad'] = cantidad
+            resultado['umbral_dias'] = umbral
+        elif sin_codigo:
+            resultado['por_empleado'].append({
+                'empleado_identificacion': empleado,
+                'total': saldo,
+                'cantidad': cantidad,
+            })
+        else:
+            resultado['tarjetas'].append({
+                'codigo': codigo,
+                'empleado_identificacion': empleado,
+                'cliente_identificacion': cliente,
+                'fecha_vencimiento': vencimiento,
+                'dias_vencida': dias,
+                'saldo': saldo,
+            })
+    return resultado
+
+
+def obtener_clavos(empleado_identificacion: Optional[str], fecha_corte: date, cuenta_id: Optional[int] = None,
+                   detalle: bool = False) -> Optional[Dict]:
+    """
+    Clavos a la fecha de corte: total, desglose por empleado y (con detalle) la
+    lista de tarjetas, en una sola consulta. None si hubo error.
+    """
+    try:
+        query, params = _consulta_clavos(empleado_identificacion, fecha_corte, cuenta_id, detalle)
+        with DatabasePool.get_cursor() as cursor:
             cursor.execute(query, params)
-            rows = cursor.fetchall()
-            
-            total_clavos = Decimal(0)
-            
-            from datetime import timedelta, datetime
-            
-            for row in rows:
-                fecha_creacion = row[1]
-                if not fecha_creacion: continue
+            return _armar_clavos(cursor.fetchall(), fecha_corte, detalle)
+    except Exception as e:
+        logger.error(f"Error calculando clavos: {e}")
+        return None
 
-                # Asegurar que es date
-                if isinstance(fecha_creacion, datetime):
-                    fecha_creacion = fecha_creacion.date()
-                
-                cuotas = int(row[2] or 0)
-                modalidad = str(row[3] or 'diario').lower()
-                monto = Decimal(row[4] or 0)
-                interes = Decimal(row[5] or 0)
-                abonado = Decimal(row[6] or 0)
-                
-                monto_total = monto * (1 + (interes / Decimal(100)))
-                saldo = monto_total - abonado
-                
-                if saldo <= 0: continue # No debe pasar si está activa, pero por seguridad
-                
-                # Factor modalidad
-                if 'semanal' in modalidad: factor = 7
-                elif 'quincenal' in modalidad: factor = 15
-                elif 'mensual' in modalidad: factor = 30
-                else: factor = 1
-                
-                dias_duracion = cuotas * factor
-                fecha_vencimiento = fecha_creacion + timedelta(days=dias_duracion)
-                
-                # Días pasados desde vencimiento hasta corte
-                dias_pasados = (fecha_corte - fecha_vencimiento).days
-                
-                if dias_pasados >= 60:
-                    total_clavos += saldo
-            
-            return total_clavos
 
+def calcular_total_clavos(empleado_identificacion: Optional[str], fecha_corte: date, cuenta_id: Optional[int] = None) -> Decimal:
+    """Saldo total de los clavos a la fecha de corte (aislado por cuenta si se da cuenta_id)."""
+    try:
+        query, params = _consulta_clavos(empleado_identificacion, fecha_corte, cuenta_id, detalle=False, desglose=False)
+        with DatabasePool.get_cursor() as cursor:
+            cursor.execute(query, params)
+            return _armar_clavos(cursor.fetchall(), fecha_corte, False)['total']
     except Exception as e:
         logger.error(f"Error calculando total clavos: {e}")
         return Decimal(0)
+
+
+def actualizar_umbral_clavos(cuenta_id: int, dias: Optional[int]) -> bool:
+    """Fija los días de vencida desde los que una tarjeta es clavo en la cuenta (None = por defecto)."""
+    try:
+        with DatabasePool.get_cursor() as cursor:
+            cursor.execute("UPDATE cuentas_admin SET dias_clavo = %s WHERE id = %s", (dias, cuenta_id))
+            return cursor.rowcount > 0
+    except Exception as e:
+        logger.error(f"Error al actualizar umbral de clavos: {e}")
+        return False
+
+
+async def calcular_total_clavos_async(empleado_identificacion: Optional[str], fecha_corte: date, cuenta_id: Optional[int] = None) -> Decimal:
+    """Versión asíncrona de calcular_total_clavos (misma consulta)."""
+    try:
+        query, params = _consulta_clavos(empleado_identificacion, fecha_corte, cuenta_id, detalle=False, desglose=False)
+        async with AsyncDatabasePool.get_cursor() as cursor:
+            await cursor.execute(query, params)
+            return _armar_clavos(await cursor.fetchall(), fecha_corte, False)['total']
+    except Exception as e:
+        logger.error(f"Error calculando total clavos (async): {e}")
+        return Decimal(0)
@@ -1,5 +1,8 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
+import json
 import os
 from typing import List, Optional
 import logging
@@ -9,17 +12,24 @@ from zoneinfo import ZoneInfo
 from time import perf_counter as _pc
 
 """Importaciones del paquete interno (usar rutas relativas del paquete)."""
-from .database.db_config import DB_CONFIG
-from .database.connection_pool import DatabasePool
+from .database.db_config import DB_CONFIG, DB_REPLICA_CONFIG
+from .database.connection_pool import DatabasePool, lectura_en_replica
+from .database.async_pool import AsyncDatabasePool
+from .database.esquema import Esquema
+from .database.fechas import limites_dia_utc
+from .database.paginacion import CursorInvalido, decodificar_cursor, siguiente_cursor
+from .database.saldos_db import actualizar_estado_por_saldo, verificar_saldos
+from starlette.concurrency import run_in_threadpool
 
 from .database.clientes_db import crear_cliente, obtener_cliente_por_identificacion, actualizar_cliente, eliminar_cliente, listar_clientes_por_empleado, buscar_datos_clavo
 from .database.empleados_db import insertar_empleado, buscar_empleado_por_identificacion, actualizar_empleado, eliminar_empleado, obtener_empleados, verificar_empleado_tiene_tarjetas, obtener_tarjetas_empleado
-from .database.tarjetas_db import crear_tarjeta, obtener_tarjeta_por_codigo, actualizar_tarjeta, actualizar_estado_tarjeta, mover_tarjeta, eliminar_tarjeta, obtener_todas_las_tarjetas, actualizar_rutas_masivo, buscar_tarjetas, verificar_reactivacion_tarjeta, listar_tarjetas_sin_abono_dia
-from .database.abonos_db import registrar_abono, obtener_abono_por_id, actualizar_abono, eliminar_abono_por_id, eliminar_ultimo_abono
-from .database.bases_db import insertar_base, obtener_base, actualizar_base, eliminar_base
+from .database.tarjetas_db import crear_tarjeta, obtener_tarjeta_por_codigo, actualizar_tarjeta, actualizar_estado_tarjeta, mover_tarjeta, eliminar_tarjeta, obtener_todas_las_tarjetas, actualizar_rutas_masivo, buscar_tarjetas, verificar_reactivacion_tarjeta, listar_tarjetas_sin_abono_dia, contar_tarjetas_sin_abono_dia, invalidar_cache_tarjetas, obtener_clavos, actualizar_umbral_clavos, obtener_resumenes_tarjetas, LIMITE_RESUMENES
+from .database.abonos_db import registrar_abono, registrar_abono_con_caja_async, obtener_abono_por_id, actualizar_abono, eliminar_abono_por_id, eliminar_ultimo_abono
+from .database.bases_db import insertar_base, obtener_base, eliminar_base
 # CORRECCIÓN: Se importa la función correcta 'obtener_tipos_gastos' (plural)
 from .database.gastos_db import agregar_gasto, obtener_gasto_por_id, actualizar_gasto, eliminar_gasto, obtener_resumen_gastos_por_tipo, obtener_tipos_gastos, obtener_todos_los_gastos
-from .database.liquidacion_db import obtener_datos_liquidacion, obtener_resumen_financiero_fecha, mover_liquidacion
+from .database.liquidacion_db import obtener_datos_liquidacion, obtener_datos_liquidacion_async, obtener_resumen_financiero_fecha, mover_liquidacion
+from .database.sync_db import upsert_clientes_lote, crear_tarjetas_lote, insertar_abonos_lote, insertar_gastos_lote, upsert_bases_lote
 from .database.caja_db import (
     verificar_esquema_caja,
     upsert_caja,
@@ -28,7 +38,9 @@ from .database.caja_db import (
     registrar_entrada,
     obtener_salidas,
     obtener_metricas_contabilidad,
+    obtener_metricas_contabilidad_async,
     recalcular_caja_dia,
+    guardar_caja_dia,
 )
 
 from .schemas import (
@@ -37,7 +49,7 @@ from .schemas import (
     BaseCreate, BaseUpdate, TipoGasto, Gasto, GastoCreate, GastoUpdate,
     ResumenGasto, LiquidacionDiaria, ResumenFinanciero,
     SyncRequest, SyncResponse,
-    ContabilidadQuery, ContabilidadMetricas, CajaValor, CajaSalida, CajaSalidaCreate, CajaEntrada, CajaEntradaCreate, VerificacionEsquemaCaja,
+    ContabilidadQuery, ContabilidadMetricas, CajaValor, CajaSalida, CajaSalidaCreate, CajaEntrada, CajaEntradaCreate, VerificacionEsquemaCaja, EstadoIndice, VerificacionSaldos, ReporteClavos, UmbralClavos,
     RutaUpdateItem, ClienteClavo
 )
 
@@ -90,7 +102,14 @@ app.add_middleware(
     allow_credentials=True, 
     allow_methods=["*"],
     allow_headers=["*"],
+    # Cursor de la página siguiente en los listados paginados
+    expose_headers=["X-Next-Cursor"],
 )
+# Compresión gzip para respuestas grandes (descargas de ruta, listados)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+# Métricas por ruta (latencia, consultas y tiempo en BD); se exponen en GET /metrics
+from .services.metrics_service import MetricasMiddleware, exponer_metricas
+app.add_middleware(MetricasMiddleware)
 
 # Routers: auth y billing
 from .routers import auth as auth_router
@@ -116,25 +135,43 @@ def _enforce_empleado_scope(principal: dict, empleado_id: str):
         return
     raise HTTPException(status_code=403, detail="Acceso denegado para este empleado")
 
+async def unidad_de_trabajo():
+    """
+    Dependencia: una conexión del pool y UNA transacción por request.
+    Los helpers de database/*_db.py llamados desde el endpoint reutilizan esa
+    conexión (cada bloque get_cursor() es un SAVEPOINT). Commit al terminar sin
+    errores; rollback si el endpoint lanza cualquier excepción.
+    """
+    unidad = await run_in_threadpool(DatabasePool.abrir_unidad)
+    token = DatabasePool.activar_unidad(unidad)
+    try:
+        yield unidad
+    except BaseException:
+        DatabasePool.desactivar_unidad(token)
+        await run_in_threadpool(DatabasePool.cerrar_unidad, unidad, False)
+        raise
+    DatabasePool.desactivar_unidad(token)
+    await run_in_threadpool(DatabasePool.cerrar_unidad, unidad, True)
+
 def _day_bounds_utc_str(fecha_str: str, tz_name: str):
-    """Devuelve (inicio_utc, fin_utc) como strings ISO para filtrar un día local en UTC."""
-    try:
-        from datetime import datetime as _dt, timezone as _tz
-        tz = ZoneInfo(tz_name or 'UTC')
-        d = _dt.strptime(fecha_str, '%Y-%m-%d').date()
-        start_local = _dt(d.year, d.month, d.day, 0, 0, 0, tzinfo=tz)
-        end_local = _dt(d.year, d.month, d.day, 23, 59, 59, 999000, tzinfo=tz)
-        start_utc = start_local.astimezone(_tz.utc)
-        end_utc = end_local.astimezone(_tz.utc)
-        # debug removido
-        return (start_utc, end_utc)
-    except Exception:
-        # Fallback seguro a día UTC si falla el parseo
-        from datetime import datetime as _dt, timezone as _tz
-        d = _dt.strptime(fecha_str, '%Y-%m-%d').date()
-        start_utc = _dt(d.year, d.month, d.day, 0, 0, 0, tzinfo=_tz.utc)
-        end_utc = _dt(d.year, d.month, d.day, 23, 59, 59, 999000, tzinfo=_tz.utc)
-        return (start_utc, end_utc)
+    """Devuelve (inicio, fin) UTC sin zona del día local fecha_str: filtrar con >= inicio AND < fin."""
+    from datetime import datetime as _dt
+    d = _dt.strptime(fecha_str, '%Y-%m-%d').date()
+    return limites_dia_utc(d, tz_name)
+
+def _decodificar_cursor_http(listado: str, cursor: Optional[str], largo: int):
+    """Clave de orden del cursor recibido (None si no vino); 400 si es inválido."""
+    if cursor is None:
+        return None
+    try:
+        return decodificar_cursor(listado, cursor, largo)
+    except CursorInvalido as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _publicar_cursor(response: Response, cursor: Optional[str]):
+    """Expone el cursor de la página siguiente en X-Next-Cursor (ausente en la última)."""
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
 
 # --- Evento de Arranque (Startup) ---
 @app.on_event("startup")
@@ -144,23 +181,47 @@ def startup_event():
         # Permitir configurar tamaño del pool por entorno
         _minconn = int(os.getenv("POOL_MINCONN", "1"))
         _maxconn = int(os.getenv("POOL_MAXCONN", "50"))
-        DatabasePool.initialize(minconn=_minconn, maxconn=_maxconn, **DB_CONFIG)
-        # Asegurar columna modalidad_pago para soportar modalidades (diario/semanal/quincenal/mensual)
+        DatabasePool.initialize(minconn=_minconn, maxconn=_maxconn, replica_config=DB_REPLICA_CONFIG, **DB_CONFIG)
+        # Migraciones: normalmente las aplica el deploy (scripts/migrate.py). Con
+        # DB_MIGRATE_ON_STARTUP=1 se intentan al arrancar, pero una migración en
+        # curso en otra instancia o fallida no impide que esta arranque.
+        if os.getenv("DB_MIGRATE_ON_STARTUP", "0").lower() in ("1", "true", "yes"):
+            from .database.migraciones import MigracionEnCurso, MigracionError, aplicar_migraciones
+            try:
+                aplicar_migraciones(DB_CONFIG)
+            except MigracionEnCurso as e:
+                logger.warning(f"Migraciones omitidas al arrancar: {e}")
+            except MigracionError as e:
+                logger.error(f"Error al aplicar migraciones al arrancar: {e}")
+        # Registro de tablas/columnas: los helpers lo consultan en vez de sondear el catálogo
+        Esquema.refrescar()
+        # Escucha de invalidaciones de caché (LISTEN/NOTIFY) entre instancias
         try:
-            from .database.tarjetas_db import ensure_modalidad_pago_column
-            ensure_modalidad_pago_column()
-        except Exception:
-            pass
+            from .database.cache_bus import iniciar_escucha
+            iniciar_escucha(DB_CONFIG)
+        except Exception as e:
+            logger.warning(f"No se pudo iniciar la escucha de invalidaciones de caché: {e}")
 
         logger.info("Pool de conexiones a la base de datos inicializado con éxito.")
     except Exception as e:
         logger.critical(f"Error crítico al inicializar el pool de conexiones: {e}", exc_info=True)
         raise RuntimeError(f"No se pudo conectar a la base de datos: {e}")
 
+@app.on_event("startup")
+async def startup_async_pool():
+    # Pool asíncrono (psycopg 3) para los endpoints calientes; si no está
+    # disponible, esos endpoints usan los helpers síncronos en el threadpool
+    _minconn = int(os.getenv("ASYNC_POOL_MINCONN", os.getenv("POOL_MINCONN", "1")))
+    _maxconn = int(os.getenv("ASYNC_POOL_MAXCONN", "20"))
+    await AsyncDatabasePool.initialize(minconn=_minconn, maxconn=_maxconn, **DB_CONFIG)
+
 # --- Evento de Cierre (Shutdown) ---
 @app.on_event("shutdown")
-def shutdown_event():
+async def shutdown_event():
     logger.info("Cerrando el pool de conexiones de la base de datos...")
+    from .database.cache_bus import detener_escucha
+    detener_escucha()
+    await AsyncDatabasePool.close_all()
     DatabasePool.close_all()
     logger.info("Pool de conexiones cerrado.")
 
@@ -184,11 +245,66 @@ def get_app_version():
     """Devuelve la versión actual de la app de escritorio y el link de descarga (público, sin auth)."""
     return DESKTOP_APP_VERSION
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint(principal: dict = Depends(require_admin)):
+    """Métricas de la API y del pool de conexiones en formato Prometheus (solo admin)."""
+    return PlainTextResponse(exponer_metricas(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/admin/indices", response_model=List[EstadoIndice])
+def admin_indices_endpoint(principal: dict = Depends(require_admin)):
+    """Índices esperados por las consultas calientes: existencia, validez y uso (pg_stat_user_indexes)."""
+    try:
+        from .database.indices_db import reporte_indices
+        return reporte_indices()
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error al generar reporte de índices: {e}")
+        raise HTTPException(status_code=500, detail="Error interno al generar reporte de índices")
+
+
+@app.get("/admin/saldos", response_model=VerificacionSaldos)
+def admin_saldos_endpoint(muestra: int = 50, principal: dict = Depends(require_admin)):
+    """Compara tarjetas.total_abonado/abonos_count/ultimo_abono_fecha con la suma real de abonos de la cuenta."""
+    try:
+        resultado = verificar_saldos(principal.get("cuenta_id"), reparar=False, muestra=muestra)
+        if resultado is None:
+            raise HTTPException(status_code=503, detail="Saldos denormalizados no disponibles (migración 018 pendiente)")
+        return resultado
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error al verificar saldos de tarjetas: {e}")
+        raise HTTPException(status_code=500, detail="Error interno al verificar saldos de tarjetas")
+
+
+@app.post("/admin/saldos/reparar", response_model=VerificacionSaldos)
+def admin_saldos_reparar_endpoint(muestra: int = 50, principal: dict = Depends(require_admin)):
+    """Reconstruye desde abonos los saldos denormalizados que no coinciden."""
+    try:
+        cuenta_id = principal.get("cuenta_id")
+        resultado = verificar_saldos(cuenta_id, reparar=True, muestra=muestra)
+        if resultado is None:
+            raise HTTPException(status_code=503, detail="Saldos denormalizados no disponibles (migración 018 pendiente)")
+        if resultado['reparadas']:
+            invalidar_cache_tarjetas()
+        return resultado
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error al reparar saldos de tarjetas: {e}")
+        raise HTTPException(status_code=500, detail="Error interno al reparar saldos de tarjetas")
+
 # --- Endpoints de Contabilidad / Caja ---
 
 @app.get("/contabilidad/esquema", response_model=VerificacionEsquemaCaja)
-def contabilidad_verificar_esquema_endpoint(principal: dict = Depends(require_admin)):
+def contabilidad_verificar_esquema_endpoint(
+    refrescar: bool = False,
+    principal: dict = Depends(require_admin),
+):
     try:
+        if refrescar:
+            Esquema.refrescar()
         info = verificar_esquema_caja()
         return info
     except Exception as e:
@@ -197,16 +313,22 @@ def contabilidad_verificar_esquema_endpoint(principal: dict = Depends(require_ad
 
 
 @app.post("/contabilidad/metricas", response_model=ContabilidadMetricas)
-def contabilidad_metricas_endpoint(query: ContabilidadQuery, principal: dict = Depends(get_current_principal)):
+async def contabilidad_metricas_endpoint(query: ContabilidadQuery, principal: dict = Depends(get_current_principal), _ro=Depends(lectura_en_replica)):
     try:
         tz_name = principal.get("timezone")
-        datos = obtener_metricas_contabilidad(
+        args = dict(
             desde=query.desde,
             hasta=query.hasta,
             empleado_id=query.empleado_id,
             timezone_name=tz_name,
             cuenta_id=principal.get("cuenta_id")
         )
+        # Con réplica configurada el reporte va por el pool síncrono (que la usa);
+        # sin réplica, por el pool asíncrono del primario
+        if AsyncDatabasePool.disponible() and not DatabasePool.tiene_replica():
+            datos = await obtener_metricas_contabilidad_async(**args)
+        else:
+            datos = await run_in_threadpool(obtener_metricas_contabilidad, **args)
         # días en rango
         try:
             dias = (query.hasta - query.desde).days + 1
@@ -240,6 +362,52 @@ def contabilidad_metricas_endpoint(query: ContabilidadQuery, principal: dict = D
         raise HTTPException(status_code=500, detail="Error interno al calcular métricas")
 
 
+@app.get("/contabilidad/clavos", response_model=ReporteClavos)
+def contabilidad_clavos_endpoint(
+    fecha_corte: Optional[date] = None,
+    empleado_id: Optional[str] = None,
+    detalle: bool = False,
+    principal: dict = Depends(get_current_principal),
+    _ro=Depends(lectura_en_replica),
+):
+    """
+    Clavos a la fecha de corte (hoy si no viene): total, desglose por empleado y,
+    con detalle, las tarjetas. Un cobrador solo ve los de su propia ruta.
+    """
+    try:
+        if principal.get("role") != "admin":
+            empleado_id = empleado_id or principal.get("empleado_identificacion")
+            _enforce_empleado_scope(principal, empleado_id)
+        if fecha_corte is None:
+            from datetime import datetime as _dt
+            fecha_corte = _dt.now(ZoneInfo(principal.get("timezone") or "UTC")).date()
+        reporte = obtener_clavos(empleado_id, fecha_corte, principal.get("cuenta_id"), detalle=detalle)
+        if reporte is None:
+            raise HTTPException(status_code=500, detail="Error interno al calcular clavos")
+        return reporte
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error al calcular clavos: {e}")
+        raise HTTPException(status_code=500, detail="Error interno al calcular clavos")
+
+
+@app.put("/contabilidad/clavos/umbral", response_model=UmbralClavos)
+def contabilidad_umbral_clavos_endpoint(body: UmbralClavos, principal: dict = Depends(require_admin)):
+    """Días de vencida desde los que una tarjeta cuenta como clavo en la cuenta (null = 60)."""
+    try:
+        if not Esquema.tiene_columna('cuentas_admin', 'dias_clavo'):
+            raise HTTPException(status_code=503, detail="Umbral de clavos no disponible (migración 019 pendiente)")
+        if not actualizar_umbral_clavos(principal.get("cuenta_id"), body.dias):
+            raise HTTPException(status_code=404, detail="Cuenta no encontrada")
+        return body
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error al actualizar umbral de clavos: {e}")
+        raise HTTPException(status_code=500, detail="Error interno al actualizar umbral de clavos")
+
+
 @app.get("/caja/{empleado_id}/{fecha}", response_model=CajaValor)
 def caja_valor_endpoint(empleado_id: str, fecha: str, principal: dict = Depends(get_current_principal)):
     try:
@@ -715,6 +883,8 @@ def transferir_tarjetas_empleado_endpoint(identificacion: str, request: Transfer
             
             tarjetas_actualizadas = cursor.fetchall()
             tarjetas_transferidas = len(tarjetas_actualizadas)
+            invalidar_cache_tarjetas(identificacion)
+            invalidar_cache_tarjetas(request.empleado_destino)
         
         return {
             "ok": True,
@@ -811,6 +981,7 @@ def eliminar_empleado_con_tarjetas_endpoint(identificacion: str, request: Elimin
                     RETURNING codigo
                 ''', (identificacion,))
                 tarjetas_eliminadas = len(cursor.fetchall())
+                invalidar_cache_tarjetas(identificacion)
 
             # 2) Eliminar gastos asociados al empleado
             cursor.execute("""
@@ -902,17 +1073,6 @@ def read_base_by_empleado_fecha_endpoint(empleado_id: str, fecha: str, principal
     Obtiene la base de un empleado en una fecha específica.
     """
     try:
-        tz_name = principal.get('timezone') or 'UTC'
-        start_utc, end_utc = _day_bounds_utc_str(fecha, tz_name)
-        start_naive = start_utc.replace(tzinfo=None)
-        end_naive = end_utc.replace(tzinfo=None)
-        start_naive = start_utc.replace(tzinfo=None)
-        end_naive = end_utc.replace(tzinfo=None)
-        start_naive = start_utc.replace(tzinfo=None)
-        end_naive = end_utc.replace(tzinfo=None)
-        # Usar límites UTC sin tz (naive) para columnas timestamp sin zona
-        start_naive = start_utc.replace(tzinfo=None)
-        end_naive = end_utc.replace(tzinfo=None)
         # La tabla bases guarda fecha (date) y/o fecha_creacion (timestamp). Usar la función actual por date exacta.
         from datetime import datetime as _dt
         fecha_obj = _dt.strptime(fecha, '%Y-%m-%d').date()
@@ -1009,12 +1169,22 @@ def read_bases_by_empleado_endpoint(empleado_id: str, skip: int = 0, limit: int
 # --- Endpoints para Gastos ---
 
 @app.get("/gastos/", response_model=List[Gasto])
-def read_gastos_endpoint(skip: int = 0, limit: int = 100, principal: dict = Depends(get_current_principal)):
+def read_gastos_endpoint(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    principal: dict = Depends(get_current_principal),
+):
     """
-    Obtiene una lista de todos los gastos.
+    Obtiene una lista de todos los gastos, del más reciente al más antiguo.
+    Paginación por cursor: pasar en `cursor` el valor del header X-Next-Cursor
+    de la respuesta anterior (skip queda por compatibilidad).
     """
+    despues = _decodificar_cursor_http('gastos', cursor, 2)
     try:
-        gastos = obtener_todos_los_gastos(skip=skip, limit=limit)
+        gastos = obtener_todos_los_gastos(skip=skip, limit=limit, despues=despues)
+        _publicar_cursor(response, siguiente_cursor('gastos', gastos, limit, 'fecha_creacion', 'id'))
         return gastos
     except Exception as e:
         logger.error(f"Error al obtener la lista de gastos: {e}")
@@ -1172,9 +1342,7 @@ def read_gastos_by_empleado_fecha_endpoint(empleado_id: str, fecha: str, princip
     """
     try:
         tz_name = principal.get('timezone') or 'UTC'
-        start_utc, end_utc = _day_bounds_utc_str(fecha, tz_name)
-        start_naive = start_utc.replace(tzinfo=None)
-        end_naive = end_utc.replace(tzinfo=None)
+        start_naive, end_naive = _day_bounds_utc_str(fecha, tz_name)
         from .database.connection_pool import DatabasePool as _DB
         gastos_tuplas = []
         with _DB.get_cursor() as cur:
@@ -1183,7 +1351,7 @@ def read_gastos_by_empleado_fecha_endpoint(empleado_id: str, fecha: str, princip
                 SELECT id, tipo, valor, observacion, fecha_creacion
                 FROM gastos
                 WHERE empleado_identificacion = %s
-                  AND fecha_creacion >= %s AND fecha_creacion <= %s
+                  AND fecha_creacion >= %s AND fecha_creacion < %s
                 ORDER BY fecha_creacion DESC
                 ''', (empleado_id, start_naive, end_naive)
             )
@@ -1288,9 +1456,7 @@ def read_tarjetas_nuevas_del_dia_endpoint(empleado_id: str, fecha: str, principa
     try:
         tz_name = principal.get('timezone') or 'UTC'
         # Para tarjetas nuevas usamos fecha_creacion (timestamp) → BETWEEN por día local convertido a UTC
-        start_utc, end_utc = _day_bounds_utc_str(fecha, tz_name)
-        start_naive = start_utc.replace(tzinfo=None)
-        end_naive = end_utc.replace(tzinfo=None)
+        start_naive, end_naive = _day_bounds_utc_str(fecha, tz_name)
         tarjetas: List[dict] = []
         with DatabasePool.get_cursor() as cursor:
             # Con la migración, fecha_creacion es TIMESTAMP (UTC) → usar siempre límites UTC naive
@@ -1315,7 +1481,7 @@ def read_tarjetas_nuevas_del_dia_endpoint(empleado_id: str, fecha: str, principa
                 FROM tarjetas t
                 JOIN clientes c ON c.identificacion = t.cliente_identificacion
                 WHERE t.empleado_identificacion = %s
-                  AND t.fecha_creacion >= %s AND t.fecha_creacion <= %s
+                  AND t.fecha_creacion >= %s AND t.fecha_creacion < %s
                 ORDER BY t.numero_ruta
                 ''', (empleado_id, start_naive, end_naive)
             )
@@ -1370,9 +1536,7 @@ def read_abonos_del_dia_endpoint(empleado_id: str, fecha: str, principal: dict =
     """
     try:
         tz_name = principal.get('timezone') or 'UTC'
-        start_utc, end_utc = _day_bounds_utc_str(fecha, tz_name)
-        start_naive = start_utc.replace(tzinfo=None)
-        end_naive = end_utc.replace(tzinfo=None)
+        start_naive, end_naive = _day_bounds_utc_str(fecha, tz_name)
         abonos: List[dict] = []
         with DatabasePool.get_cursor() as cursor:
             cursor.execute(
@@ -1384,7 +1548,7 @@ def read_abonos_del_dia_endpoint(empleado_id: str, fecha: str, principal: dict =
                 JOIN tarjetas t ON a.tarjeta_codigo = t.codigo
                 JOIN clientes c ON t.cliente_identificacion = c.identificacion
                 WHERE t.empleado_identificacion = %s
-                  AND a.fecha >= %s AND a.fecha <= %s
+                  AND a.fecha >= %s AND a.fecha < %s
                 ORDER BY a.fecha, a.id
                 ''', (empleado_id, start_naive, end_naive)
             )
@@ -1415,18 +1579,16 @@ def read_resumen_gastos_by_empleado_fecha_endpoint(empleado_id: str, fecha: str,
     """
     try:
         tz_name = principal.get('timezone') or 'UTC'
-        start_utc, end_utc = _day_bounds_utc_str(fecha, tz_name)
-        start_naive = start_utc.replace(tzinfo=None)
-        end_naive = end_utc.replace(tzinfo=None)
+        start_naive, end_naive = _day_bounds_utc_str(fecha, tz_name)
         from .database.connection_pool import DatabasePool as _DB
         with _DB.get_cursor() as cur:
             cur.execute(
-                '''SELECT COALESCE(SUM(valor),0) FROM gastos WHERE empleado_identificacion=%s AND fecha_creacion >= %s AND fecha_creacion <= %s''',
+                '''SELECT COALESCE(SUM(valor),0) FROM gastos WHERE empleado_identificacion=%s AND fecha_creacion >= %s AND fecha_creacion < %s''',
                 (empleado_id, start_naive, end_naive)
             )
             total = cur.fetchone()[0] or 0
             cur.execute(
-                '''SELECT COUNT(*) FROM gastos WHERE empleado_identificacion=%s AND fecha_creacion >= %s AND fecha_creacion <= %s''',
+                '''SELECT COUNT(*) FROM gastos WHERE empleado_identificacion=%s AND fecha_creacion >= %s AND fecha_creacion < %s''',
                 (empleado_id, start_naive, end_naive)
             )
             conteo = cur.fetchone()[0] or 0
@@ -1480,14 +1642,25 @@ def read_gastos_by_fecha_endpoint(fecha: str, tipo: Optional[str] = None):
 # --- Endpoints para Tarjetas ---
 
 @app.get("/tarjetas/", response_model=List[Tarjeta])
-def read_tarjetas_endpoint(estado: str = 'activas', skip: int = 0, limit: int = 100, principal: dict = Depends(get_current_principal)):
+def read_tarjetas_endpoint(
+    response: Response,
+    estado: str = 'activas',
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    principal: dict = Depends(get_current_principal),
+):
     """
-    Obtiene una lista de todas las tarjetas filtradas por estado.
+    Obtiene una lista de todas las tarjetas filtradas por estado, en orden de ruta.
+    Paginación por cursor: pasar en `cursor` el valor del header X-Next-Cursor
+    de la respuesta anterior (skip queda por compatibilidad).
     """
+    despues = _decodificar_cursor_http('tarjetas', cursor, 2)
     try:
         # Usar la función original que acepta filtros
         from .database.tarjetas_db import obtener_tarjetas
-        tarjetas_tuplas = obtener_tarjetas(empleado_identificacion=None, estado=estado, offset=skip, limit=limit)
+        tarjetas_tuplas = obtener_tarjetas(empleado_identificacion=None, estado=estado, offset=skip, limit=limit, despues=despues)
+        _publicar_cursor(response, siguiente_cursor('tarjetas', tarjetas_tuplas, limit, 6, 0))
         
         # Convertir tuplas a diccionarios para FastAPI con estructura anidada
         tarjetas = []
@@ -1537,45 +1710,21 @@ def buscar_tarjetas_endpoint(
     termino: str, 
     empleado_id: Optional[str] = None, 
     estado: str = 'activas',
+    limite: int = 50,
     principal: dict = Depends(get_current_principal)
 ):
     """
-    Busca tarjetas por nombre o apellido del cliente.
+    Busca tarjetas por nombre, apellido, identificación o teléfono del cliente
+    (sin distinguir tildes ni mayúsculas), de la más parecida a la menos.
     """
     if empleado_id:
         _enforce_empleado_scope(principal, empleado_id)
         
     try:
-        hits = buscar_tarjetas(termino, empleado_id, estado)
-        resultados = []
-        for hit in hits:
-            # hit[0] es codigo
-            t_full = obtener_tarjeta_por_codigo(hit[0])
-            if t_full:
-                 # Convert dict to Tarjeta schema structure
-                 # La estructura de t_full (dict) coincide con el esquema Pydantic Tarjeta
-                 # excepto que 'cliente' debe ser un objeto/dict
-                 
-                 tarjeta = {
-                    'codigo': t_full['codigo'],
-                    'monto': float(t_full['monto']),
-                    'interes': t_full['interes'],
-                    'cliente': {
-                        'identificacion': t_full['cliente_identificacion'],
-                        'nombre': t_full['cliente_nombre'],
-                        'apellido': t_full['cliente_apellido']
-                    },
-                    'cuotas': t_full['cuotas'],
-                    'numero_ruta': float(t_full['numero_ruta']) if t_full['numero_ruta'] else 0.0,
-                    'estado': t_full['estado'],
-                    'fecha_creacion': t_full['fecha_creacion'],
-                    'cliente_identificacion': t_full['cliente_identificacion'],
-                    'empleado_identificacion': t_full['empleado_identificacion'],
-                    'observaciones': t_full['observaciones'],
-                    'fecha_cancelacion': t_full['fecha_cancelacion'],
-                    'modalidad_pago': t_full.get('modalidad_pago', 'diario')
-                }
-                 resultados.append(tarjeta)
+        resultados = buscar_tarjetas(termino, empleado_id, estado, limite=limite)
+        for tarjeta in resultados:
+            tarjeta['monto'] = float(tarjeta['monto']) if tarjeta['monto'] is not None else 0.0
+            tarjeta['numero_ruta'] = float(tarjeta['numero_ruta']) if tarjeta['numero_ruta'] else 0.0
         return resultados
 
     except Exception as e:
@@ -1618,33 +1767,53 @@ def update_rutas_masivo_endpoint(items: List[RutaUpdateItem], principal: dict =
         raise HTTPException(status_code=500, detail="Error al actualizar rutas")
 
 @app.get("/empleados/{empleado_id}/tarjetas/", response_model=List[Tarjeta])
-def read_tarjetas_by_empleado_endpoint(
+async def read_tarjetas_by_empleado_endpoint(
     empleado_id: str,
+    response: Response,
     estado: str = 'activas',
     skip: int = 0,
     limit: int = 100,
     desde: Optional[date] = None,
+    cursor: Optional[str] = None,
     principal: dict = Depends(get_current_principal),
 ):
     _enforce_empleado_scope(principal, empleado_id)
     """
     Obtiene una lista de tarjetas de un empleado específico filtradas por estado.
+    Paginación por cursor: pasar en `cursor` el valor del header X-Next-Cursor
+    de la respuesta anterior (skip queda por compatibilidad).
     """
+    despues = _decodificar_cursor_http('tarjetas', cursor, 2)
     try:
         tz_name = principal.get('timezone') or 'UTC'
-        # Usar la función existente obtener_tarjetas con empleado_identificacion y estado
-        # use_cache=False: En producción (AWS App Runner) hay múltiples instancias,
-        # cada una con su propio caché en memoria. El _cache.clear() de una instancia
-        # no afecta a las otras, causando datos obsoletos.
-        from .database.tarjetas_db import obtener_tarjetas
-        tarjetas_tuplas = obtener_tarjetas(
-            empleado_identificacion=empleado_id,
-            estado=estado,
-            offset=skip,
-            limit=limit,
-            use_cache=False,
-            fecha_cancelacion_desde=desde,
-        )
+        # Usar la función existente obtener_tarjetas con empleado_identificacion y estado.
+        # El caché se usa mientras la escucha de invalidaciones está conectada: en
+        # producción (AWS App Runner) hay múltiples instancias y las escrituras de
+        # cualquiera llegan a las demás por LISTEN/NOTIFY.
+        from .database.tarjetas_db import obtener_tarjetas, obtener_tarjetas_async, cache_tarjetas_en_endpoints
+        usar_cache = cache_tarjetas_en_endpoints()
+        if AsyncDatabasePool.disponible():
+            tarjetas_tuplas = await obtener_tarjetas_async(
+                empleado_identificacion=empleado_id,
+                estado=estado,
+                offset=skip,
+                limit=limit,
+                use_cache=usar_cache,
+                fecha_cancelacion_desde=desde,
+                despues=despues,
+            )
+        else:
+            tarjetas_tuplas = await run_in_threadpool(
+                obtener_tarjetas,
+                empleado_identificacion=empleado_id,
+                estado=estado,
+                offset=skip,
+                limit=limit,
+                use_cache=usar_cache,
+                fecha_cancelacion_desde=desde,
+                despues=despues,
+            )
+        _publicar_cursor(response, siguiente_cursor('tarjetas', tarjetas_tuplas, limit, 6, 0))
         
         # Convertir tuplas a diccionarios para FastAPI con estructura anidada
         tarjetas = []
@@ -1705,6 +1874,139 @@ def read_tarjetas_by_empleado_endpoint(
         logger.error(f"Error al obtener las tarjetas del empleado: {e}")
         raise HTTPException(status_code=500, detail="Error interno al consultar las tarjetas del empleado.")
 
+def _json_default(v):
+    if isinstance(v, Decimal):
+        return float(v)
+    if hasattr(v, 'isoformat'):
+        return v.isoformat()
+    return str(v)
+
+def _ruta_tarjeta_item(t: dict, clientes: dict, abonos: dict, tz) -> dict:
+    """Arma una tarjeta de ruta (misma forma que /empleados/{id}/tarjetas/) con su cliente y abonos."""
+    from datetime import timezone as _tz
+    cedula = t['cliente_identificacion']
+    fc = t['fecha_creacion']
+    fecha_local = None
+    if fc is not None:
+        try:
+            fecha_local = fc.replace(tzinfo=_tz.utc).astimezone(tz).date().isoformat()
+        except Exception:
+            fecha_local = None
+    return {
+        'codigo': t['codigo'],
+        'monto': float(t['monto']) if t['monto'] is not None else 0.0,
+        'interes': t['interes'],
+        'cliente': clientes.get(cedula) or {'identificacion': cedula},
+        'cuotas': t['cuotas'],
+        'numero_ruta': t['numero_ruta'],
+        'estado': t['estado'],
+        'fecha_creacion': fc,
+        'fecha': fecha_local,
+        'cliente_identificacion': cedula,
+        'empleado_identificacion': t['empleado_identificacion'],
+        'observaciones': t['observaciones'],
+        'fecha_cancelacion': t['fecha_cancelacion'],
+        'modalidad_pago': t['modalidad_pago'] or 'diario',
+        'abonos': [_ruta_abono_item(a) for a in abonos.get(t['codigo'], [])],
+    }
+
+def _ruta_abono_item(a: dict) -> dict:
+    return {
+        'id': a['id'],
+        'fecha': a['fecha'],
+        'monto': a['monto'],
+        'indice_orden': int(a['indice_orden']) if a['indice_orden'] is not None else 0,
+        'metodo_pago': a['metodo_pago'] or 'efectivo',
+        'tarjeta_codigo': a['tarjeta_codigo'],
+    }
+
+def _tz_principal(principal: dict):
+    try:
+        return ZoneInfo(principal.get('timezone') or 'UTC')
+    except Exception:
+        return ZoneInfo('UTC')
+
+@app.get("/empleados/{empleado_id}/snapshot")
+def read_snapshot_empleado_endpoint(empleado_id: str, principal: dict = Depends(get_current_principal)):
+    """
+    Descarga de ruta en una sola petición para la PWA: todas las tarjetas ACTIVAS
+    del empleado con su cliente completo y sus abonos.
+    - Se lee por bloques de tarjetas en orden de ruta (3 consultas por bloque) y
+      cada bloque se emite apenas se lee: ni la API ni la BD arman la ruta
+      completa en memoria. Sale comprimida con gzip por el GZipMiddleware
+      cuando el cliente lo acepta.
+    - sync_token permite pedir luego solo los cambios (/empleados/{id}/changes).
+    """
+    _enforce_empleado_scope(principal, empleado_id)
+    from .database.tarjetas_db import iniciar_snapshot_empleado, iterar_snapshot_empleado
+    inicio = iniciar_snapshot_empleado(empleado_id)
+    if inicio is None:
+        raise HTTPException(status_code=500, detail="Error interno al generar la descarga de la ruta.")
+
+    from datetime import datetime as _dt, timezone as _tz
+    tz = _tz_principal(principal)
+
+    def _generar():
+        cabecera = {
+            'empleado_identificacion': empleado_id,
+            'generado_en': _dt.now(_tz.utc).isoformat(),
+            'sync_token': inicio['sync_token'],
+            'total_tarjetas': inicio['total_tarjetas'],
+        }
+        yield json.dumps(cabecera, ensure_ascii=False)[:-1] + ', "tarjetas": ['
+        primera = True
+        for tarjetas, clientes, abonos in iterar_snapshot_empleado(empleado_id):
+            partes = [json.dumps(_ruta_tarjeta_item(t, clientes, abonos, tz), default=_json_default, ensure_ascii=False)
+                      for t in tarjetas]
+            yield ('' if primera else ',') + ','.join(partes)
+            primera = False
+        yield ']}'
+
+    return StreamingResponse(_generar(), media_type="application/json")
+
+@app.get("/empleados/{empleado_id}/changes")
+def read_cambios_empleado_endpoint(empleado_id: str, since: Optional[str] = None, principal: dict = Depends(get_current_principal)):
+    """
+    Descarga incremental de la ruta: solo lo que cambió desde 'since'
+    (sync_token devuelto por /snapshot o por una llamada previa a /changes).
+    Si el token falta, no es válido o es anterior a la retención de lápidas
+    (SYNC_RETENCION_DIAS) responde full_resync=true y la PWA debe usar /snapshot.
+    """
+    _enforce_empleado_scope(principal, empleado_id)
+    try:
+        desde = int(since) if since is not None else None
+    except (TypeError, ValueError):
+        desde = None
+    if desde is None or desde < 0:
+        return {"full_resync": True, "sync_token": None}
+
+    from .database.tarjetas_db import obtener_cambios_empleado
+    cambios = obtener_cambios_empleado(empleado_id, desde)
+    if cambios is None:
+        raise HTTPException(status_code=500, detail="Error interno al consultar los cambios de la ruta.")
+    if cambios.get('full_resync'):
+        # Token anterior a las lápidas purgadas: no se pueden garantizar los borrados
+        return {"full_resync": True, "sync_token": None}
+
+    tz = _tz_principal(principal)
+    tarjetas = []
+    for t in cambios['tarjetas']:
+        if t['estado'] == 'activas':
+            tarjetas.append(_ruta_tarjeta_item(t, cambios['clientes'], cambios['abonos'], tz))
+        else:
+            # Salió de la ruta activa (cancelada): basta el código y el estado
+            tarjetas.append({'codigo': t['codigo'], 'estado': t['estado'], 'fecha_cancelacion': t['fecha_cancelacion']})
+
+    contenido = {
+        "full_resync": False,
+        "sync_token": cambios['sync_token'],
+        "tarjetas": tarjetas,
+        "abonos": [_ruta_abono_item(a) for a in cambios['abonos_cambiados']],
+        "clientes": cambios['clientes_cambiados'],
+        "eliminados": cambios['eliminados'],
+    }
+    return contenido
+
 @app.get("/empleados/{empleado_id}/clientes", response_model=List[ClienteBase])
 def list_clientes_por_empleado_endpoint(
     empleado_id: str,
@@ -2050,27 +2352,61 @@ def read_abono_endpoint(abono_id: int, principal: dict = Depends(get_current_pri
         logger.error(f"Error al obtener abono: {e}")
         raise HTTPException(status_code=500, detail="Error interno al consultar el abono.")
 
+def _fecha_caja_abono(fecha_abono, tz_name: Optional[str]) -> date:
+    """Día local (zona del usuario) cuya caja afecta el abono: el de su fecha o hoy."""
+    from datetime import datetime, timezone as _tz
+    try:
+        tz = ZoneInfo(tz_name) if tz_name else _tz.utc
+        if fecha_abono:
+            dt_ref = fecha_abono
+            if dt_ref.tzinfo is None:
+                dt_ref = dt_ref.replace(tzinfo=_tz.utc)
+            return dt_ref.astimezone(tz).date()
+        return datetime.now(tz).date()
+    except Exception:
+        return date.today()
+
+def _registrar_abono_en_unidad(tarjeta_codigo: str, monto: Decimal, metodo_pago: str, fecha,
+                               fecha_caja: date, tz_name: Optional[str]) -> Optional[dict]:
+    """
+    Respaldo síncrono de POST /abonos/: inserta el abono, lo relee y recalcula
+    la caja del día en una sola transacción (si la caja falla, no queda el abono).
+    """
+    with DatabasePool.unidad_de_trabajo():
+        abono_id = registrar_abono(
+            tarjeta_codigo=tarjeta_codigo,
+            monto=monto,
+            metodo_pago=metodo_pago,
+            fecha=fecha
+        )
+        if abono_id is None:
+            return None
+        with DatabasePool.get_cursor() as cur:
+            cur.execute("SELECT empleado_identificacion FROM tarjetas WHERE codigo = %s", (tarjeta_codigo,))
+            fila = cur.fetchone()
+            if fila and fila[0]:
+                guardar_caja_dia(cur, fila[0], fecha_caja, tz_name)
+        return obtener_abono_por_id(abono_id) or {}
+
 @app.post("/abonos/", response_model=Abono, status_code=201)
-def create_abono_endpoint(abono: AbonoCreate, principal: dict = Depends(get_current_principal)):
+async def create_abono_endpoint(abono: AbonoCreate, principal: dict = Depends(get_current_principal)):
     """
-    Registra un nuevo abono.
+    Registra un nuevo abono y recalcula la caja del día en la misma transacción.
     """
     try:
         metodo = (abono.metodo_pago or 'efectivo').lower()
         if metodo not in ('efectivo','consignacion'):
             raise HTTPException(status_code=400, detail="metodo_pago inválido")
-        abono_id = registrar_abono(
-            tarjeta_codigo=abono.tarjeta_codigo,
-            monto=Decimal(str(abono.monto)),
-            metodo_pago=metodo,
-            fecha=abono.fecha
-        )
-        if abono_id is None:
-            raise HTTPException(status_code=400, detail="No se pudo registrar el abono.")
-        
-        # Obtener el abono recién creado
-        db_abono = obtener_abono_por_id(abono_id)
+        monto = Decimal(str(abono.monto))
+        tz_name = principal.get("timezone")
+        fecha_caja = _fecha_caja_abono(abono.fecha, tz_name)
+        if AsyncDatabasePool.disponible():
+            db_abono = await registrar_abono_con_caja_async(abono.tarjeta_codigo, monto, metodo, abono.fecha, fecha_caja, tz_name)
+        else:
+            db_abono = await run_in_threadpool(_registrar_abono_en_unidad, abono.tarjeta_codigo, monto, metodo, abono.fecha, fecha_caja, tz_name)
         if db_abono is None:
+            raise HTTPException(status_code=400, detail="No se pudo registrar el abono.")
+        if not db_abono:
             raise HTTPException(status_code=500, detail="Abono creado pero no encontrado.")
         # Normalizar campos opcionales
         try:
@@ -2082,27 +2418,6 @@ def create_abono_endpoint(abono: AbonoCreate, principal: dict = Depends(get_curr
             db_abono['indice_orden'] = 0
         db_abono['metodo_pago'] = (db_abono.get('metodo_pago') or 'efectivo')
 
-        # Recalcular caja del día automáticamente
-        try:
-            tarjeta_info = obtener_tarjeta_por_codigo(abono.tarjeta_codigo)
-            if tarjeta_info:
-                from datetime import datetime, date, timezone as _tz
-                try:
-                    from zoneinfo import ZoneInfo
-                    tz = ZoneInfo(principal.get("timezone")) if principal.get("timezone") else _tz.utc
-                    f_calc = datetime.now(tz).date()
-                    if abono.fecha:
-                        dt_ref = abono.fecha
-                        if dt_ref.tzinfo is None:
-                            dt_ref = dt_ref.replace(tzinfo=_tz.utc)
-                        f_calc = dt_ref.astimezone(tz).date()
-                except Exception:
-                    f_calc = date.today()
-                
-                _ = recalcular_caja_dia(tarjeta_info["empleado_identificacion"], f_calc, principal.get("timezone"))
-        except Exception:
-            pass
-
         return db_abono
     except HTTPException:
         raise
@@ -2278,6 +2593,7 @@ class TarjetaSinAbono(BaseModel):
     cliente_apellido: str
     numero_ruta: Optional[Decimal] = None
     interes: float = 0.0
+    total_pagado: float = 0.0
     atraso: float = 0.0
 
 @app.get("/empleados/{empleado_id}/tarjetas-sin-abono/{fecha}", response_model=List[TarjetaSinAbono])
@@ -2294,14 +2610,29 @@ def list_tarjetas_sin_abono_dia_endpoint(
     tz_name = timezone or principal.get('timezone') or 'UTC'
     return listar_tarjetas_sin_abono_dia(empleado_id, fecha, tz_name)
 
+@app.get("/empleados/{empleado_id}/tarjetas-sin-abono/{fecha}/conteo")
+def count_tarjetas_sin_abono_dia_endpoint(
+    empleado_id: str,
+    fecha: date,
+    timezone: Optional[str] = None,
+    principal: dict = Depends(get_current_principal)
+):
+    """Cantidad de tarjetas activas del empleado sin abono en la fecha (sin el listado)."""
+    _enforce_empleado_scope(principal, empleado_id)
+    tz_name = timezone or principal.get('timezone') or 'UTC'
+    return {"total": contar_tarjetas_sin_abono_dia(empleado_id, fecha, tz_name)}
+
 @app.get("/liquidacion/{empleado_id}/{fecha}", response_model=LiquidacionDiaria)
-def read_liquidacion_diaria_endpoint(empleado_id: str, fecha: str, principal: dict = Depends(get_current_principal)):
+async def read_liquidacion_diaria_endpoint(empleado_id: str, fecha: str, principal: dict = Depends(get_current_principal)):
     _enforce_empleado_scope(principal, empleado_id)
     try:
         from datetime import datetime as _dt
         fecha_obj = _dt.strptime(fecha, '%Y-%m-%d').date()
         tz_name = principal.get('timezone') or 'UTC'
-        datos = obtener_datos_liquidacion(empleado_id, fecha_obj, tz_name)
+        if AsyncDatabasePool.disponible():
+            datos = await obtener_datos_liquidacion_async(empleado_id, fecha_obj, tz_name)
+        else:
+            datos = await run_in_threadpool(obtener_datos_liquidacion, empleado_id, fecha_obj, tz_name)
         # Adaptar tipos a float/int donde aplique
         adaptado = {
             'empleado': datos.get('empleado', empleado_id),
@@ -2326,7 +2657,7 @@ def read_liquidacion_diaria_endpoint(empleado_id: str, fecha: str, principal: di
         raise HTTPException(status_code=500, detail="Error interno al consultar la liquidación diaria.")
 
 @app.get("/liquidacion/resumen/{fecha}", response_model=ResumenFinanciero)
-def read_resumen_financiero_endpoint(fecha: str, principal: dict = Depends(require_admin)):
+def read_resumen_financiero_endpoint(fecha: str, principal: dict = Depends(require_admin), _ro=Depends(lectura_en_replica)):
     try:
         from datetime import datetime as _dt
         fecha_obj = _dt.strptime(fecha, '%Y-%m-%d').date()
@@ -2373,8 +2704,130 @@ def mover_liquidacion_endpoint(req: MoverLiquidacionRequest, principal: dict = D
 
 # --- Endpoint de Resumen de Tarjeta ---
 
+def _hoy_y_zona(principal: dict):
+    """Fecha local de hoy y zona horaria del usuario (UTC si no es válida)."""
+    from datetime import datetime as dt, timezone as _tz
+    tz_name = principal.get("timezone") or "UTC"
+    try:
+        tz = ZoneInfo(tz_name)
+    except Exception:
+        tz = _tz.utc
+    return dt.now(tz).date(), tz
+
+
+def _calcular_resumen_tarjeta(tarjeta: dict, hoy: date, tz) -> dict:
+    """
+    Resumen de una tarjeta (saldo, valor de cuota, atraso, vencimiento) a partir
+    de sus datos y su total abonado. Cálculo puro: lo usan el resumen individual
+    y el de lote sobre filas ya leídas.
+    """
+    from math import floor, ceil
+    from datetime import datetime as dt, timedelta, timezone as _tz
+
+    tarjeta_codigo = tarjeta.get("codigo")
+    total_abonado = tarjeta.get("total_abonado") or 0
+    monto = float(tarjeta.get("monto") or 0)
+    interes = int(tarjeta.get("interes") or 0)
+    cuotas = int(tarjeta.get("cuotas") or 1) or 1
+    modalidad = str(tarjeta.get("modalidad_pago") or "diario").strip().lower()
+    if modalidad not in ("diario", "semanal", "quincenal", "mensual"):
+        modalidad = "diario"
+
+    monto_total = monto * (1 + interes / 100.0)
+    valor_cuota = monto_total / cuotas if cuotas > 0 else monto_total
+    saldo_pendiente = max(0.0, monto_total - float(total_abonado))
+
+    # Fecha de creación en la zona del usuario (se guarda en UTC sin zona)
+    fecha_creacion = tarjeta.get("fecha_creacion")
+    if isinstance(fecha_creacion, dt):
+        if fecha_creacion.tzinfo is None:
+            fecha_creacion = fecha_creacion.replace(tzinfo=_tz.utc)
+        fecha_crea = fecha_creacion.astimezone(tz).date()
+    elif fecha_creacion and hasattr(fecha_creacion, 'isoformat'):
+        fecha_crea = fecha_creacion
+    else:
+        fecha_crea = hoy
+
+    dias_transcurridos = max(0, (hoy - fecha_crea).days)
+
+    # Periodos según modalidad de pago; mensual = cada 30 días (no mes calendario)
+    factor = {"diario": 1, "semanal": 7, "quincenal": 15, "mensual": 30}[modalidad]
+    periodos_transcurridos = dias_transcurridos // factor
+    fecha_venc = fecha_crea + timedelta(days=cuotas * factor)
+
+    cuotas_pagadas = floor(float(total_abonado) / valor_cuota) if valor_cuota > 0 else 0
+    # Puede ser negativo (atraso) o positivo (adelanto). 0 si va al día
+    cuotas_pendientes_a_la_fecha = cuotas_pagadas - int(periodos_transcurridos)
+    # Días pasados desde el vencimiento del plazo (según la modalidad)
+    dias_pasados_cancelacion = max(0, (hoy - fecha_venc).days)
+    cuotas_restantes = ceil(saldo_pendiente / valor_cuota) if valor_cuota > 0 else 0
+    # Regla: no mostrar más cuotas pendientes (en atraso) que las restantes por pagar
+    if cuotas_pendientes_a_la_fecha < 0 and cuotas_restantes > 0:
+        cuotas_pendientes_a_la_fecha = max(cuotas_pendientes_a_la_fecha, -cuotas_restantes)
+
+    return {
+        "tarjeta_id": tarjeta_codigo,
+        "codigo_tarjeta": tarjeta_codigo,
+        "estado_tarjeta": tarjeta.get("estado", "activas"),
+        "modalidad_pago": modalidad,
+        "total_abonado": float(total_abonado),
+        "valor_cuota": float(valor_cuota),
+        "saldo_pendiente": float(saldo_pendiente),
+        "cuotas_restantes": int(cuotas_restantes),
+        "cuotas": int(cuotas),  # Agregado para frontend
+        "cuotas_pendientes_a_la_fecha": int(cuotas_pendientes_a_la_fecha),
+        "dias_pasados_cancelacion": int(dias_pasados_cancelacion),
+        "fecha_vencimiento": fecha_venc.isoformat() if fecha_venc else None,
+    }
+
+
+class ResumenesTarjetasRequest(BaseModel):
+    codigos: Optional[List[str]] = None
+    empleado_identificacion: Optional[str] = None
+    estado: Optional[str] = 'activas'
+
+
+@app.post("/tarjetas/resumenes")
+def read_tarjetas_resumenes_endpoint(body: ResumenesTarjetasRequest, principal: dict = Depends(get_current_principal)):
+    """
+    Resumen (saldo, atraso, vencimiento...) de muchas tarjetas en un solo
+    llamado: por lista de códigos o por empleado + estado. Una consulta; los
+    códigos inexistentes o de otra cuenta (u otro empleado, para cobradores)
+    se omiten. Más de LIMITE_RESUMENES tarjetas -> 400.
+    """
+    if body.codigos is None and not body.empleado_identificacion:
+        raise HTTPException(status_code=400, detail="Debe indicar codigos o empleado_identificacion")
+    if body.codigos is None:
+        _enforce_empleado_scope(principal, body.empleado_identificacion)
+    elif len(body.codigos) > LIMITE_RESUMENES:
+        raise HTTPException(status_code=400, detail=f"Máximo {LIMITE_RESUMENES} códigos por llamado")
+    # Cobrador: solo sus tarjetas, también en modo códigos
+    solo_empleado = None
+    if principal.get("role") != "admin":
+        solo_empleado = str(principal.get("empleado_identificacion") or "")
+    try:
+        filas = obtener_resumenes_tarjetas(
+            body.codigos, body.empleado_identificacion, body.estado,
+            cuenta_id=principal.get("cuenta_id"), solo_empleado=solo_empleado,
+        )
+        if filas is None:
+            raise HTTPException(status_code=500, detail="Error interno al obtener los resúmenes de tarjetas.")
+        if len(filas) > LIMITE_RESUMENES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"El empleado tiene más de {LIMITE_RESUMENES} tarjetas en ese estado; pida los códigos en bloques",
+            )
+        hoy, tz = _hoy_y_zona(principal)
+        return [_calcular_resumen_tarjeta(fila, hoy, tz) for fila in filas]
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error al obtener resúmenes de tarjetas: {e}")
+        raise HTTPException(status_code=500, detail="Error interno al obtener los resúmenes de tarjetas.")
+
+
 @app.get("/tarjetas/{tarjeta_codigo}/resumen")
-def read_tarjeta_resumen_endpoint(tarjeta_codigo: str, principal: dict = Depends(get_current_principal)):
+def read_tarjeta_resumen_endpoint(tarjeta_codigo: str, principal: dict = Depends(get_current_principal), _uow=Depends(unidad_de_trabajo)):
     """
     Devuelve un resumen de la tarjeta: saldo, total abonado, valor de cuota, etc.
     """
@@ -2382,97 +2835,8 @@ def read_tarjeta_resumen_endpoint(tarjeta_codigo: str, principal: dict = Depends
         tarjeta = obtener_tarjeta_por_codigo(tarjeta_codigo)
         if tarjeta is None:
             raise HTTPException(status_code=404, detail="Tarjeta no encontrada")
-
-        # Obtener total abonado
-        with DatabasePool.get_cursor() as cursor:
-            cursor.execute("SELECT COALESCE(SUM(monto), 0) FROM abonos WHERE tarjeta_codigo = %s", (tarjeta_codigo,))
-            total_abonado = cursor.fetchone()[0] or 0
-
-        monto = float(tarjeta["monto"]) if isinstance(tarjeta.get("monto"), (int, float)) else float(tarjeta.get("monto", 0))
-        interes = int(tarjeta.get("interes", 0))
-        cuotas = int(tarjeta.get("cuotas", 1)) or 1
-        modalidad = str(tarjeta.get("modalidad_pago") or "diario").strip().lower()
-        if modalidad not in ("diario", "semanal", "quincenal", "mensual"):
-            modalidad = "diario"
-
-        monto_total = monto * (1 + interes / 100.0)
-        valor_cuota = monto_total / cuotas if cuotas > 0 else monto_total
-        saldo_pendiente = max(0.0, monto_total - float(total_abonado))
-
-        # Cálculos (al día / atraso) según modalidad de pago (diario/semanal/quincenal/mensual)
-        from math import floor, ceil
-        from datetime import datetime as dt, timezone as _tz
-        
-        # Timezone del usuario para calcular 'hoy' correctamente
-        tz_name = principal.get("timezone") or "UTC"
-        try:
-            tz = ZoneInfo(tz_name)
-        except Exception:
-            tz = _tz.utc
-            
-        hoy = dt.now(tz).date()
-        
-        fecha_creacion = tarjeta.get("fecha_creacion")
-        if fecha_creacion:
-            if isinstance(fecha_creacion, dt):
-                if fecha_creacion.tzinfo is None:
-                    fecha_creacion = fecha_creacion.replace(tzinfo=_tz.utc)
-                fecha_crea = fecha_creacion.astimezone(tz).date()
-            elif hasattr(fecha_creacion, 'date'):
-                fecha_crea = fecha_creacion
-            else:
-                fecha_crea = hoy
-        else:
-            fecha_crea = hoy
-            
-        dias_transcurridos = (hoy - fecha_crea).days
-        if dias_transcurridos < 0:
-            dias_transcurridos = 0
-
-        if modalidad == "diario":
-            periodos_transcurridos = dias_transcurridos
-            fecha_venc = fecha_crea.replace()  # no-op (solo para inicializar)
-            from datetime import timedelta
-            fecha_venc = fecha_crea + timedelta(days=cuotas)
-        elif modalidad == "semanal":
-            periodos_transcurridos = dias_transcurridos // 7
-            from datetime import timedelta
-            fecha_venc = fecha_crea + timedelta(days=cuotas * 7)
-        elif modalidad == "quincenal":
-            periodos_transcurridos = dias_transcurridos // 15
-            from datetime import timedelta
-            fecha_venc = fecha_crea + timedelta(days=cuotas * 15)
-        else:  # mensual
-            # Regla solicitada: mensual = cada 30 días (no mes calendario)
-            periodos_transcurridos = dias_transcurridos // 30
-            from datetime import timedelta
-            fecha_venc = fecha_crea + timedelta(days=cuotas * 30)
-        cuotas_pagadas = floor(float(total_abonado) / valor_cuota) if valor_cuota > 0 else 0
-        # Puede ser negativo (atraso) o positivo (adelanto). 0 si va al día
-        cuotas_pendientes_a_la_fecha = cuotas_pagadas - int(periodos_transcurridos)
-        # Días pasados desde el vencimiento del plazo (según la modalidad)
-        dias_pasados_cancelacion = max(0, (hoy - fecha_venc).days)
-        cuotas_restantes = ceil(saldo_pendiente / valor_cuota) if valor_cuota > 0 else 0
-        # Regla: no mostrar más cuotas pendientes (en atraso) que las restantes por pagar
-        if cuotas_pendientes_a_la_fecha < 0 and cuotas_restantes > 0:
-            cuotas_pendientes_a_la_fecha = max(cuotas_pendientes_a_la_fecha, -cuotas_restantes)
-
-        resumen = {
-            "tarjeta_id": tarjeta_codigo,
-            "codigo_tarjeta": tarjeta_codigo,
-            "estado_tarjeta": tarjeta.get("estado", "activas"),
-            "modalidad_pago": modalidad,
-            "total_abonado": float(total_abonado),
-            "valor_cuota": float(valor_cuota),
-            "saldo_pendiente": float(saldo_pendiente),
-            "cuotas_restantes": int(cuotas_restantes),
-            "cuotas": int(cuotas),  # Agregado para frontend
-            "cuotas_pendientes_a_la_fecha": int(cuotas_pendientes_a_la_fecha),
-            "dias_pasados_cancelacion": int(dias_pasados_cancelacion),
-            "fecha_vencimiento": fecha_venc.isoformat() if fecha_venc else None,
-        }
-
-        return resumen
+        hoy, tz = _hoy_y_zona(principal)
+        return _calcular_resumen_tarjeta(tarjeta, hoy, tz)
     except HTTPException:
         raise
     except Exception as e:
@@ -2480,12 +2844,18 @@ def read_tarjeta_resumen_endpoint(tarjeta_codigo: str, principal: dict = Depends
         raise HTTPException(status_code=500, detail="Error interno al obtener el resumen de la tarjeta.")
 
 @app.post("/sync", response_model=SyncResponse)
-def sync_endpoint(payload: SyncRequest, principal: dict = Depends(get_current_principal)):
+def sync_endpoint(payload: SyncRequest, principal: dict = Depends(get_current_principal), _uow=Depends(unidad_de_trabajo)):
     """
     Sincroniza cambios del frontend (offline) con idempotencia.
-    - Usa payload.idempotency_key para evitar procesar duplicado
+    - Usa payload.idempotency_key para evitar procesar duplicado (se reclama al
+      inicio de la transacción del lote: reintentos concurrentes no duplican)
     - Crea clientes/tarjetas nuevas, abonos con metodo_pago, gastos y bases en lote
     - Devuelve mapeos de IDs temporales a definitivos
+    - Todo el request usa una sola conexión y una sola transacción (unidad_de_trabajo)
+    Pendiente: sigue síncrono (threadpool + psycopg2). Pasarlo al pool asíncrono
+    requiere versiones async de los helpers de sync_db (lotes de clientes,
+    tarjetas, abonos, gastos y bases) sobre un mismo cursor, como
+    registrar_abono_con_caja_async.
     """
     try:
         t0 = _pc()
@@ -2620,234 +2990,152 @@ def sync_endpoint(payload: SyncRequest, principal: dict = Depends(get_current_pr
                 logger.error(f"Error verificando permisos para empleado {emp_id}: {e}")
                 raise HTTPException(status_code=500, detail="Error interno verificando permisos")
         
-        # Idempotencia
-        with DatabasePool.get_cursor() as cursor:
-            cursor.execute("SELECT 1 FROM idempotency_keys WHERE key=%s", (payload.idempotency_key,))
-            if cursor.fetchone():
-                # DEBUGGING TEMPORAL: Log de respuesta de idempotencia
-                response_data = SyncResponse(
-                    already_processed=True,
-                    created_tarjetas=[],
-                    created_abonos=[],
-                    created_gastos=0,
-                    created_bases=0
-                )
-                
-                logger.info("🔍 [DEBUG SYNC] Respuesta de idempotencia que se va a devolver:")
-                logger.info(f"  - already_processed: {response_data.already_processed}")
-                logger.info(f"  - created_tarjetas: {response_data.created_tarjetas}")
-                logger.info(f"  - created_abonos: {response_data.created_abonos}")
-                logger.info(f"  - created_gastos: {response_data.created_gastos}")
-                logger.info(f"  - created_bases: {response_data.created_bases}")
-                logger.info(f"  - Tipo de respuesta: {type(response_data)}")
-                
-                return response_data
-        t_idem_chk = _pc()
 
         created_tarjetas = []
         created_abonos = []
         created_gastos = 0
         created_bases = 0
 
-        # 1) Tarjetas nuevas (y clientes si no existen)
-        for idx, t in enumerate(payload.tarjetas_nuevas or []):
-            cli = obtener_cliente_por_identificacion(t.cliente.identificacion)
-            if cli is None:
-                _ = crear_cliente(
-                    identificacion=t.cliente.identificacion,
-                    nombre=t.cliente.nombre,
-                    apellido=t.cliente.apellido,
-                    telefono=t.cliente.telefono,
-                    direccion=t.cliente.direccion,
-                    observaciones=t.cliente.observaciones,
-                )
-            else:
-                # Si ya existe, actualizar datos personales priorizando los valores NUEVOS del payload
-                try:
-                    _ = actualizar_cliente(
-                        identificacion=cli.get('identificacion', t.cliente.identificacion),
-                        nombre=(t.cliente.nombre if (t.cliente.nombre is not None and str(t.cliente.nombre).strip() != '') else cli.get('nombre', '')),
-                        apellido=(t.cliente.apellido if (t.cliente.apellido is not None and str(t.cliente.apellido).strip() != '') else cli.get('apellido', '')),
-                        telefono=(t.cliente.telefono if (t.cliente.telefono is not None and str(t.cliente.telefono).strip() != '') else cli.get('telefono')),
-                        direccion=(t.cliente.direccion if (t.cliente.direccion is not None and str(t.cliente.direccion).strip() != '') else cli.get('direccion')),
-                        observaciones=(t.cliente.observaciones if (t.cliente.observaciones is not None and str(t.cliente.observaciones).strip() != '') else cli.get('observaciones')),
-                    )
-                except Exception:
-                    pass
-            codigo = crear_tarjeta(
-                cliente_identificacion=t.cliente.identificacion,
-                empleado_identificacion=t.empleado_identificacion,
-                monto=Decimal(str(t.monto)),
-                cuotas=int(t.cuotas),
-                interes=int(t.interes),
-                modalidad_pago=(getattr(t, 'modalidad_pago', None) or 'diario'),
-                numero_ruta=Decimal(str(t.numero_ruta)) if t.numero_ruta is not None else None,
-                observaciones=t.observaciones,
-                posicion_anterior=Decimal(str(t.posicion_anterior)) if t.posicion_anterior is not None else None,
-                posicion_siguiente=Decimal(str(t.posicion_siguiente)) if t.posicion_siguiente is not None else None,
-            )
-            if not codigo:
-                raise HTTPException(status_code=400, detail="No se pudo crear una tarjeta durante la sincronización")
-            created_tarjetas.append({"temp_id": t.temp_id, "codigo": codigo})
-            if (idx + 1) % 50 == 0:
-                logger.info(f"Tarjetas procesadas: {idx + 1}")
-        t_tar = _pc()
-
-        # Mapa rápido temp_id -> codigo real
-        temp_to_real = {it["temp_id"]: it["codigo"] for it in created_tarjetas}
-
-        # 2) Abonos (inserción optimizada por lotes)
-        abonos_payload = []
-        tarjetas_con_abonos = set()
+        # Validaciones previas (antes de abrir la transacción)
         for a in (payload.abonos or []):
             metodo = (a.metodo_pago or 'efectivo').lower()
             if metodo not in ('efectivo','consignacion'):
                 raise HTTPException(status_code=400, detail="metodo_pago inválido en abono")
-            tc = temp_to_real.get(a.tarjeta_codigo, a.tarjeta_codigo)
-            try:
-                abonos_payload.append((tc, Decimal(str(a.monto)), metodo))
-                tarjetas_con_abonos.add(tc)
-            except Exception:
-                raise HTTPException(status_code=400, detail="Abono inválido en sincronización")
 
-        if abonos_payload:
-            # Preparar payload con tarjeta repetida para calcular indice_orden por tarjeta
-            batch_rows = []
-            for (tc, monto_dec, metodo) in abonos_payload:
-                batch_rows.append((tc, monto_dec, tc, metodo))
+        # Todo el lote se escribe en UNA conexión y UNA transacción:
+        # si algo falla, no quedan tarjetas/abonos/gastos/bases a medias.
+        try:
             with DatabasePool.get_cursor() as cur:
-                # Insertar con fecha NOW() y calcular indice_orden: max(indice_orden)+1 por tarjeta
-                cur.executemany(
-                    """
-                    INSERT INTO abonos (tarjeta_codigo, fecha, monto, indice_orden, metodo_pago)
-                    SELECT %s, NOW(), %s,
-                           COALESCE((SELECT MAX(indice_orden) FROM abonos WHERE tarjeta_codigo=%s), 0) + 1,
-                           %s
-                    """,
-                    batch_rows,
+                # 0) Reclamar la key de idempotencia ANTES de escribir el lote: un
+                # reintento concurrente con la misma key espera aquí a la primera
+                # transacción y, si ésta confirma, no obtiene fila y no repite nada.
+                cur.execute(
+                    "INSERT INTO idempotency_keys(key) VALUES (%s) ON CONFLICT (key) DO NOTHING RETURNING key",
+                    (payload.idempotency_key,),
                 )
-            # Para la respuesta, solo reportar la cantidad creada
-            created_abonos = [{"id_temporal": a.id_temporal or ""} for a in (payload.abonos or [])]
-        t_abn = _pc()
-
-        # 2.1) Actualización optimizada de estado de tarjetas: cancelar aquellas con saldo 0
-        t_cancel = _pc()
-        try:
-            if tarjetas_con_abonos:
-                tarjetas_list = list(tarjetas_con_abonos)
-                with DatabasePool.get_cursor() as cur:
-                    # Sumas de abonos por tarjeta afectada
-                    placeholders = ','.join(['%s'] * len(tarjetas_list))
-                    cur.execute(
-                        f"""
-                        SELECT tarjeta_codigo, COALESCE(SUM(monto),0)
-                        FROM abonos
-                        WHERE tarjeta_codigo IN ({placeholders})
-                        GROUP BY tarjeta_codigo
-                        """,
-                        tarjetas_list,
+                if cur.fetchone() is None:
+                    logger.info(f"Sincronización ya procesada (idempotency_key={payload.idempotency_key})")
+                    return SyncResponse(
+                        already_processed=True,
+                        created_tarjetas=[],
+                        created_abonos=[],
+                        created_gastos=0,
+                        created_bases=0
                     )
-                    sum_abonos = {row[0]: row[1] for row in cur.fetchall() or []}
+                t_idem_chk = _pc()
+
+                # 1) Clientes (upsert en lote) y tarjetas nuevas
+                tarjetas_nuevas = payload.tarjetas_nuevas or []
+                if tarjetas_nuevas:
+                    upsert_clientes_lote(cur, [
+                        {
+                            'identificacion': t.cliente.identificacion,
+                            'nombre': t.cliente.nombre,
+                            'apellido': t.cliente.apellido,
+                            'telefono': t.cliente.telefono,
+                            'direccion': t.cliente.direccion,
+                            'observaciones': t.cliente.observaciones,
+                        }
+                        for t in tarjetas_nuevas
+                    ])
+                    codigos = crear_tarjetas_lote(cur, [
+                        {
+                            'cliente_identificacion': t.cliente.identificacion,
+                            'empleado_identificacion': t.empleado_identificacion,
+                            'monto': Decimal(str(t.monto)),
+                            'cuotas': int(t.cuotas),
+                            'interes': int(t.interes),
+                            'modalidad_pago': (getattr(t, 'modalidad_pago', None) or 'diario'),
+                            'numero_ruta': Decimal(str(t.numero_ruta)) if t.numero_ruta is not None else None,
+                            'observaciones': t.observaciones,
+                            'posicion_anterior': Decimal(str(t.posicion_anterior)) if t.posicion_anterior is not None else None,
+                            'posicion_siguiente': Decimal(str(t.posicion_siguiente)) if t.posicion_siguiente is not None else None,
+                        }
+                        for t in tarjetas_nuevas
+                    ])
+                    created_tarjetas = [
+                        {"temp_id": t.temp_id, "codigo": codigo}
+                        for t, codigo in zip(tarjetas_nuevas, codigos)
+                    ]
+                t_tar = _pc()
 
-                    # Datos base de tarjetas para calcular total
-                    cur.execute(
-                        f"""
-                        SELECT codigo, monto, interes, cuotas, estado
-                        FROM tarjetas
-                        WHERE codigo IN ({placeholders})
-                        """,
-                        tarjetas_list,
-                    )
-                    to_cancel = []
-                    for row in cur.fetchall() or []:
-                        codigo, monto, interes, cuotas, estado = row
-                        try:
-                            monto_base = float(monto or 0)
-                            interes_pct = int(interes or 0)
-                            total = monto_base * (1 + interes_pct / 100.0)
-                            abonado = float(sum_abonos.get(codigo, 0) or 0)
-                            saldo = total - abonado
-                            if saldo <= 0 and (estado == 'activas' or estado == 'activa'):
-                                to_cancel.append(codigo)
-                        except Exception:
-                            continue
-                    if to_cancel:
-                        placeholders2 = ','.join(['%s'] * len(to_cancel))
-                        cur.execute(
-                            f"""
-                            UPDATE tarjetas
-                            SET estado='cancelada',
-                                fecha_cancelacion=%s
-                            WHERE codigo IN ({placeholders2})
-                              AND (estado='activas' OR estado='activa')
-                            """,
-                            [today_local, *to_cancel],
-                        )
-        except Exception:
-            # No bloquear la sincronización si algo falla aquí
-            pass
-        t_cancel = _pc()
+                # Mapa rápido temp_id -> codigo real
+                temp_to_real = {it["temp_id"]: it["codigo"] for it in created_tarjetas}
 
-        # 3) Gastos
-        for idx, g in enumerate(payload.gastos or []):
-            # Debug: Log del gasto
-            logger.info(f"Procesando gasto: empleado={g.empleado_identificacion}, tipo={g.tipo}, valor={g.valor}, fecha={g.fecha}")
-            
-            # Truncar empleado_identificacion a 20 caracteres para evitar error de BD
-            empleado_id_truncado = str(g.empleado_identificacion)[:20] if g.empleado_identificacion else None
-            
-            # Pydantic ya convierte la fecha a objeto date, usar directamente
-            fecha_obj = g.fecha if g.fecha else date.today()
-            
-            gid = agregar_gasto(
-                empleado_identificacion=empleado_id_truncado,
-                tipo=g.tipo,
-                valor=Decimal(str(g.valor)),
-                fecha=fecha_obj,
-                observacion=g.observacion,
-            )
-            if gid is None:
-                logger.error(f"Error al crear gasto: empleado={empleado_id_truncado}, tipo={g.tipo}, fecha={g.fecha}")
-                raise HTTPException(status_code=400, detail="No se pudo registrar un gasto durante la sincronización")
-            created_gastos += 1
-            if (idx + 1) % 100 == 0:
-                logger.info(f"Gastos procesados: {idx + 1}")
-        t_gas = _pc()
-
-        # 4) Bases (una por día/empleado). Si ya existe, actualizar en vez de fallar
-        for idx, b in enumerate(payload.bases or []):
-            logger.info(f"Procesando base: empleado={b.empleado_id}, fecha={b.fecha}, monto={b.monto}")
-            empleado_id_truncado = str(b.empleado_id)[:20] if b.empleado_id else None
-            fecha_obj = b.fecha
-            try:
-                # ¿Existe ya una base para ese día/empleado?
-                existente = obtener_base(empleado_id_truncado, fecha_obj)
-                if existente:
-                    ok = actualizar_base(empleado_id_truncado, fecha_obj, Decimal(str(b.monto)))
-                    if not ok:
-                        logger.error(f"Error al actualizar base existente: empleado={empleado_id_truncado}, fecha={b.fecha}")
-                        raise HTTPException(status_code=400, detail="No se pudo actualizar la base existente durante la sincronización")
-                    created_bases += 1
-                else:
-                    bid = insertar_base(empleado_id_truncado, fecha_obj, Decimal(str(b.monto)))
-                    if bid is None:
-                        logger.error(f"Error al crear base: empleado={empleado_id_truncado}, fecha={b.fecha}, monto={b.monto}")
-                        raise HTTPException(status_code=400, detail="No se pudo registrar una base durante la sincronización")
-                    created_bases += 1
-            except HTTPException:
-                raise
-            except Exception as e:
-                logger.error(f"Excepción al procesar base: {e}")
-                raise HTTPException(status_code=500, detail="Error interno al procesar base durante la sincronización")
-            if (idx + 1) % 100 == 0:
-                logger.info(f"Bases procesadas: {idx + 1}")
-        t_bas = _pc()
+                # 2) Abonos (inserción optimizada por lotes)
+                abonos_payload = []
+                tarjetas_con_abonos = set()
+                for a in (payload.abonos or []):
+                    metodo = (a.metodo_pago or 'efectivo').lower()
+                    tc = temp_to_real.get(a.tarjeta_codigo, a.tarjeta_codigo)
+                    try:
+                        abonos_payload.append((tc, Decimal(str(a.monto)), metodo))
+                        tarjetas_con_abonos.add(tc)
+                    except Exception:
+                        raise HTTPException(status_code=400, detail="Abono inválido en sincronización")
+
+                if abonos_payload:
+                    # Una sola sentencia; ids en el mismo orden del payload
+                    ids = insertar_abonos_lote(cur, [
+                        {'tarjeta_codigo': tc, 'monto': monto_dec, 'metodo_pago': metodo}
+                        for (tc, monto_dec, metodo) in abonos_payload
+                    ])
+                    created_abonos = [
+                        {"id_temporal": a.id_temporal or "", "id": abono_id}
+                        for a, abono_id in zip(payload.abonos or [], ids)
+                    ]
+                t_abn = _pc()
 
-        # Registrar la key de idempotencia al final (commit implícito con context manager)
-        with DatabasePool.get_cursor() as cursor:
-            cursor.execute("INSERT INTO idempotency_keys(key) VALUES (%s) ON CONFLICT (key) DO NOTHING", (payload.idempotency_key,))
+                # 2.1) Actualización optimizada de estado de tarjetas: cancelar aquellas con saldo 0
+                # Va en un SAVEPOINT: si falla no debe abortar el resto de la transacción.
+                try:
+                    if tarjetas_con_abonos:
+                        tarjetas_list = list(tarjetas_con_abonos)
+                        cur.execute("SAVEPOINT sync_cancelar")
+                        # Una sola sentencia sobre el saldo denormalizado (los triggers
+                        # ya sumaron los abonos recién insertados)
+                        actualizar_estado_por_saldo(cur, tarjetas_list, today_local)
+                        cur.execute("RELEASE SAVEPOINT sync_cancelar")
+                except Exception as e:
+                    # No bloquear la sincronización si algo falla aquí
+                    logger.warning(f"No se pudo actualizar estado de tarjetas en sync: {e}")
+                    cur.execute("ROLLBACK TO SAVEPOINT sync_cancelar")
+                t_cancel = _pc()
+
+                # 3) Gastos (una sola sentencia)
+                created_gastos = insertar_gastos_lote(cur, [
+                    {
+                        # Truncar empleado_identificacion a 20 caracteres para evitar error de BD
+                        'empleado_identificacion': str(g.empleado_identificacion)[:20] if g.empleado_identificacion else None,
+                        'tipo': g.tipo,
+                        'valor': Decimal(str(g.valor)),
+                        'observacion': g.observacion,
+                        'fecha': g.fecha if g.fecha else date.today(),
+                    }
+                    for g in (payload.gastos or [])
+                ])
+                t_gas = _pc()
+
+                # 4) Bases (una por día/empleado). Si ya existe, se actualiza en vez de fallar
+                created_bases = upsert_bases_lote(cur, [
+                    {
+                        'empleado_id': str(b.empleado_id)[:20] if b.empleado_id else None,
+                        'fecha': b.fecha,
+                        'monto': Decimal(str(b.monto)),
+                    }
+                    for b in (payload.bases or [])
+                ])
+                t_bas = _pc()
+        except ValueError as e:
+            logger.error(f"Lote de sincronización inválido: {e}")
+            raise HTTPException(status_code=400, detail=f"Datos inválidos durante la sincronización: {e}")
         t_idem_ins = _pc()
 
+        # Limpiar caché de tarjetas (tarjetas nuevas o canceladas por los abonos)
+        if created_tarjetas or payload.abonos:
+            for emp_id in empleado_ids:
+                invalidar_cache_tarjetas(emp_id)
+
         # Actualizar permisos DESPUÉS de sincronización exitosa
         # Solo actualizar el empleado único que se sincronizó
         try:
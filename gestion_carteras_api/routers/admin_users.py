@@ -1,3 +1,4 @@
+import os
 from typing import Optional
 from datetime import date, timedelta, datetime
 try:
@@ -12,9 +13,53 @@ from pydantic import BaseModel
 from ..security import require_admin, get_password_hash, get_current_principal
 from ..schemas import AttemptDownloadRequest, AttemptDownloadResponse
 from ..database.connection_pool import DatabasePool
+from ..database.cache import crear_cache
+from ..database.empleados_db import invalidar_cache_empleados
+from ..database import cache_bus
 
 router = APIRouter()
 
+# Estado de la cuenta (plan y vigencia) por cuenta_id; se consulta en cada refresh
+# y en cada operación con límites. Invalidado entre instancias vía cache_bus.
+_cache_cuentas = crear_cache(
+    'cuentas',
+    max_entradas=int(os.getenv('CACHE_CUENTAS_MAX_ENTRADAS', '500')),
+    ttl_segundos=float(os.getenv('CACHE_CUENTAS_TTL_SECONDS', '300')),
+)
+
+
+def invalidar_cache_cuenta(cuenta_id) -> None:
+    cache_bus.publicar('cuenta', cuenta_id)
+
+
+def _invalidar_cuenta_local(cuenta_id: Optional[str] = None):
+    if cuenta_id:
+        _cache_cuentas.invalidar(str(cuenta_id))
+    else:
+        _cache_cuentas.invalidar_todo()
+
+
+cache_bus.registrar_ambito('cuenta', _invalidar_cuenta_local)
+
+
+def _estado_cuenta(cuenta_id) -> Optional[tuple]:
+    """(max_empleados, fecha_fin, trial_until, timezone_default) de la cuenta, o None."""
+    usar_cache = cache_bus.cache_habilitado('CACHE_CUENTAS_ENABLED')
+    if usar_cache:
+        cacheado = _cache_cuentas.get(str(cuenta_id), 'estado')
+        if cacheado is not None:
+            return cacheado
+        generacion = _cache_cuentas.generacion(str(cuenta_id))
+    with DatabasePool.get_cursor() as cur:
+        cur.execute("""
+            SELECT max_empleados, fecha_fin, trial_until, timezone_default
+            FROM cuentas_admin WHERE id=%s
+        """, (cuenta_id,))
+        row = cur.fetchone()
+    if row is not None and usar_cache:
+        _cache_cuentas.set(str(cuenta_id), 'estado', tuple(row), generacion)
+    return tuple(row) if row is not None else None
+
 def get_hoy_local(timezone_str: Optional[str]) -> date:
     """Obtiene la fecha actual respetando la zona horaria del usuario."""
     if not timezone_str:
@@ -30,35 +75,29 @@ def enforce_account_state(cuenta_id: str, timezone_str: Optional[str] = None) ->
     Retorna True si la cuenta está activa, False si está vencida.
     Nota: No cambia estados de usuarios; la suscripción se hace cumplir a nivel de cuenta.
     """
-    with DatabasePool.get_cursor() as cur:
-        # Obtener información de la cuenta
-        cur.execute("""
-            SELECT max_empleados, fecha_fin, trial_until, timezone_default
-            FROM cuentas_admin WHERE id=%s
-        """, (cuenta_id,))
-        row = cur.fetchone()
-        
-        if not row:
-            return False
-            
-        max_emp, fecha_fin, trial_until, tz_default = row
-        tz_eff = timezone_str or tz_default or 'America/Bogota'
-        hoy = get_hoy_local(tz_eff)
-        
-        # Normalizar fechas a date si vienen como datetime
-        if fecha_fin and hasattr(fecha_fin, 'date'):
-            fecha_fin = fecha_fin.date()
-        if trial_until and hasattr(trial_until, 'date'):
-            trial_until = trial_until.date()
-        
-        # Verificar si está vencida
-        vencida = False
-        if fecha_fin and hoy > fecha_fin:
-            vencida = True
-        elif trial_until and hoy > trial_until and not fecha_fin:
-            vencida = True
+    # Obtener información de la cuenta
+    row = _estado_cuenta(cuenta_id)
+    if not row:
+        return False
+
+    max_emp, fecha_fin, trial_until, tz_default = row
+    tz_eff = timezone_str or tz_default or 'America/Bogota'
+    hoy = get_hoy_local(tz_eff)
+
+    # Normalizar fechas a date si vienen como datetime
+    if fecha_fin and hasattr(fecha_fin, 'date'):
+        fecha_fin = fecha_fin.date()
+    if trial_until and hasattr(trial_until, 'date'):
+        trial_until = trial_until.date()
+
+    # Verificar si está vencida
+    vencida = False
+    if fecha_fin and hoy > fecha_fin:
+        vencida = True
+    elif trial_until and hoy > trial_until and not fecha_fin:
+        vencida = True
 
-        return not vencida
+    return not vencida
 
 
 class CreateCobradorRequest(BaseModel):
@@ -172,6 +211,7 @@ def create_cobrador(body: CreateCobradorRequest, principal: dict = Depends(requi
         emp_cuenta = row[0]
         if emp_cuenta is None:
             cur.execute("UPDATE empleados SET cuenta_id=%s WHERE identificacion=%s", (cuenta_id, body.empleado_identificacion))
+            invalidar_cache_empleados(cuenta_id)
         elif emp_cuenta != cuenta_id:
             raise HTTPException(status_code=403, detail="El empleado pertenece a otra cuenta")
 
@@ -199,7 +239,6 @@ def create_cobrador(body: CreateCobradorRequest, principal: dict = Depends(requi
         new_id = cur.fetchone()[0]
         
         # Guardar contraseña en texto plano para memorización
-        _ensure_tabla_passwords(cur)
         cur.execute(
             """
             INSERT INTO cobrador_passwords (usuario_id, password_plain)
@@ -245,26 +284,10 @@ class UsarPermisosRequest(BaseModel):
     descargar: bool = False
     subir: bool = False
 
-def _ensure_tabla_passwords(cur):
-    # Crear tabla para guardar contraseñas en texto plano de cobradores
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS cobrador_passwords (
-            usuario_id INTEGER PRIMARY KEY,
-            password_plain TEXT NOT NULL,
-            FOREIGN KEY (usuario_id) REFERENCES usuarios(id) ON DELETE CASCADE
-        )
-        """
-    )
-
-
 @router.get("/users/cobradores/{empleado_id}/credentials", response_model=CobradorCredsResponse)
 def get_cobrador_credentials(empleado_id: str, principal: dict = Depends(require_admin)):
     cuenta_id = principal.get("cuenta_id")
     with DatabasePool.get_cursor() as cur:
-        # Asegurar que la tabla existe
-        _ensure_tabla_passwords(cur)
-        
         try:
             # Buscar si hay una contraseña guardada en texto plano
             cur.execute("""
@@ -335,7 +358,6 @@ def upsert_cobrador(empleado_id: str, body: UpsertCobradorRequest, principal: di
                 (body.username, pwd_hash, row[0]),
             )
             # Actualizar contraseña en texto plano
-            _ensure_tabla_passwords(cur)
             cur.execute(
                 """
                 INSERT INTO cobrador_passwords (usuario_id, password_plain)
@@ -357,7 +379,6 @@ def upsert_cobrador(empleado_id: str, body: UpsertCobradorRequest, principal: di
             )
             new_id = cur.fetchone()[0]
             # Guardar contraseña en texto plano
-            _ensure_tabla_passwords(cur)
             cur.execute(
                 """
                 INSERT INTO cobrador_passwords (usuario_id, password_plain)
@@ -615,11 +636,6 @@ def renew_subscription(body: RenewRequest, principal: dict = Depends(require_adm
         hoy_local = get_hoy_local(tz_eff)
         fecha_fin_local = hoy_local + timedelta(days=int(body.dias or 0))
 
-        # Asegurar columna max_daily_routes
-        cur.execute("""
-            ALTER TABLE cuentas_admin
-            ADD COLUMN IF NOT EXISTS max_daily_routes INTEGER
-        """)
         # 1. Actualizar plan
         cur.execute(
             """
@@ -634,6 +650,7 @@ def renew_subscription(body: RenewRequest, principal: dict = Depends(require_adm
             """,
             (body.max_empleados, body.max_daily_routes, body.max_empleados, hoy_local, fecha_fin_local, cuenta_id),
         )
+        invalidar_cache_cuenta(cuenta_id)
     
     return {
         "ok": True, 
@@ -711,13 +728,6 @@ def attempt_download(body: AttemptDownloadRequest, principal: dict = Depends(get
     except _ZINF:
         hoy_local = _dt.now(_ZI('UTC')).date()
     with DatabasePool.get_cursor() as cur:
-        # Asegurar columnas volátiles
-        cur.execute("""
-            ALTER TABLE cuentas_admin
-            ADD COLUMN IF NOT EXISTS daily_routes_date DATE,
-            ADD COLUMN IF NOT EXISTS daily_routes_empleados JSONB DEFAULT '{}'::jsonb,
-            ADD COLUMN IF NOT EXISTS max_daily_routes INTEGER
-        """)
         # Validar pertenencia del empleado a la cuenta cuando el rol es admin (opcional pero recomendable)
         if role == 'admin':
             cur.execute("SELECT 1 FROM empleados WHERE identificacion=%s AND cuenta_id=%s", (empleado_id, cuenta_id))
@@ -6,7 +6,7 @@ from datetime import date, datetime
 from ..schemas import DataCreditoReport, IndicadoresTarjeta
 from ..security import get_current_principal, require_admin
 from ..services.risk_engine import RiskEngine
-from ..database.connection_pool import DatabasePool
+from ..database.connection_pool import DatabasePool, lectura_en_replica
 from ..database.clientes_db import obtener_cliente_por_identificacion, actualizar_score_historial
 from ..database.tarjetas_db import obtener_tarjetas_cliente
 from ..database.abonos_db import obtener_abonos_por_tarjeta
@@ -26,7 +26,7 @@ def _get_empleados_cuenta(cuenta_id: Optional[int]) -> Set[str]:
         return set()
 
 @router.get("/clientes/{identificacion}/reporte", response_model=DataCreditoReport)
-def get_datacredito_report(identificacion: str, principal: dict = Depends(get_current_principal)):
+def get_datacredito_report(identificacion: str, principal: dict = Depends(get_current_principal), _ro=Depends(lectura_en_replica)):
     """
     Genera el reporte de DataCrédito Interno en tiempo real.
     Combina historial compactado con análisis en vivo de tarjetas activas.
@@ -52,11 +52,6 @@ def signup(body: SignupRequest):
             raise HTTPException(status_code=409, detail="Email ya registrado. Inicia sesión o usa otro email.")
 
         # crear cuenta (guardar timezone_default si se envía)
-        cur.execute(
-            """
-            ALTER TABLE cuentas_admin ADD COLUMN IF NOT EXISTS timezone_default TEXT
-            """
-        )
         cur.execute(
             """
             INSERT INTO cuentas_admin (nombre, estado_suscripcion, plan, fecha_inicio, fecha_fin, max_empleados, trial_until, timezone_default)
@@ -339,6 +339,30 @@ class ContabilidadMetricas(BaseModel):
     total_clavos: float = 0.0
     tarjetas_activas_historicas: int = 0
 
+class ClavosEmpleado(BaseModel):
+    empleado_identificacion: str
+    total: float
+    cantidad: int
+
+class ClavoTarjeta(BaseModel):
+    codigo: str
+    empleado_identificacion: str
+    cliente_identificacion: Optional[str] = None
+    fecha_vencimiento: date
+    dias_vencida: int
+    saldo: float
+
+class ReporteClavos(BaseModel):
+    fecha_corte: date
+    umbral_dias: int
+    total: float
+    cantidad: int
+    por_empleado: List[ClavosEmpleado] = []
+    tarjetas: Optional[List[ClavoTarjeta]] = None
+
+class UmbralClavos(BaseModel):
+    dias: Optional[int] = Field(None, gt=0)  # None -> valor por defecto (60)
+
 class CajaValor(BaseModel):
     fecha: date
     valor: float
@@ -372,4 +396,32 @@ class VerificacionEsquemaCaja(BaseModel):
     tabla_caja: bool
     tabla_salidas: bool
     columnas_caja: List[str] = []
-    columnas_salidas: List[str] = []
\ No newline at end of file
+    columnas_salidas: List[str] = []
+
+class EstadoIndice(BaseModel):
+    tabla: str
+    indice: str
+    columnas: List[str] = []
+    existe: bool
+    valido: bool
+    en_uso: bool
+    escaneos: int = 0
+    tuplas_leidas: int = 0
+    tamano_bytes: int = 0
+    definicion: Optional[str] = None
+
+
+class DiferenciaSaldo(BaseModel):
+    codigo: str
+    total_abonado: Decimal
+    total_real: Decimal
+    abonos_count: int
+    abonos_count_real: int
+    ultimo_abono_fecha: Optional[datetime] = None
+    ultimo_abono_fecha_real: Optional[datetime] = None
+
+
+class VerificacionSaldos(BaseModel):
+    inconsistentes: int
+    reparadas: int = 0
+    muestra: List[DiferenciaSaldo] = []
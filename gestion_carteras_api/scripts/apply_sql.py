@@ -3,6 +3,7 @@ import pathlib
 import psycopg2
 
 from gestion_carteras_api.database.db_config import DB_CONFIG
+from gestion_carteras_api.database.migraciones import split_statements
 
 
 def main():
@@ -19,8 +20,8 @@ def main():
     conn.autocommit = True
     cur = conn.cursor()
     try:
-        # Ejecutar múltiples sentencias separadas por ';'
-        statements = [s.strip() for s in sql.split(';') if s.strip()]
+        # Ejecutar múltiples sentencias separadas por ';' (respetando bloques $$)
+        statements = split_statements(sql)
         for idx, stmt in enumerate(statements, start=1):
             try:
                 cur.execute(stmt)
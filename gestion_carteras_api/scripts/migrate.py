@@ -0,0 +1,31 @@
+import argparse
+import logging
+import sys
+
+from gestion_carteras_api.database.db_config import DB_CONFIG
+from gestion_carteras_api.database.migraciones import MigracionError, aplicar_migraciones, estado_migraciones
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Aplica las migraciones versionadas pendientes (database/migrations).")
+    parser.add_argument("--estado", action="store_true", help="Solo lista cada migración como aplicada, pendiente o modificada.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.estado:
+        for version, estado in estado_migraciones(DB_CONFIG):
+            print(f"{estado:<10} {version}")
+        return 0
+
+    try:
+        aplicadas = aplicar_migraciones(DB_CONFIG)
+    except MigracionError as e:
+        print(f"ERROR: {e}")
+        return 1
+    print(f"aplicadas={len(aplicadas)} {' '.join(aplicadas)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
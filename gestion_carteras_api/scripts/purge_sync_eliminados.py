@@ -0,0 +1,29 @@
+import argparse
+import logging
+
+from gestion_carteras_api.database.connection_pool import DatabasePool
+from gestion_carteras_api.database.db_config import DB_CONFIG
+from gestion_carteras_api.database.tarjetas_db import SYNC_RETENCION_DIAS, purgar_sync_eliminados
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Purga las lápidas de sincronización (sync_eliminados) vencidas.")
+    parser.add_argument("--dias", type=int, default=SYNC_RETENCION_DIAS,
+                        help=f"Días de retención (default: SYNC_RETENCION_DIAS={SYNC_RETENCION_DIAS}).")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    # Inicializar pool
+    DatabasePool.initialize(**DB_CONFIG)
+
+    res = purgar_sync_eliminados(args.dias)
+    if res is None:
+        return 2
+
+    print(f"eliminadas={res['eliminadas']} token_minimo={res['token_minimo']}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
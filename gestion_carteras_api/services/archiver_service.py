@@ -9,7 +9,7 @@ from typing import Dict, List, Optional, Any, Tuple
 
 from ..database.connection_pool import DatabasePool
 from ..database.abonos_db import obtener_abonos_por_tarjeta
-from ..database.tarjetas_db import obtener_tarjetas_canceladas_antiguas
+from ..database.tarjetas_db import obtener_tarjetas_canceladas_antiguas, invalidar_cache_tarjetas
 from ..services.risk_engine import RiskEngine
 
 logger = logging.getLogger(__name__)
@@ -128,6 +128,7 @@ def archivar_tarjetas_canceladas_antiguas(
                 # Borramos primero abonos para evitar FK si existe.
                 cursor.execute("DELETE FROM abonos WHERE tarjeta_codigo = ANY(%s)", (codigos_a_borrar,))
                 cursor.execute("DELETE FROM tarjetas WHERE codigo = ANY(%s)", (codigos_a_borrar,))
+                invalidar_cache_tarjetas()
 
                 tarjetas_procesadas += len(codigos_a_borrar)
                 clientes_afectados += 1
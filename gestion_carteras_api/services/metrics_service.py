@@ -0,0 +1,244 @@
+"""Métricas en formato de exposición de Prometheus (texto 0.0.4).
+
+Sin dependencias externas: contadores e histogramas simples protegidos por un
+lock y un middleware ASGI que mide cada request (latencia, consultas a la BD y
+tiempo en BD por ruta). El pool se lee de DatabasePool.stats() al exportar.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple
+
+from ..database.connection_pool import DatabasePool
+from ..database.async_pool import AsyncDatabasePool
+from ..database.cache import stats_caches
+from ..database import cache_bus
+
+# Límites (segundos) para la latencia de los requests
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Etiquetas = Tuple[Tuple[str, str], ...]
+
+
+def _escapar(valor: str) -> str:
+    return str(valor).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _formatear_etiquetas(etiquetas: Etiquetas, extra: Etiquetas = ()) -> str:
+    pares = tuple(etiquetas) + tuple(extra)
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{k}="{_escapar(v)}"' for k, v in pares) + '}'
+
+
+def _formatear_numero(valor: float) -> str:
+    if valor == float('inf'):
+        return '+Inf'
+    if float(valor).is_integer():
+        return str(int(valor))
+    return repr(float(valor))
+
+
+class Contador:
+    """Contador monotónico con etiquetas."""
+
+    def __init__(self, nombre: str, ayuda: str):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self._valores: Dict[Etiquetas, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, etiquetas: Etiquetas = (), valor: float = 1.0):
+        with self._lock:
+            self._valores[etiquetas] = self._valores.get(etiquetas, 0.0) + valor
+
+    def exponer(self) -> List[str]:
+        with self._lock:
+            valores = list(self._valores.items())
+        lineas = [f'# HELP {self.nombre} {self.ayuda}', f'# TYPE {self.nombre} counter']
+        for etiquetas, valor in sorted(valores):
+            lineas.append(f'{self.nombre}{_formatear_etiquetas(etiquetas)} {_formatear_numero(valor)}')
+        return lineas
+
+
+class Histograma:
+    """Histograma acumulativo con etiquetas y límites fijos."""
+
+    def __init__(self, nombre: str, ayuda: str, buckets: Iterable[float]):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.buckets = tuple(sorted(buckets))
+        # etiquetas -> [conteos por bucket..., suma, cuenta]
+        self._series: Dict[Etiquetas, list] = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor: float, etiquetas: Etiquetas = ()):
+        with self._lock:
+            serie = self._series.get(etiquetas)
+            if serie is None:
+                serie = [0] * len(self.buckets) + [0.0, 0]
+                self._series[etiquetas] = serie
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie[i] += 1
+                    break
+            serie[-2] += valor
+            serie[-1] += 1
+
+    def exponer(self) -> List[str]:
+        with self._lock:
+            series = [(k, list(v)) for k, v in self._series.items()]
+        lineas = [f'# HELP {self.nombre} {self.ayuda}', f'# TYPE {self.nombre} histogram']
+        for etiquetas, serie in sorted(series):
+            conteos = serie[:len(self.buckets)]
+            lineas.extend(exponer_histograma(self.nombre, etiquetas, zip(self.buckets, conteos), serie[-2], serie[-1]))
+        return lineas
+
+
+def exponer_histograma(nombre: str, etiquetas: Etiquetas, buckets, suma: float, cuenta: int) -> List[str]:
+    """Líneas de un histograma a partir de conteos NO acumulados por bucket."""
+    lineas = []
+    acumulado = 0
+    for limite, conteo in buckets:
+        acumulado += conteo
+        le = (('le', _formatear_numero(limite)),)
+        lineas.append(f'{nombre}_bucket{_formatear_etiquetas(etiquetas, le)} {acumulado}')
+    lineas.append(f'{nombre}_bucket{_formatear_etiquetas(etiquetas, (("le", "+Inf"),))} {cuenta}')
+    lineas.append(f'{nombre}_sum{_formatear_etiquetas(etiquetas)} {_formatear_numero(suma)}')
+    lineas.append(f'{nombre}_count{_formatear_etiquetas(etiquetas)} {cuenta}')
+    return lineas
+
+
+# --- Métricas de la aplicación ---
+
+request_latencia = Histograma(
+    'http_request_duration_seconds', 'Latencia de los requests HTTP por ruta', BUCKETS_LATENCIA
+)
+requests_total = Contador('http_requests_total', 'Requests HTTP por ruta, método y código de estado')
+db_consultas_total = Contador('db_queries_total', 'Sentencias SQL ejecutadas por ruta')
+db_segundos_total = Contador('db_query_seconds_total', 'Tiempo acumulado en sentencias SQL por ruta')
+
+_METRICAS_APP = (request_latencia, requests_total, db_consultas_total, db_segundos_total)
+
+
+def _exponer_pool() -> List[str]:
+    stats = DatabasePool.stats()
+    if not stats:
+        return []
+    lineas = []
+
+    def _gauge(nombre, ayuda, valor):
+        lineas.extend([f'# HELP {nombre} {ayuda}', f'# TYPE {nombre} gauge', f'{nombre} {_formatear_numero(valor)}'])
+
+    def _counter(nombre, ayuda, valor):
+        lineas.extend([f'# HELP {nombre} {ayuda}', f'# TYPE {nombre} counter', f'{nombre} {_formatear_numero(valor)}'])
+
+    _gauge('db_pool_connections_max', 'Máximo de conexiones del pool', stats.get('max', 0))
+    _gauge('db_pool_connections_open', 'Conexiones abiertas', stats.get('open', 0))
+    _gauge('db_pool_connections_in_use', 'Conexiones prestadas', stats.get('in_use', 0))
+    _gauge('db_pool_connections_idle', 'Conexiones libres', stats.get('idle', 0))
+    _gauge('db_pool_waiting', 'Hilos esperando una conexión', stats.get('waiting', 0))
+    _counter('db_pool_acquire_timeouts_total', 'Esperas de conexión que vencieron', stats.get('timeouts', 0))
+    _counter('db_pool_broken_replaced_total', 'Conexiones rotas reemplazadas', stats.get('broken_replaced', 0))
+
+    stats_async = AsyncDatabasePool.stats()
+    if stats_async:
+        _gauge('db_async_pool_connections_open', 'Conexiones abiertas del pool asíncrono', stats_async.get('pool_size', 0))
+        _gauge('db_async_pool_connections_idle', 'Conexiones libres del pool asíncrono', stats_async.get('pool_available', 0))
+        _gauge('db_async_pool_waiting', 'Requests esperando una conexión del pool asíncrono', stats_async.get('requests_waiting', 0))
+
+    stats_replica = DatabasePool.stats_replica()
+    if stats_replica:
+        _gauge('db_replica_pool_connections_in_use', 'Conexiones prestadas del pool de réplica', stats_replica.get('in_use', 0))
+        _gauge('db_replica_pool_connections_idle', 'Conexiones libres del pool de réplica', stats_replica.get('idle', 0))
+        _gauge('db_replica_up_to_date', '1 si la réplica está dentro del retraso máximo', 1 if stats_replica.get('up_to_date') else 0)
+        _counter('db_replica_primary_fallbacks_total', 'Lecturas de reportes atendidas por el primario', stats_replica.get('primary_fallbacks', 0))
+
+    hist = stats.get('wait_histogram')
+    if hist:
+        nombre = 'db_pool_acquire_wait_seconds'
+        lineas.extend([f'# HELP {nombre} Espera para obtener una conexión del pool', f'# TYPE {nombre} histogram'])
+        lineas.extend(exponer_histograma(nombre, (), hist['buckets'], hist['sum'], hist['count']))
+    return lineas
+
+
+def _exponer_caches() -> List[str]:
+    caches = stats_caches()
+    if not caches:
+        return []
+    lineas = []
+    series = (
+        ('cache_entries', 'gauge', 'entradas', 'Entradas en el caché'),
+        ('cache_hits_total', 'counter', 'aciertos', 'Aciertos del caché'),
+        ('cache_misses_total', 'counter', 'fallos', 'Fallos del caché'),
+        ('cache_evictions_total', 'counter', 'expulsiones', 'Entradas expulsadas por tamaño (LRU)'),
+        ('cache_invalidations_total', 'counter', 'invalidaciones', 'Invalidaciones del caché'),
+    )
+    for nombre, tipo, clave, ayuda in series:
+        lineas.extend([f'# HELP {nombre} {ayuda}', f'# TYPE {nombre} {tipo}'])
+        for cache, datos in sorted(caches.items()):
+            lineas.append(f'{nombre}{_formatear_etiquetas((("cache", cache),))} {_formatear_numero(datos[clave])}')
+
+    escucha = cache_bus.stats()
+    if escucha:
+        lineas.extend([
+            '# HELP cache_invalidation_listener_up 1 si la escucha LISTEN/NOTIFY está conectada',
+            '# TYPE cache_invalidation_listener_up gauge',
+            f"cache_invalidation_listener_up {1 if escucha['conectado'] else 0}",
+            '# HELP cache_invalidation_messages_total Avisos de invalidación recibidos',
+            '# TYPE cache_invalidation_messages_total counter',
+            f"cache_invalidation_messages_total {escucha['recibidos']}",
+            '# HELP cache_invalidation_listener_reconnects_total Reconexiones de la escucha',
+            '# TYPE cache_invalidation_listener_reconnects_total counter',
+            f"cache_invalidation_listener_reconnects_total {escucha['reconexiones']}",
+        ])
+    return lineas
+
+
+def exponer_metricas() -> str:
+    """Texto completo para GET /metrics."""
+    lineas: List[str] = []
+    for metrica in _METRICAS_APP:
+        lineas.extend(metrica.exponer())
+    lineas.extend(_exponer_pool())
+    lineas.extend(_exponer_caches())
+    return '\n'.join(lineas) + '\n'
+
+
+class MetricasMiddleware:
+    """Middleware ASGI: mide latencia, consultas y tiempo en BD de cada request.
+
+    La ruta se etiqueta con la plantilla (p. ej. /tarjetas/{tarjeta_codigo}) para
+    no crear una serie por cada código; lo que no coincide con ninguna ruta se
+    agrupa en "sin_ruta".
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope.get('type') != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        estado = {'codigo': 500}
+
+        async def _send(mensaje):
+            if mensaje.get('type') == 'http.response.start':
+                estado['codigo'] = mensaje.get('status', 500)
+            await send(mensaje)
+
+        medicion, token = DatabasePool.iniciar_medicion()
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            duracion = time.perf_counter() - inicio
+            DatabasePool.finalizar_medicion(token)
+            ruta = getattr(scope.get('route'), 'path', None) or 'sin_ruta'
+            etiquetas = (('route', ruta), ('method', scope.get('method', '')))
+            request_latencia.observar(duracion, etiquetas)
+            requests_total.inc(etiquetas + (('status', str(estado['codigo'])),))
+            db_consultas_total.inc(etiquetas, medicion.consultas)
+            db_segundos_total.inc(etiquetas, medicion.segundos)
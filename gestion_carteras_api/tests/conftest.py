@@ -0,0 +1,52 @@
+"""
+Fixtures de las pruebas.
+
+Las pruebas marcadas con la fixture `pg` corren el SQL real contra PostgreSQL:
+se activan con TEST_DATABASE_URL (DSN de una base de pruebas, nunca la de
+producción) y se omiten si no está definida. Cada prueba trabaja en una
+transacción que se revierte al final; las tablas que necesita las crea como
+TEMP con el mismo nombre, que tienen prioridad sobre las del esquema public.
+"""
+import os
+
+import pytest
+
+
+class CursorGrabador:
+    """Cursor que guarda (sql, params) y responde filas predefinidas, sin interpretar el SQL."""
+
+    def __init__(self, *respuestas):
+        self.respuestas = list(respuestas)
+        self.ejecutadas = []
+        self._filas = []
+
+    def execute(self, sql, params=None):
+        self.ejecutadas.append((' '.join(sql.split()), params))
+        self._filas = self.respuestas.pop(0) if self.respuestas else []
+
+    def fetchone(self):
+        return self._filas[0] if self._filas else None
+
+    def fetchall(self):
+        return self._filas
+
+
+@pytest.fixture
+def grabador():
+    return CursorGrabador
+
+
+@pytest.fixture
+def pg():
+    dsn = os.getenv('TEST_DATABASE_URL')
+    if not dsn:
+        pytest.skip('TEST_DATABASE_URL no definida')
+    import psycopg2
+
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            yield cur
+    finally:
+        conn.rollback()
+        conn.close()
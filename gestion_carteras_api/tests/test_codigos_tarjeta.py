@@ -0,0 +1,77 @@
+"""Reserva de códigos de tarjeta por prefijo (_reservar_codigos / _resincronizar_codigo)."""
+import pytest
+
+from gestion_carteras_api.database.tarjetas_db import _reservar_codigos, _resincronizar_codigo
+
+
+def test_una_sentencia_con_prefijos_ordenados(grabador):
+    cursor = grabador([('240501-1234-', 5), ('240501-5678-', 11)])
+    primeros = _reservar_codigos(cursor, {'240501-5678-': 1, '240501-1234-': 4})
+    assert primeros == {'240501-1234-': 2, '240501-5678-': 11}
+
+    (sql, params), = cursor.ejecutadas
+    assert sql.startswith('INSERT INTO tarjetas_codigo_secuencias AS s (prefijo, ultimo_n)')
+    assert 'ON CONFLICT (prefijo) DO UPDATE SET ultimo_n = s.ultimo_n + EXCLUDED.ultimo_n' in sql
+    assert sql.endswith('RETURNING prefijo, ultimo_n')
+    # Prefijos ordenados: las filas se bloquean siempre en el mismo orden
+    assert params == (['240501-1234-', '240501-5678-'], [4, 1])
+
+
+def test_se_pasa_de_999(grabador):
+    with pytest.raises(ValueError):
+        _reservar_codigos(grabador([('240501-1234-', 1000)]), {'240501-1234-': 2})
+
+
+def test_resincronizar_usa_el_maximo_del_prefijo(grabador):
+    cursor = grabador([('240501-1234-007',)], [])
+    _resincronizar_codigo(cursor, '240501-1234-')
+    assert cursor.ejecutadas[0] == ('SELECT MAX(codigo) FROM tarjetas WHERE codigo LIKE %s', ('240501-1234-%',))
+    sql, params = cursor.ejecutadas[1]
+    assert 'SET ultimo_n = GREATEST(ultimo_n, %s)' in sql
+    assert params == (7, '240501-1234-')
+
+
+# --- Contra PostgreSQL (TEST_DATABASE_URL) ----------------------------------
+
+@pytest.fixture
+def secuencias_pg(pg):
+    pg.execute("""
+        CREATE TEMP TABLE tarjetas_codigo_secuencias (
+            prefijo TEXT PRIMARY KEY,
+            ultimo_n INTEGER NOT NULL CHECK (ultimo_n >= 0)
+        ) ON COMMIT DROP
+    """)
+    pg.execute("CREATE TEMP TABLE tarjetas (codigo TEXT PRIMARY KEY) ON COMMIT DROP")
+    return pg
+
+
+def _contador(cur, prefijo):
+    cur.execute("SELECT ultimo_n FROM tarjetas_codigo_secuencias WHERE prefijo = %s", (prefijo,))
+    return cur.fetchone()[0]
+
+
+def test_reservas_consecutivas_en_postgres(secuencias_pg):
+    cur = secuencias_pg
+    assert _reservar_codigos(cur, {'240501-1234-': 3}) == {'240501-1234-': 1}
+    assert _reservar_codigos(cur, {'240501-1234-': 2, '240501-5678-': 1}) == {'240501-1234-': 4, '240501-5678-': 1}
+    assert _contador(cur, '240501-1234-') == 5
+
+
+def test_limite_999_en_postgres(secuencias_pg):
+    cur = secuencias_pg
+    cur.execute("INSERT INTO tarjetas_codigo_secuencias VALUES ('240501-1234-', 998)")
+    assert _reservar_codigos(cur, {'240501-1234-': 1}) == {'240501-1234-': 999}
+    with pytest.raises(ValueError):
+        _reservar_codigos(cur, {'240501-1234-': 1})
+
+
+def test_resincronizar_en_postgres(secuencias_pg):
+    cur = secuencias_pg
+    cur.execute("INSERT INTO tarjetas VALUES ('240501-1234-001'), ('240501-1234-007'), ('240502-1234-009')")
+    cur.execute("INSERT INTO tarjetas_codigo_secuencias VALUES ('240501-1234-', 2), ('240502-1234-', 20)")
+    _resincronizar_codigo(cur, '240501-1234-')
+    _resincronizar_codigo(cur, '240502-1234-')
+    # Sube al máximo existente, nunca baja
+    assert _contador(cur, '240501-1234-') == 7
+    assert _contador(cur, '240502-1234-') == 20
+    assert _reservar_codigos(cur, {'240501-1234-': 1}) == {'240501-1234-': 8}
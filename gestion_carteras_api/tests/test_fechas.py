@@ -0,0 +1,74 @@
+"""Límites UTC de días locales (limites_dia_utc / limites_rango_utc), incluidos cambios de horario."""
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from gestion_carteras_api.database.fechas import limites_dia_utc, limites_rango_utc
+
+
+def test_utc_por_defecto_y_zona_invalida():
+    esperado = (datetime(2024, 5, 1), datetime(2024, 5, 2))
+    assert limites_dia_utc(date(2024, 5, 1)) == esperado
+    assert limites_dia_utc(date(2024, 5, 1), 'Zona/Inexistente') == esperado
+
+
+def test_zona_sin_horario_de_verano():
+    inicio, fin = limites_dia_utc(date(2024, 5, 1), 'America/Bogota')
+    assert inicio == datetime(2024, 5, 1, 5, 0)
+    assert fin == datetime(2024, 5, 2, 5, 0)
+
+
+def test_dia_de_23_horas():
+    # Nueva York adelanta el reloj a las 02:00 del 10/03/2024
+    inicio, fin = limites_dia_utc(date(2024, 3, 10), 'America/New_York')
+    assert inicio == datetime(2024, 3, 10, 5, 0)
+    assert fin == datetime(2024, 3, 11, 4, 0)
+    assert fin - inicio == timedelta(hours=23)
+
+
+def test_dia_de_25_horas():
+    # Nueva York atrasa el reloj a las 02:00 del 03/11/2024
+    inicio, fin = limites_dia_utc(date(2024, 11, 3), 'America/New_York')
+    assert inicio == datetime(2024, 11, 3, 4, 0)
+    assert fin == datetime(2024, 11, 4, 5, 0)
+    assert fin - inicio == timedelta(hours=25)
+
+
+def test_medianoche_inexistente_toma_el_instante_del_cambio():
+    # Santiago salta de 00:00 a 01:00 el 08/09/2024: el día empieza en el cambio
+    inicio, fin = limites_dia_utc(date(2024, 9, 8), 'America/Santiago')
+    assert inicio == datetime(2024, 9, 8, 4, 0)
+    assert fin == datetime(2024, 9, 9, 3, 0)
+    # y el día anterior termina justo donde este empieza (sin huecos ni solapes)
+    assert limites_dia_utc(date(2024, 9, 7), 'America/Santiago')[1] == inicio
+
+
+def test_rango_es_la_union_de_los_dias():
+    tz = 'America/New_York'
+    inicio, fin = limites_rango_utc(date(2024, 3, 9), date(2024, 3, 11), tz)
+    assert inicio == limites_dia_utc(date(2024, 3, 9), tz)[0]
+    assert fin == limites_dia_utc(date(2024, 3, 11), tz)[1]
+
+
+@pytest.mark.parametrize('fecha, tz', [
+    (date(2024, 3, 10), 'America/New_York'),
+    (date(2024, 11, 3), 'America/New_York'),
+    (date(2024, 9, 8), 'America/Santiago'),
+    (date(2024, 5, 1), 'America/Bogota'),
+])
+def test_coincide_con_la_fecha_local_de_postgres(pg, fecha, tz):
+    # El rango debe seleccionar exactamente lo que el filtro por expresión que reemplaza
+    inicio, fin = limites_dia_utc(fecha, tz)
+    pg.execute(
+        """
+        SELECT (%(inicio)s::timestamp AT TIME ZONE 'UTC' AT TIME ZONE %(tz)s)::date,
+               ((%(fin)s::timestamp - interval '1 microsecond') AT TIME ZONE 'UTC' AT TIME ZONE %(tz)s)::date,
+               (%(fin)s::timestamp AT TIME ZONE 'UTC' AT TIME ZONE %(tz)s)::date,
+               ((%(inicio)s::timestamp - interval '1 microsecond') AT TIME ZONE 'UTC' AT TIME ZONE %(tz)s)::date
+        """,
+        {'inicio': inicio, 'fin': fin, 'tz': tz},
+    )
+    primero, ultimo, siguiente, anterior = pg.fetchone()
+    assert primero == ultimo == fecha
+    assert siguiente == fecha + timedelta(days=1)
+    assert anterior == fecha - timedelta(days=1)
@@ -0,0 +1,80 @@
+"""Runner de migraciones: separación de sentencias y descubrimiento de versiones."""
+from gestion_carteras_api.database.migraciones import VERSION_BASE, descubrir, split_statements
+
+
+def test_separa_por_punto_y_coma_y_descarta_vacias():
+    sql = "CREATE TABLE a (id INT);\n\n;  ALTER TABLE a ADD COLUMN b INT ;\n"
+    assert split_statements(sql) == ['CREATE TABLE a (id INT)', 'ALTER TABLE a ADD COLUMN b INT']
+
+
+def test_respeta_comillas_y_comentarios():
+    sql = (
+        "-- encabezado; con punto y coma\n"
+        "INSERT INTO t (x) VALUES ('a;b'), ('it''s; ok'); -- otro; comentario\n"
+        "SELECT 1;\n"
+        "-- solo comentario al final;\n"
+    )
+    assert split_statements(sql) == [
+        "-- encabezado; con punto y coma\nINSERT INTO t (x) VALUES ('a;b'), ('it''s; ok')",
+        "-- otro; comentario\nSELECT 1",
+    ]
+
+
+def test_cuerpos_dollar_quoted():
+    funcion = (
+        "CREATE OR REPLACE FUNCTION f() RETURNS trigger AS $$\n"
+        "BEGIN\n"
+        "    NEW.x := 1; -- dentro del cuerpo;\n"
+        "    RETURN NEW;\n"
+        "END;\n"
+        "$$ LANGUAGE plpgsql"
+    )
+    etiquetada = "DO $cuerpo$ BEGIN PERFORM 1; RAISE NOTICE '$$;'; END $cuerpo$"
+    sql = f"{funcion};\nDROP TRIGGER IF EXISTS t ON x;\n{etiquetada};"
+    assert split_statements(sql) == [funcion, 'DROP TRIGGER IF EXISTS t ON x', etiquetada]
+
+
+def test_parametros_posicionales_no_abren_bloque():
+    sql = "PREPARE p AS SELECT $1; EXECUTE p(1);"
+    assert split_statements(sql) == ['PREPARE p AS SELECT $1', 'EXECUTE p(1)']
+
+
+def test_migraciones_del_repositorio():
+    migraciones = descubrir()
+    versiones = [m.version for m in migraciones]
+    assert versiones == sorted(versiones)
+    # Los scripts manuales no son versiones
+    assert not any(v.startswith(('diagnostico', 'zz_', '2025-')) for v in versiones)
+    assert all(m.es_base == (m.version[:3] <= VERSION_BASE) for m in migraciones)
+    assert all(split_statements(m.sql) for m in migraciones)
+
+    por_version = {m.version: m for m in migraciones}
+    assert por_version['015_indices_rutas_calientes'].sin_transaccion
+    assert not por_version['011_sync_change_tracking'].sin_transaccion
+
+
+def test_sentencias_separadas_se_ejecutan_en_postgres(pg):
+    # Cada fragmento debe ser una sentencia válida: cuerpos plpgsql con ';' incluidos
+    script = """
+        -- migración de prueba; todo TEMP
+        CREATE TEMP TABLE prueba_split (id INT PRIMARY KEY, nota TEXT, marca TEXT) ON COMMIT DROP;
+
+        CREATE FUNCTION pg_temp.fn_prueba_split() RETURNS trigger AS $$
+        BEGIN
+            NEW.marca := 'ok; ' || COALESCE(NEW.nota, '');  -- comentario; dentro
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER trg_prueba_split BEFORE INSERT ON prueba_split
+            FOR EACH ROW EXECUTE FUNCTION pg_temp.fn_prueba_split();
+
+        DO $bloque$ BEGIN INSERT INTO prueba_split (id, nota) VALUES (1, 'a;b'); END $bloque$;
+        INSERT INTO prueba_split (id, nota) VALUES (2, 'it''s; $$');
+    """
+    sentencias = split_statements(script)
+    assert len(sentencias) == 5
+    for sentencia in sentencias:
+        pg.execute(sentencia)
+    pg.execute("SELECT id, marca FROM prueba_split ORDER BY id")
+    assert pg.fetchall() == [(1, 'ok; a;b'), (2, "ok; it's; $$")]
@@ -0,0 +1,131 @@
+"""Paginación keyset: consulta_keyset y el cursor opaco."""
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+from gestion_carteras_api.database.paginacion import (
+    CursorInvalido,
+    codificar_cursor,
+    consulta_keyset,
+    decodificar_cursor,
+    siguiente_cursor,
+)
+
+ORDEN = (('t.numero_ruta', 'numero_ruta'), ('t.codigo', 'codigo'))
+SELECT = 'SELECT t.numero_ruta, t.codigo FROM tarjetas t'
+
+
+@pytest.mark.parametrize('valores', [
+    (Decimal('150.5'), 'T-001'),
+    (None, 'T-002'),
+    (datetime(2024, 3, 10, 5, 30, 15), 42),
+    (date(2024, 1, 31), True),
+])
+def test_cursor_ida_y_vuelta(valores):
+    cursor = codificar_cursor('tarjetas', valores)
+    decodificado = decodificar_cursor('tarjetas', cursor, len(valores))
+    esperado = tuple(int(v) if isinstance(v, bool) else v for v in valores)
+    assert decodificado == esperado
+    assert [type(v) for v in decodificado] == [type(v) for v in esperado]
+
+
+def test_cursor_de_otro_listado_o_largo_no_sirve():
+    cursor = codificar_cursor('tarjetas', (1, 'A'))
+    with pytest.raises(CursorInvalido):
+        decodificar_cursor('gastos', cursor, 2)
+    with pytest.raises(CursorInvalido):
+        decodificar_cursor('tarjetas', cursor, 3)
+
+
+@pytest.mark.parametrize('cursor', ['', 'no-es-base64!', 'A' * 600])
+def test_cursor_basura(cursor):
+    with pytest.raises(CursorInvalido):
+        decodificar_cursor('tarjetas', cursor, 2)
+
+
+def test_cursor_con_tipo_desconocido():
+    crudo = json.dumps({'l': 'tarjetas', 'v': [['X', 1], ['S', 'A']]}).encode('utf-8')
+    cursor = base64.urlsafe_b64encode(crudo).decode('ascii').rstrip('=')
+    with pytest.raises(CursorInvalido):
+        decodificar_cursor('tarjetas', cursor, 2)
+
+
+def test_siguiente_cursor_solo_con_pagina_llena():
+    filas = [{'numero_ruta': 100, 'codigo': 'A'}, {'numero_ruta': 200, 'codigo': 'B'}]
+    assert siguiente_cursor('tarjetas', filas, 3, 'numero_ruta', 'codigo') is None
+    cursor = siguiente_cursor('tarjetas', filas, 2, 'numero_ruta', 'codigo')
+    assert decodificar_cursor('tarjetas', cursor, 2) == (200, 'B')
+
+
+def test_primera_pagina_usa_offset():
+    sql, params = consulta_keyset(SELECT, 't.empleado_identificacion = %s', ['E1'], ORDEN, None, 50, offset=10)
+    assert sql == (
+        f'{SELECT} WHERE t.empleado_identificacion = %s'
+        ' ORDER BY t.numero_ruta ASC, t.codigo ASC OFFSET %s LIMIT %s'
+    )
+    assert params == ['E1', 10, 50]
+
+
+def test_pagina_siguiente_compara_la_fila_completa():
+    sql, params = consulta_keyset(SELECT, '', [], ORDEN, (100, 'A'), 50, descendente=True)
+    assert sql == (
+        f'{SELECT} WHERE TRUE AND (t.numero_ruta, t.codigo) < (%s, %s)'
+        ' ORDER BY t.numero_ruta DESC, t.codigo DESC LIMIT %s'
+    )
+    assert params == [100, 'A', 50]
+
+
+def test_lider_nullable_une_el_tramo_de_nulos():
+    sql, params = consulta_keyset(SELECT, 't.estado = %s', ['activas'], ORDEN, (100, 'A'), 20, lider_nullable=True)
+    assert 'UNION ALL' in sql
+    assert 't.numero_ruta IS NULL' in sql
+    assert sql.endswith('ORDER BY numero_ruta ASC NULLS LAST, codigo ASC LIMIT %s')
+    assert sql.count('%s') == len(params)
+    assert params == ['activas', 100, 'A', 20, 'activas', 20, 20]
+
+
+def test_lider_nullable_ya_en_los_nulos():
+    sql, params = consulta_keyset(SELECT, 't.estado = %s', ['activas'], ORDEN, (None, 'A'), 20, lider_nullable=True)
+    assert sql == (
+        f'{SELECT} WHERE t.estado = %s AND t.numero_ruta IS NULL AND (t.codigo) > (%s)'
+        ' ORDER BY t.codigo ASC NULLS LAST LIMIT %s'
+    )
+    assert params == ['activas', 'A', 20]
+
+
+# --- Contra PostgreSQL (TEST_DATABASE_URL) ----------------------------------
+
+@pytest.mark.parametrize('descendente', [False, True])
+def test_recorrer_todas_las_paginas_en_postgres(pg, descendente):
+    pg.execute("""
+        CREATE TEMP TABLE tarjetas (codigo TEXT PRIMARY KEY, numero_ruta NUMERIC(10, 3), estado TEXT) ON COMMIT DROP
+    """)
+    filas = [
+        ('A', Decimal('100'), 'activas'), ('B', Decimal('100'), 'activas'), ('C', Decimal('150.5'), 'activas'),
+        ('D', None, 'activas'), ('E', Decimal('200'), 'activas'), ('F', None, 'activas'),
+        ('G', Decimal('120'), 'cancelada'), ('H', Decimal('90'), 'activas'), ('I', None, 'activas'),
+    ]
+    pg.executemany("INSERT INTO tarjetas VALUES (%s, %s, %s)", filas)
+    direccion = 'DESC' if descendente else 'ASC'
+    pg.execute(
+        f"SELECT t.numero_ruta, t.codigo FROM tarjetas t WHERE t.estado = 'activas'"
+        f" ORDER BY t.numero_ruta {direccion} NULLS LAST, t.codigo {direccion}"
+    )
+    esperado = pg.fetchall()
+
+    vistas, cursor, limite = [], None, 2
+    for _ in range(len(filas)):
+        despues = decodificar_cursor('tarjetas', cursor, 2) if cursor else None
+        sql, params = consulta_keyset(SELECT, 't.estado = %s', ['activas'], ORDEN, despues, limite,
+                                      descendente=descendente, lider_nullable=True)
+        pg.execute(sql, params)
+        pagina = pg.fetchall()
+        vistas.extend(pagina)
+        cursor = siguiente_cursor('tarjetas', pagina, limite, 0, 1)
+        if cursor is None:
+            break
+
+    assert vistas == esperado
@@ -0,0 +1,185 @@
+"""Asignación de numero_ruta: reglas (_calcular_numero_ruta), SQL de _RutasEmpleado y su ejecución en PostgreSQL."""
+import bisect
+from decimal import Decimal
+
+import pytest
+
+from gestion_carteras_api.database.tarjetas_db import _RutasEmpleado, _calcular_numero_ruta
+
+
+class RutasEnLista(_RutasEmpleado):
+    """_RutasEmpleado sobre una lista de rutas enteras: prueba las reglas sin SQL."""
+
+    def __init__(self, *rutas):
+        super().__init__(None, 'E1')
+        self.rutas = sorted(int(r) for r in rutas)
+        self.llamadas = []
+
+    def agregar(self, ruta: int):
+        bisect.insort(self.rutas, int(ruta))
+
+    def hay_rutas(self) -> bool:
+        self.llamadas.append('hay_rutas')
+        return bool(self.rutas)
+
+    def maximo(self):
+        self.llamadas.append('maximo')
+        return self.rutas[-1] if self.rutas else None
+
+    def existe(self, ruta: int) -> bool:
+        self.llamadas.append('existe')
+        return ruta in self.rutas
+
+    def siguiente(self, ruta: int):
+        self.llamadas.append('siguiente')
+        return next((r for r in self.rutas if r > ruta), None)
+
+    def anterior(self, ruta: int):
+        self.llamadas.append('anterior')
+        return next((r for r in reversed(self.rutas) if r < ruta), None)
+
+
+def test_sin_rutas_empieza_en_100():
+    assert _calcular_numero_ruta(RutasEnLista()) == Decimal('100')
+
+
+@pytest.mark.parametrize('existentes, pa, ps, esperada', [
+    # Sin referencia: siguiente centena sobre el máximo
+    ((100, 200), None, None, 300),
+    ((150,), None, None, 200),
+    # Entre dos posiciones: la mitad entera
+    ((100, 200), 100, 200, 150),
+    # Mitad ocupada: siguiente centena del mayor
+    ((100, 150, 200), 100, 200, 300),
+    # Sin hueco entero entre ellas
+    ((100, 101), 100, 101, 200),
+    # Solo anterior: mitad hasta la siguiente existente
+    ((100, 200), 100, None, 150),
+    # Solo anterior y es la última: siguiente centena
+    ((100, 200), 200, None, 300),
+    # Solo siguiente: mitad desde la anterior existente
+    ((100, 200), None, 200, 150),
+    # Solo siguiente y es la primera: centena previa (mínimo 100)
+    ((300,), None, 300, 200),
+    ((100,), None, 100, 100),
+    # Solo siguiente sin hueco: centena previa libre
+    ((250, 251), None, 251, 200),
+    # Con referencia pero sin tarjetas activas: 100
+    ((), 100, 200, 100),
+    ((), 300, None, 100),
+    ((), None, 300, 100),
+])
+def test_calcular_numero_ruta(existentes, pa, ps, esperada):
+    assert _calcular_numero_ruta(RutasEnLista(*existentes), pa, ps) == Decimal(esperada)
+
+
+@pytest.mark.parametrize('pa, ps', [(100, 200), (100, None), (None, 200), (200, None), (None, 100)])
+def test_con_referencia_no_consulta_el_maximo(pa, ps):
+    rutas = RutasEnLista(100, 200)
+    _calcular_numero_ruta(rutas, pa, ps)
+    assert 'maximo' not in rutas.llamadas
+
+
+def test_tope_9900_usa_la_unidad_siguiente_al_maximo():
+    assert _calcular_numero_ruta(RutasEnLista(9900)) == Decimal('9901')
+    assert _calcular_numero_ruta(RutasEnLista(9999)) == Decimal('9900')
+
+
+def test_lote_no_repite_rutas_asignadas_en_la_transaccion():
+    rutas = RutasEnLista(100, 200)
+    primera = _calcular_numero_ruta(rutas, 100, 200)
+    rutas.agregar(primera)
+    assert primera == Decimal('150')
+    assert _calcular_numero_ruta(rutas, 100, 200) == Decimal('300')
+
+
+# --- SQL que arma _RutasEmpleado -------------------------------------------
+
+FILTRO_BASE = ("FROM tarjetas WHERE empleado_identificacion = %s AND estado = 'activas' "
+               "AND numero_ruta IS NOT NULL AND")
+
+
+@pytest.mark.parametrize('metodo, argumento, select, condicion, params', [
+    ('maximo', None, 'MAX(numero_ruta)::int', 'TRUE', ('E1',)),
+    ('existe', 150, 'COUNT(*) > 0', 'numero_ruta >= %s AND numero_ruta < %s', ('E1', Decimal('149.5'), Decimal('150.5'))),
+    ('siguiente', 100, 'MIN(numero_ruta)::int', 'numero_ruta >= %s', ('E1', Decimal('100.5'))),
+    ('anterior', 150, 'MAX(numero_ruta)::int', 'numero_ruta < %s', ('E1', Decimal('149.5'))),
+])
+def test_consultas_por_rango_de_la_columna(grabador, metodo, argumento, select, condicion, params):
+    cursor = grabador([(None,)])
+    rutas = _RutasEmpleado(cursor, 'E1')
+    getattr(rutas, metodo)(*([] if argumento is None else [argumento]))
+    assert cursor.ejecutadas == [(f'SELECT {select} {FILTRO_BASE} {condicion}', params)]
+
+
+def test_hay_rutas_usa_exists_y_las_agregadas_evitan_la_consulta(grabador):
+    cursor = grabador([(False,)])
+    rutas = _RutasEmpleado(cursor, 'E1')
+    assert rutas.hay_rutas() is False
+    sql, params = cursor.ejecutadas[0]
+    assert sql.startswith('SELECT EXISTS ( SELECT 1 FROM tarjetas')
+    assert params == ('E1',)
+
+    rutas.agregar(300)
+    assert rutas.hay_rutas() is True
+    assert len(cursor.ejecutadas) == 1
+
+
+def test_agregadas_se_combinan_con_la_consulta(grabador):
+    rutas = _RutasEmpleado(grabador([(200,)], [(None,)], [(100,)]), 'E1')
+    rutas.agregar(150)
+    assert rutas.maximo() == 200
+    assert rutas.siguiente(100) == 150
+    assert rutas.anterior(200) == 150
+
+
+# --- Contra PostgreSQL (TEST_DATABASE_URL) ----------------------------------
+
+@pytest.fixture
+def tarjetas_pg(pg):
+    pg.execute("""
+        CREATE TEMP TABLE tarjetas (
+            codigo TEXT PRIMARY KEY,
+            empleado_identificacion VARCHAR(20),
+            estado VARCHAR(20),
+            numero_ruta NUMERIC(10, 3)
+        ) ON COMMIT DROP
+    """)
+
+    def _cargar(*filas):
+        pg.executemany(
+            "INSERT INTO tarjetas (codigo, empleado_identificacion, estado, numero_ruta) VALUES (%s, %s, %s, %s)",
+            filas,
+        )
+        return _RutasEmpleado(pg, 'E1')
+    return _cargar
+
+
+def test_rutas_en_postgres(tarjetas_pg):
+    rutas = tarjetas_pg(
+        ('A', 'E1', 'activas', Decimal('100')),
+        ('B', 'E1', 'activas', Decimal('149.5')),   # ::int redondea a 150
+        ('C', 'E1', 'activas', Decimal('200.4')),   # ::int redondea a 200
+        ('D', 'E1', 'cancelada', Decimal('175')),   # no cuenta: no está activa
+        ('E', 'E2', 'activas', Decimal('120')),     # otro empleado
+        ('F', 'E1', 'activas', None),
+    )
+    assert rutas.hay_rutas()
+    assert rutas.maximo() == 200
+    assert rutas.existe(150) and rutas.existe(200)
+    assert not rutas.existe(149) and not rutas.existe(175) and not rutas.existe(120)
+    assert rutas.siguiente(100) == 150
+    assert rutas.siguiente(150) == 200
+    assert rutas.siguiente(200) is None
+    assert rutas.anterior(200) == 150
+    assert rutas.anterior(100) is None
+
+    assert _calcular_numero_ruta(rutas, 100, 150) == Decimal('125')
+    assert _calcular_numero_ruta(rutas) == Decimal('300')
+
+
+def test_sin_rutas_activas_en_postgres(tarjetas_pg):
+    rutas = tarjetas_pg(('A', 'E1', 'cancelada', Decimal('100')))
+    assert not rutas.hay_rutas()
+    assert rutas.maximo() is None
+    assert _calcular_numero_ruta(rutas, 100, 200) == Decimal('100')
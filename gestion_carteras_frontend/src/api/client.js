@@ -202,6 +202,15 @@ export const apiClient = {
     const params = new URLSearchParams({ estado, skip: String(skip), limit: String(limit) })
     return request(`/empleados/${encodeURIComponent(empleadoId)}/tarjetas/?${params.toString()}`, { method: 'GET' })
   },
+  // Descarga de ruta en una sola petición: tarjetas activas + cliente + abonos
+  getSnapshotEmpleado: async (empleadoId) => {
+    return request(`/empleados/${encodeURIComponent(empleadoId)}/snapshot`, { method: 'GET' })
+  },
+  // Solo los cambios de la ruta desde el sync_token de la última descarga
+  getCambiosEmpleado: async (empleadoId, since) => {
+    const params = new URLSearchParams({ since: String(since) })
+    return request(`/empleados/${encodeURIComponent(empleadoId)}/changes?${params.toString()}`, { method: 'GET' })
+  },
   getAbonosDiaByEmpleado: async (empleadoId, yyyyMmDd) => {
     return request(`/empleados/${encodeURIComponent(empleadoId)}/abonos/${yyyyMmDd}`, { method: 'GET' })
   },
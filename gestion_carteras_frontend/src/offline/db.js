@@ -118,6 +118,106 @@ async function resetWorkingMemory() {
   })
 }
 
+// --- Copia base de la ruta (datos del servidor + sync_token) ---
+// Vive en una BD aparte para sobrevivir a resetWorkingMemory: permite que la
+// siguiente descarga pida solo los cambios (/empleados/{id}/changes).
+const BASE_DB_NAME = 'carteras_ruta_base'
+const BASE_DB_VERSION = 1
+const BASE_STORE = 'rutas'
+
+let baseDbPromise
+
+function openBaseDB() {
+  if (baseDbPromise) return baseDbPromise
+  baseDbPromise = new Promise((resolve, reject) => {
+    const req = indexedDB.open(BASE_DB_NAME, BASE_DB_VERSION)
+    req.onupgradeneeded = () => {
+      const db = req.result
+      if (!db.objectStoreNames.contains(BASE_STORE)) db.createObjectStore(BASE_STORE)
+    }
+    req.onsuccess = () => resolve(req.result)
+    req.onerror = () => reject(req.error)
+  })
+  return baseDbPromise
+}
+
+async function getRutaBase(empleadoId) {
+  const db = await openBaseDB()
+  return new Promise((resolve, reject) => {
+    const tx = db.transaction(BASE_STORE, 'readonly')
+    const req = tx.objectStore(BASE_STORE).get(String(empleadoId))
+    req.onsuccess = () => resolve(req.result || null)
+    req.onerror = () => reject(req.error)
+  })
+}
+
+async function setRutaBase(empleadoId, token, tarjetas) {
+  const db = await openBaseDB()
+  return new Promise((resolve, reject) => {
+    const tx = db.transaction(BASE_STORE, 'readwrite')
+    const req = tx.objectStore(BASE_STORE).put({ token: token || null, tarjetas: tarjetas || [], ts: Date.now() }, String(empleadoId))
+    req.onsuccess = () => resolve()
+    req.onerror = () => reject(req.error)
+  })
+}
+
+function ordenarRuta(a, b) {
+  const ra = Number(a?.numero_ruta || 0)
+  const rb = Number(b?.numero_ruta || 0)
+  if (ra !== rb) return ra - rb
+  return String(a?.codigo || '').localeCompare(String(b?.codigo || ''))
+}
+
+function ordenarAbonos(a, b) {
+  return String(b?.fecha || '').localeCompare(String(a?.fecha || ''))
+}
+
+// Aplica la respuesta de /changes sobre la copia base del empleado.
+// Retorna la lista de tarjetas resultante (con abonos embebidos) o null si no hay base.
+async function applyRouteChanges(empleadoId, changes) {
+  const base = await getRutaBase(empleadoId)
+  if (!base || !Array.isArray(base.tarjetas)) return null
+  const porCodigo = new Map(base.tarjetas.map(t => [t.codigo, t]))
+  const eliminados = changes?.eliminados || {}
+
+  // 1. Tarjetas borradas / movidas, luego las modificadas (las no activas salen de la ruta)
+  for (const codigo of (eliminados.tarjetas || [])) porCodigo.delete(codigo)
+  for (const t of (changes?.tarjetas || [])) {
+    if (t?.estado === 'activas') porCodigo.set(t.codigo, t)
+    else porCodigo.delete(t?.codigo)
+  }
+
+  // 2. Abonos borrados y abonos nuevos/modificados de tarjetas no reemplazadas
+  const abonosBorrados = new Set((eliminados.abonos || []).map(a => a.id))
+  const abonosPorTarjeta = new Map()
+  for (const a of (changes?.abonos || [])) {
+    if (!abonosPorTarjeta.has(a.tarjeta_codigo)) abonosPorTarjeta.set(a.tarjeta_codigo, [])
+    abonosPorTarjeta.get(a.tarjeta_codigo).push(a)
+  }
+  for (const [codigo, t] of porCodigo) {
+    const nuevos = abonosPorTarjeta.get(codigo) || []
+    const lista = (t.abonos || []).filter(a => !abonosBorrados.has(a.id))
+    if (!nuevos.length && lista.length === (t.abonos || []).length) continue
+    const porId = new Map(lista.map(a => [a.id, a]))
+    for (const a of nuevos) porId.set(a.id, a)
+    porCodigo.set(codigo, { ...t, abonos: Array.from(porId.values()).sort(ordenarAbonos) })
+  }
+
+  // 3. Clientes modificados
+  const clientes = new Map((changes?.clientes || []).map(c => [c.identificacion, c]))
+  if (clientes.size) {
+    for (const [codigo, t] of porCodigo) {
+      const cli = clientes.get(t.cliente_identificacion)
+      if (cli) porCodigo.set(codigo, { ...t, cliente: { ...(t.cliente || {}), ...cli } })
+    }
+  }
+
+  const tarjetas = Array.from(porCodigo.values()).sort(ordenarRuta)
+  await setRutaBase(empleadoId, changes?.sync_token, tarjetas)
+  return tarjetas
+}
+
 export const offlineDB = {
   setTarjetas, getTarjetas, setStats, getStats, setAbonos, getAbonos, queueOperation, readOutbox, removeOutbox, readOutboxCount, resetWorkingMemory, close,
+  getRutaBase, setRutaBase, applyRouteChanges,
 }
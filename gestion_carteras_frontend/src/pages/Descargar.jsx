@@ -51,73 +51,32 @@ export default function DescargarPage() {
     }
   }
 
-  // Función auxiliar para procesar en lotes (concurrency limit)
-  async function processInBatches(items, batchSize, fn) {
-    const results = []
-    for (let i = 0; i < items.length; i += batchSize) {
-      const batch = items.slice(i, i + batchSize)
-      const batchResults = await Promise.all(batch.map(fn))
-      results.push(...batchResults)
-    }
-    return results
-  }
-
+  // Las tarjetas llegan del snapshot con su cliente completo y sus abonos embebidos:
+  // no se hacen peticiones adicionales por tarjeta.
   async function enrichTarjetasWithResumen(tarjetas) {
     const hoy = new Date()
     logDownload('tarjetas_raw', { total: tarjetas?.length || 0, sample: (tarjetas||[]).slice(0,3) })
-    
-    // Procesar en lotes de 5 para evitar saturación de red en Android y timeouts
-    const enriched = await processInBatches(tarjetas, 5, async (t) => {
-      // 1. Completar datos de cliente
-      try {
-        if (t?.cliente_identificacion) {
-          const needCliente = !t?.cliente?.nombre || !t?.cliente?.apellido || !t?.cliente?.telefono || !t?.cliente?.direccion
-          if (needCliente) {
-            // Reintentar obtención de cliente si falla
-            await retryOperation(async () => {
-              const cli = await apiClient.getClienteByIdentificacion(t.cliente_identificacion)
-              t.cliente = t.cliente || {}
-              t.cliente.nombre = cli?.nombre || t.cliente.nombre
-              t.cliente.apellido = cli?.apellido || t.cliente.apellido
-              t.cliente.telefono = cli?.telefono || t.cliente.telefono
-              t.cliente.direccion = cli?.direccion || t.cliente.direccion
-              t.telefono = t.telefono || cli?.telefono || t?.cliente?.telefono
-              t.cliente_telefono = t.cliente_telefono || cli?.telefono || t?.cliente?.telefono
-              if (!t?.cliente?.identificacion && t?.cliente_identificacion) t.cliente.identificacion = t.cliente_identificacion
-            }, 2, 500)
-            logDownload('cliente_completado', { tarjeta: t.codigo, cliente_identificacion: t.cliente_identificacion })
-          }
-        }
-      } catch (e) {
-        console.warn(`No se pudo completar info de cliente para ${t.codigo}`, e)
-        // No es crítico, continuamos
-      }
 
-      // 2. Obtener abonos (CRÍTICO: Con reintentos y fallo explícito)
-      let abonos = []
-      try {
-        abonos = await retryOperation(async () => {
-          return await apiClient.getAbonosByTarjeta(t.codigo)
-        }, 3, 1000) // 3 intentos, espera inicial 1s
-        
-        logDownload('abonos_tarjeta', { tarjeta: t.codigo, num: (abonos||[]).length })
-      } catch (err) {
-        // Si falla después de 3 reintentos, ES UN ERROR REAL DE RED.
-        // NO debemos asumir abonos=[], porque eso corrompe el saldo.
-        // Lanzamos el error para detener la descarga completa.
-        console.error(`Fallo crítico descargando abonos tarjeta ${t.codigo}`, err)
-        throw new Error(`Error de red descargando abonos de tarjeta ${t.codigo}. Revisa tu conexión.`)
-      }
+    const enriched = []
+    for (const raw of (tarjetas || [])) {
+      const { abonos: abonosRaw, ...t } = raw
+      // 1. Datos de cliente (ya completos en el snapshot)
+      const cli = t.cliente || {}
+      t.cliente = { ...cli, identificacion: cli.identificacion || t.cliente_identificacion }
+      t.telefono = t.telefono || cli.telefono
+      t.cliente_telefono = t.cliente_telefono || cli.telefono
+
+      // 2. Abonos: el snapshot siempre los trae (lista vacía si no hay)
+      const abonos = Array.isArray(abonosRaw) ? abonosRaw : []
+      logDownload('abonos_tarjeta', { tarjeta: t.codigo, num: abonos.length })
 
       // 3. Guardar abonos offline
       try { await offlineDB.setAbonos(t.codigo, abonos) } catch {}
-      
+
       // 4. Computar resumen
       const resumen = computeDerived(t, abonos, hoy)
-      const enrichedT = { ...t, resumen }
-      return enrichedT
-    })
-    
+      enriched.push({ ...t, resumen })
+    }
     return enriched
   }
 
@@ -216,8 +175,29 @@ export default function DescargarPage() {
         localStorage.setItem('jornada_started_at', String(now))
       } catch {}
       
-      const tarjetas = await apiClient.getTarjetasByEmpleado(id, 'activas')
-      logDownload('tarjetas_empleado', { empleado: id, total: tarjetas?.length || 0 })
+      // Si ya hay una copia base de la ruta, pedir solo los cambios desde su token
+      let tarjetas = null
+      try {
+        const base = await offlineDB.getRutaBase(id)
+        if (base?.token) {
+          const changes = await apiClient.getCambiosEmpleado(id, base.token)
+          if (changes && !changes.full_resync) {
+            tarjetas = await offlineDB.applyRouteChanges(id, changes)
+            logDownload('cambios_empleado', { empleado: id, tarjetas: changes?.tarjetas?.length || 0, abonos: changes?.abonos?.length || 0 })
+          }
+        }
+      } catch (e) {
+        if (e?.status === 401) throw e
+        console.warn('Descarga incremental no disponible, se descarga la ruta completa', e)
+        tarjetas = null
+      }
+      if (!tarjetas) {
+        // Una sola petición (gzip) con tarjetas, clientes y abonos de la ruta
+        const snapshot = await retryOperation(() => apiClient.getSnapshotEmpleado(id), 3, 1000)
+        tarjetas = Array.isArray(snapshot?.tarjetas) ? snapshot.tarjetas : []
+        try { await offlineDB.setRutaBase(id, snapshot?.sync_token, tarjetas) } catch {}
+      }
+      logDownload('tarjetas_empleado', { empleado: id, total: tarjetas.length })
       const enriched = await enrichTarjetasWithResumen(tarjetas)
       // Recaudado del día
       let stats = { monto: 0, abonos: 0 }